@@ -1,5 +1,5 @@
 import json
-from google import genai
+from utils.client_utils import generate_content
 # from IPython.display import display, Markdown # .pyファイルからは削除
 
 # ⬇️ [修正] 'SITE_TYPE' ( 'corporate' or 'personal' ) を引数として受け取る
@@ -51,7 +51,8 @@ def generate_corporate_identity(client, raw_input, SITE_TYPE='corporate'):
     """
 
     try:
-        response = client.models.generate_content(
+        response = generate_content(
+            client,
             model="gemini-2.5-flash",
             contents=prompt
         )
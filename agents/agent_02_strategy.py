@@ -1,7 +1,9 @@
 import re
 import json
-from google import genai
-from google.genai import types
+from utils.client_utils import generate_content, generate_json
+from utils.lazy_import import lazy_import
+
+types = lazy_import("google.genai.types")
 
 # ⬇️ [修正] SITE_TYPE を引数に追加
 def generate_final_sitemap(client, identity, SITE_TYPE='corporate'):
@@ -43,7 +45,8 @@ def generate_final_sitemap(client, identity, SITE_TYPE='corporate'):
 
     print("Geminiモデルで最終サイトマップの階層構造を生成しています...")
     try:
-        response = client.models.generate_content(
+        response = generate_content(
+            client,
             model="gemini-2.5-flash",
             contents=prompt
         )
@@ -103,7 +106,8 @@ def generate_content_strategy(client, identity, sitemap, SITE_TYPE='corporate'):
 
     print(f"Geminiモデルで {SITE_TYPE} 用のコンテンツ戦略を策定しています...")
     try:
-        response = client.models.generate_content(
+        response = generate_content(
+            client,
             model="gemini-2.5-flash",
             contents=prompt
         )
@@ -141,14 +145,14 @@ def generate_target_page_list(client, identity, strategy):
 
     print("\n📢 AIが戦略に基づき、ターゲットページリストを動的生成中...")
     try:
-        response = client.models.generate_content(
+        target_list = generate_json(
+            client,
             model="gemini-2.5-flash",
             contents=prompt_extract,
             config=types.GenerateContentConfig(
                 response_mime_type="application/json"
             )
         )
-        target_list = json.loads(response.text.strip())
         print(f"✅ ターゲットリストの抽出と構造化に成功しました ({len(target_list)} 件)。")
         return target_list
     except Exception as e:
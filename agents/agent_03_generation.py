@@ -2,62 +2,81 @@ import re
 import os
 import json
 import time
-import random
-from google import genai
-from google.genai import types
 from datetime import datetime
-try:
-    from config import settings
-except ImportError:
-    # settingsがない場合の簡易フォールバック（通常はありえない）
-    class MockSettings:
-        API_KEYS = []
-    settings = MockSettings()
+from utils.client_utils import generate_content
+from utils.stream_utils import stream_generate_content, partial_file_path
+from utils.nav_utils import build_nav_context
+from utils.context_cache import prepend_prefix, is_cache_access_error
+from utils.manifest_utils import fingerprint_inputs
+from utils.listing_utils import GRID_PLACEHOLDER, build_grid_html
+from utils.telemetry import scope as telemetry_scope
+from utils.retry_utils import RetryPolicy, InvalidOutputError, INVALID_OUTPUT, classify_error, get_retry_after
+from utils.lazy_import import lazy_import
+
+types = lazy_import("google.genai.types")
+
 try:
     from config.settings import MODEL_NAME_PRO, MODEL_NAME_GEN
 except ImportError:
     MODEL_NAME_PRO = "gemini-3-flash-preview"
     MODEL_NAME_GEN = "gemini-3-flash-preview"
+try:
+    from config.settings import STREAM_HTML_GENERATION, HTML_CONTINUATION_MAX_ROUNDS
+except ImportError:
+    STREAM_HTML_GENERATION = False
+    HTML_CONTINUATION_MAX_ROUNDS = 2
+try:
+    from config.settings import PROMPT_TEMPLATE_VERSION
+except ImportError:
+    PROMPT_TEMPLATE_VERSION = None
+
+# 続きの生成で、前回出力の末尾との重複を探す最大文字数
+CONTINUATION_OVERLAP_WINDOW = 2000
+# これより短い一致は偶然の一致とみなし、重複として取り除かない (例: "<p>hel" + "lo" の "l")
+CONTINUATION_MIN_OVERLAP = 32
+CONTINUATION_INSTRUCTION = (
+    "直前のあなたの出力は途中で途切れました。最後の文字の直後から、正確にその続きだけを出力してください。"
+    "既に出力した部分の繰り返し、前置き、説明、コードブロックの開始記号は一切不要です。"
+    "必ず </html> まで出力して終えてください。"
+)
+
+def page_input_fingerprint(target_page, identity, strategy_full, page_list, GTM_ID=None, ADSENSE_CLIENT_ID=None, SITE_TYPE='corporate', article_date=None, header_snippet=None, footer_snippet=None):
+    """
+    generate_single_page_html の出力を左右する入力 (アイデンティティ・戦略・ページ仕様・ナビゲーション・
+    記事カード・スニペット・モデル・プロンプトテンプレート版) の指紋を返す。
+    utils.manifest_utils.BuildManifest で、ページを再生成する必要があるかの判定に使う。
+    """
+    return fingerprint_inputs(
+        model=MODEL_NAME_GEN,
+        template_version=PROMPT_TEMPLATE_VERSION,
+        site_type=SITE_TYPE,
+        identity=identity,
+        strategy=strategy_full,
+        page=target_page,
+        nav=build_nav_context(target_page, page_list),
+        grid=build_grid_html(page_list),
+        snippets={"gtm": GTM_ID, "adsense": ADSENSE_CLIENT_ID, "header": header_snippet, "footer": footer_snippet},
+        article_date=article_date,
+    )
 
 # ⬇️ [修正] 引数に article_date=None を追加
-def generate_single_page_html(client, target_page, identity, strategy_full, page_list, GTM_ID=None, ADSENSE_CLIENT_ID=None, SITE_TYPE='corporate', retry_attempts=3, article_date=None, header_snippet=None, footer_snippet=None):
+def generate_single_page_html(client, target_page, identity, strategy_full, page_list, GTM_ID=None, ADSENSE_CLIENT_ID=None, SITE_TYPE='corporate', retry_attempts=3, article_date=None, header_snippet=None, footer_snippet=None, stream=None, prefix_cache=None, keep_grid_placeholder=False):
     """
     ターゲットページ情報に基づいてプロンプトを動的に生成し、HTMLファイルを出力する。
     GTMとAdSenseのスニペットを自動で挿入し、サイトタイプに応じてフッターを変更する。
+    stream=True (既定は settings.STREAM_HTML_GENERATION) の場合はストリーミングで受信し、
+    途中経過を一時ファイルに書き出しながら途切れ・停止を早期に検知する。
+    prefix_cache (utils.context_cache) を渡すと、全ページ共通のプレフィックスは再送せず、ページ固有の部分だけを送る。
+    keep_grid_placeholder=True の場合は GRID_PLACEHOLDER を置換せずに残す (一覧ページのシェルの生成用、utils.listing_utils)。
     """
     if client is None:
         return "❌ Geminiクライアントが利用できません。"
 
-    nav_structure = "\n".join([f' - {p.get("title", "N/A")} ({p.get("file_name", "N/A")})' for p in page_list])
+    # サイト全体ではなく、このページに必要なナビゲーションだけをトークン予算内で渡す
+    nav_structure = build_nav_context(target_page, page_list)
 
     # --- ⬇️ [追加] Python側でグリッドHTMLを生成して強制挿入する ---
-    grid_html = ""
-    if page_list:
-        grid_html += '<div class="grid grid-cols-1 md:grid-cols-2 gap-8">\n'
-        for page in page_list:
-            title = page.get('title', 'No Title')
-            # 目的が長い場合は丸める処理を入れてもいいが、一旦そのまま
-            desc = page.get('purpose', 'No Description')
-            # ファイル名からリンク先を特定 (相対パス計算は簡易的、同階層前提)
-            link = os.path.basename(page.get('file_name', '#'))
-            
-            # カテゴリ推定 (ディレクトリ名)
-            category = "Project"
-            if '/' in page.get('file_name', ''):
-                category = page.get('file_name', '').split('/')[0].capitalize()
-
-            grid_html += f"""
-            <!-- Article Card -->
-            <a href="{link}" class="block bg-brand-gray-800 rounded-lg p-6 hover:bg-brand-gray-700 hover:scale-105 transition-all duration-300 shadow-lg">
-                <div class="flex items-center mb-3">
-                    <span class="inline-block bg-brand-accent-500 text-brand-gray-900 text-xs font-semibold px-2.5 py-1 rounded-full">{category}</span>
-                </div>
-                <h3 class="text-xl font-bold text-white mb-2">{title}</h3>
-                <p class="text-brand-light-300 text-sm">{desc}</p>
-            </a>
-            """
-        grid_html += '</div>'
-    # --- ⬆️ [追加] ---
+    grid_html = GRID_PLACEHOLDER if keep_grid_placeholder else build_grid_html(page_list)
 
     target_title = target_page['title']
     target_filename = target_page['file_name']
@@ -105,18 +124,6 @@ def generate_single_page_html(client, target_page, identity, strategy_full, page
             snippet_instruction += f"- **FOOTER**: 以下のHTMLをフッターとしてそのまま使用してください:\n{footer_snippet}\n"
     # --- ⬆️ [追加] ---
 
-    content_focus = f"**このページの具体的な目的と、必要なコンテンツの詳細:** {target_purpose}\n"
-    if strategy_full:
-        content_focus += f"\n--- 全体戦略の要約 ---\n{strategy_full}"
-
-    # --- フッターの指示を動的に変更 ---
-    if SITE_TYPE == 'corporate':
-        footer_instruction = "フッターの著作権表記は、AIが生成した法人名（例: Quantalize Futures Inc.）にしてください。"
-        identity_label = "法人格フレームワーク"
-    else: # 'personal'
-        footer_instruction = "フッターの著作権表記は、**「LOU-Ark」**または**「LOU-Ark Portfolio」**にしてください。"
-        identity_label = "パーソナル・ブランド"
-
     # --- 日付の指示を生成 ---
     date_instruction = ""
     if article_date:
@@ -141,30 +148,15 @@ def generate_single_page_html(client, target_page, identity, strategy_full, page
     """
     # --- ⬆️ [追加] ---
 
-    prompt_template = f"""
-    あなたはワールドクラスのウェブデザイナーであり、フロントエンドエンジニアです。
-    以下の「{identity_label}」と「コンテンツ戦略」に基づき、**{target_title} ({target_filename}) 用の単一のモダンでレスポンシブなHTMLファイル**を生成してください。
-
-    ### CRITICAL INSTRUCTION: 出力形式の厳守
-    - **[START HTML CODE]** というマーカーからコードの記述を開始してください。
-    - **必ず** `<!DOCTYPE html>` から `</html>` まで、全てのHTML構造を完全に記述してください。
-    - **必ず** `\n```eof` で出力を完全に終了してください。（コードブロックは```htmlで開始してください）
-    - **CRITICAL:** 提供された「全ページリスト」の**全ての項目**に対して、必ずカード（またはリストアイテム）を作成してください。省略・要約は厳禁です。リストがN個あれば、N個のカードを出力してください。
+    # 全ページ共通のプレフィックス (役割・デザイン要件・アイデンティティ・戦略) と、ページ固有の部分に分けて組み立てる。
+    # prefix_cache がある場合、共通部分はキャッシュ済みコンテンツとして1度だけ送信される
+    prompt_prefix = build_page_prompt_prefix(identity, strategy_full, SITE_TYPE)
+    prompt_suffix = f"""
+    ### 生成対象のページ
+    **{target_title} ({target_filename}) 用の単一のモダンでレスポンシブなHTMLファイル**を生成してください。
 
-    ### デザイン・フォーマット要件 (DESIGN REQUIREMENTS)
-    1.  **全体の雰囲気:** 背景は深みのあるダークモード (`bg-gray-900`)、テキストは読みやすいグレー (`text-gray-300`) を基調とします。
-    2.  **タイポグラフィ:** Google Fonts の 'Inter' をメイン、『Roboto Mono』を等幅フォントとして使用してください。
-    3.  **グラデーション:** 強調箇所やテキストには `#2dd4bf` (teal-400) から `#38bdf8` (blue-400) へのグラデーション (`gradient-text`) を使用してください。
-    4.  **ヘッダー/フッター:** 
-        - ヘッダーは `bg-gray-900/80 backdrop-blur-sm sticky top-0`。
-        - ロゴテキストは `LOU-Ark`。
-        - フッターにはサイトマップと著作権表記（© 2025 LOU-Ark Portfolio.）を含めてください。
-    5.  **記事構造:**
-        - パンくずリストを設置（ホーム > セクション名 > 記事タイトル）。リンクは相対パスで。
-        - 記事ヘッダーにはタグ（例：Looker Studio, GA4）をバッジ形式で配置。
-        - タイトルの下に「公開日: YYYY年MM月DD日」を配置。
-        - 本文は `prose prose-lg prose-invert max-w-none` クラスを適用した `div` 内に記述してください。
-    6.  **ナビゲーション:**
+    ### ページ固有の要件
+    1.  **ナビゲーション:**
         - 現在のファイルパス `{target_filename}` に基づき、`../index.html` などの相対パスを正確に生成してください。
     {gtm_instructions}
     {adsense_instructions} 
@@ -174,12 +166,9 @@ def generate_single_page_html(client, target_page, identity, strategy_full, page
     ### ページ固有の入力データ
     - ページのタイトル: {target_title}
     - ページのファイル名: {target_filename}
-    - ページの目的: {target_purpose}
-
-    ### 全体的な入力データ
-    - {identity_label}: {identity}
-    - コンテンツ戦略（コンテンツ焦点）：{content_focus}
-    - 確定した全ページリスト（ナビゲーション構造）:{nav_structure}
+    - ページの目的（必要なコンテンツの詳細）: {target_purpose}
+    - 確定した全ページリスト（ナビゲーション構造）:
+{nav_structure}
     
     ### CRITICAL: 記事一覧エリアのプレースホルダー
     **記事一覧（カードのグリッド）を描画する場所には、以下のプレースホルダーのみを記述してください。**
@@ -199,66 +188,249 @@ def generate_single_page_html(client, target_page, identity, strategy_full, page
 
     [START HTML CODE]
     """
+    if prefix_cache is not None and not prefix_cache.matches(prompt_prefix, MODEL_NAME_GEN):
+        print(f"  ⚠️ 共通プレフィックスがキャッシュと一致しないため、キャッシュを使わずに送信します。 for {target_filename}")
+        prefix_cache = None
+
+    # API エラー (レート制限・過負荷) は generate_content 内で再試行されるため、
+    # このループでは「応答は返ったが完全なHTMLではなかった」場合だけを同じポリシーで再試行する
+    retry_policy = RetryPolicy.from_settings(max_attempts=retry_attempts)
+    if stream is None:
+        stream = STREAM_HTML_GENERATION
+    generation_config = types.GenerateContentConfig(max_output_tokens=65536)
+    # ストリーミング中の出力の書き出し先。続きの生成は回ごとに別のファイル (.cont1, .cont2, ...) に書き、
+    # 最初の応答の途中経過を上書きしないようにする
+    partial_paths = []
+
+    def request_text(contents, round_index=None):
+        partial_path = None
+        if stream:
+            suffix = "" if round_index is None else f".cont{round_index + 1}"
+            partial_path = partial_file_path(target_filename + suffix)
+            partial_paths.append(partial_path)
+        # テレメトリのイベントに対象ページを記録する
+        with telemetry_scope(page=target_filename):
+            return send_request(contents, partial_path)
+
+    def send_request(contents, partial_path):
+        # contents はページ固有の部分から始まる (共通プレフィックスは prefix_cache 側で付与・参照する)
+        if prefix_cache is None:
+            return send_contents_request(prepend_prefix(prompt_prefix, contents), generation_config, None, partial_path)
+        send_contents, send_config = prefix_cache.apply(contents, generation_config)
+        key_parts = (prefix_cache.key_contents(contents), generation_config)
+        try:
+            return send_contents_request(send_contents, send_config, key_parts, partial_path)
+        except Exception as e:
+            # キャッシュ済みコンテンツは作成したキーにしか見えないため、キーの切り替え後は 403 / 404 になる。
+            # その場合はプレフィックスを前置して (キャッシュを使わずに) 送り直す
+            if not prefix_cache.remote or not is_cache_access_error(e):
+                raise
+            print(f"  ⚠️ キャッシュ済みコンテンツを参照できないため、プレフィックスを前置して再送します: {e} for {target_filename}")
+            return send_contents_request(prepend_prefix(prompt_prefix, contents), generation_config, key_parts,
+                                         partial_path, record_prefix_use=False)
+
+    def send_contents_request(send_contents, send_config, key_parts, partial_path, record_prefix_use=True):
+        record_prefix_use = record_prefix_use and prefix_cache is not None
+        if stream:
+            # ストリーミング: 受信したチャンクを一時ファイルに書き出しつつ、途切れ・停止をその場で検知する
+            result = stream_generate_content(
+                client,
+                model=MODEL_NAME_GEN,
+                contents=send_contents,
+                config=send_config,
+                partial_path=partial_path,
+                retry_policy=retry_policy,
+                cache_key_parts=key_parts
+            )
+            print(f"  📶 {result.summary()} for {target_filename}")
+            if record_prefix_use and not result.from_cache:
+                prefix_cache.record_use(result.usage_metadata)
+            # 続きの生成で継ぎ目の空白が失われないよう、strip せずに返す
+            return result.text
+        response = generate_content(
+            client,
+            model=MODEL_NAME_GEN, # 生成用モデルを使用
+            contents=send_contents,
+            config=send_config,
+            # </html> まで出力された応答だけをキャッシュする (途中で切れた応答は再利用しない)
+            cache_if=lambda text: "</html>" in text,
+            retry_policy=retry_policy,
+            cache_key_parts=key_parts
+        )
+        if record_prefix_use and not getattr(response, 'from_cache', False):
+            prefix_cache.record_use(getattr(response, 'usage_metadata', None))
+        return response.text
 
     for attempt in range(retry_attempts):
         print(f"  > HTMLコードの生成を開始中... (試行 {attempt + 1}/{retry_attempts}) for {target_filename}")
         try:
-            response = client.models.generate_content(
-                model=MODEL_NAME_GEN, # 生成用モデルを使用
-                contents=prompt_template,
-                config=types.GenerateContentConfig(max_output_tokens=65536)
-            )
-            raw_output = response.text.strip()
-            
-            # --- ⬇️ [追加] プレースホルダーをPython生成のグリッドに置換 (最優先) ---
-            if "<!-- GRID_PLACEHOLDER -->" in raw_output:
-                print("  > プレースホルダーを検知しました。グリッドHTMLと置換します。")
-                raw_output = raw_output.replace("<!-- GRID_PLACEHOLDER -->", grid_html)
-            elif grid_html:
-                # プレースホルダーがない場合、強制的に mainの終わりの前などに挿入を試みるか、
-                # または AIが指示を無視した場合のリスクヘッジとして警告を出す
-                print("  ⚠️ 警告: GRID_PLACEHOLDER が検出されませんでした。AIが記事リストを自作した可能性があります。")
-            # --- ⬆️ [追加] ---
-
-            # より柔軟な抽出ロジック
-
-            # より柔軟な抽出ロジック
-            # 1. ```html ... ``` を探す
-            match = re.search(r"```html\s*(.*?)\s*(?:```|$)", raw_output, re.DOTALL)
-            if match:
-                html_candidate = match.group(1).strip()
-                if "</html>" in html_candidate:
-                    return html_candidate
-
-            # 2. マーカーがない場合、<html>...</html> を直接探す
-            match = re.search(r"(<!DOCTYPE html>.*?</html>)", raw_output, re.DOTALL | re.IGNORECASE)
-            if match:
-                return match.group(1).strip()
-            
-            # 3. それでもダメで </html> で終わっているなら、マーカー類を削って返す
-            if "</html>" in raw_output:
-                clean_html = re.sub(r"^[^{]*\[START HTML CODE\]", "", raw_output, flags=re.DOTALL).strip()
-                clean_html = re.sub(r"```.*$", "", clean_html, flags=re.DOTALL).strip()
-                return clean_html
+            raw_output = request_text(prompt_suffix)
+
+            # 途中で切れている場合は、全体を作り直す前に「続きの生成」で補完を試みる
+            if is_truncated_html(raw_output):
+                raw_output = continue_truncated_html(request_text, prompt_suffix, raw_output, target_filename)
+
+            html = extract_html(raw_output, grid_html)
+            if html:
+                for partial_path in set(partial_paths):
+                    if os.path.exists(partial_path):
+                        os.remove(partial_path)
+                return html
 
             print(f"警告: 有効なHTML構造が見つかりませんでした。 for {target_filename}")
+            error = InvalidOutputError(f"有効なHTML構造が見つかりませんでした ({target_filename})")
 
         except Exception as e:
             print(f"エラーが発生しました: {e} for {target_filename}")
-            
-            # --- [追加] 自動フェイルオーバー (APIキーローテーション) ---
-            # エラー時、次の試行のためにクライアントを別のキーで再構築する
-            if hasattr(settings, 'API_KEYS') and settings.API_KEYS and len(settings.API_KEYS) > 1:
-                # ランダムにキーを選択 (確率的に回避)
-                new_key = random.choice(settings.API_KEYS)
-                print(f"  ↻ Switching to a new API Key for retry... (****{new_key[-4:]})")
-                try:
-                    client = genai.Client(api_key=new_key)
-                except Exception as client_err:
-                    print(f"  ⚠️ Failed to switch client: {client_err}")
-            # ----------------------------------------------------
-
-            if attempt < retry_attempts - 1:
-                time.sleep(5) # ローテーション時は待ち時間短縮でOK
-            else:
-                return f"❌ HTMLコードの生成に失敗しました。\nError: {e}"
+            error = e
+
+        category = classify_error(error)
+        # FATAL、または generate_content 内で再試行し尽くした API エラーはここで諦める
+        if category != INVALID_OUTPUT or not retry_policy.should_retry(category, attempt):
+            return f"❌ HTMLコードの生成に失敗しました。\nError: {error}"
+        delay = retry_policy.compute_delay(attempt, category, get_retry_after(error))
+        print(f"  ⏳ {delay:.1f} 秒後に再生成します ({category})")
+        time.sleep(delay)
+
+    return f"❌ HTMLコードの生成に失敗しました。 ({target_filename})"
+
+def build_page_prompt_prefix(identity, strategy_full, SITE_TYPE='corporate'):
+    """
+    ページ生成プロンプトのうち、同じ実行内の全ページで共通の部分 (役割・出力形式・デザイン要件・
+    アイデンティティ・全体戦略) を返す。ページ固有の情報は含めないこと (キャッシュが無効になるため)。
+    """
+    identity_label = "法人格フレームワーク" if SITE_TYPE == 'corporate' else "パーソナル・ブランド"
+    content_focus = ""
+    if strategy_full:
+        content_focus = f"\n    - コンテンツ戦略（全体戦略の要約）：\n{strategy_full}\n"
+
+    return f"""
+    あなたはワールドクラスのウェブデザイナーであり、フロントエンドエンジニアです。
+    以下の「{identity_label}」と「コンテンツ戦略」に基づき、後半で指定するページ用の**単一のモダンでレスポンシブなHTMLファイル**を生成してください。
+
+    ### CRITICAL INSTRUCTION: 出力形式の厳守
+    - **[START HTML CODE]** というマーカーからコードの記述を開始してください。
+    - **必ず** `<!DOCTYPE html>` から `</html>` まで、全てのHTML構造を完全に記述してください。
+    - **必ず** `\n```eof` で出力を完全に終了してください。（コードブロックは```htmlで開始してください）
+    - **CRITICAL:** 提供された「全ページリスト」の**全ての項目**に対して、必ずカード（またはリストアイテム）を作成してください。省略・要約は厳禁です。リストがN個あれば、N個のカードを出力してください。
+
+    ### デザイン・フォーマット要件 (DESIGN REQUIREMENTS)
+    1.  **全体の雰囲気:** 背景は深みのあるダークモード (`bg-gray-900`)、テキストは読みやすいグレー (`text-gray-300`) を基調とします。
+    2.  **タイポグラフィ:** Google Fonts の 'Inter' をメイン、『Roboto Mono』を等幅フォントとして使用してください。
+    3.  **グラデーション:** 強調箇所やテキストには `#2dd4bf` (teal-400) から `#38bdf8` (blue-400) へのグラデーション (`gradient-text`) を使用してください。
+    4.  **ヘッダー/フッター:** 
+        - ヘッダーは `bg-gray-900/80 backdrop-blur-sm sticky top-0`。
+        - ロゴテキストは `LOU-Ark`。
+        - フッターにはサイトマップと著作権表記（© 2025 LOU-Ark Portfolio.）を含めてください。
+    5.  **記事構造:**
+        - パンくずリストを設置（ホーム > セクション名 > 記事タイトル）。リンクは相対パスで。
+        - 記事ヘッダーにはタグ（例：Looker Studio, GA4）をバッジ形式で配置。
+        - タイトルの下に「公開日: YYYY年MM月DD日」を配置。
+        - 本文は `prose prose-lg prose-invert max-w-none` クラスを適用した `div` 内に記述してください。
+
+    ### 全体的な入力データ
+    - {identity_label}: {identity}{content_focus}
+    """
+
+def is_truncated_html(raw_output):
+    """HTML文書が始まっているのに </html> で閉じられていない (出力が途中で切れた) かを返す。"""
+    lowered = raw_output.lower()
+    return ("<!doctype html" in lowered or "<html" in lowered) and "</html>" not in lowered
+
+def stitch_continuation(partial, continuation):
+    """
+    途中で切れた出力 partial に続きの出力 continuation を継ぎ足す。
+    - 続きの先頭に付いたコードブロック記号は取り除く
+    - 続きが partial の末尾を CONTINUATION_MIN_OVERLAP 文字以上繰り返している場合は重複部分を取り除く
+    - 継ぎ目の空白を保つため、partial と continuation は strip せずに渡すこと
+    - モデルが文書を最初から書き直した場合は、続きの方をそのまま採用する
+    """
+    continuation = re.sub(r"^\s*```(?:html)?[ \t]*\n", "", continuation)
+    if re.match(r"\s*<!DOCTYPE html", continuation, re.IGNORECASE):
+        return continuation
+    max_overlap = min(len(partial), len(continuation), CONTINUATION_OVERLAP_WINDOW)
+    for size in range(max_overlap, CONTINUATION_MIN_OVERLAP - 1, -1):
+        if partial.endswith(continuation[:size]):
+            continuation = continuation[size:]
+            break
+    return partial + continuation
+
+def is_valid_stitched_html(html):
+    """継ぎ足した結果が1つの完結したHTML文書になっているかを簡易的に検証する。"""
+    lowered = html.lower()
+    if lowered.count("<!doctype html") > 1 or "</html>" not in lowered:
+        return False
+    for tag in ("head", "body"):
+        if len(re.findall(rf"<{tag}[\s>]", lowered)) != lowered.count(f"</{tag}>"):
+            return False
+    return True
+
+def continue_truncated_html(request_text, prompt_template, partial, target_filename, max_rounds=None):
+    """
+    途中で切れたHTMLの続きを生成させ、継ぎ足した出力を返す。
+    元のプロンプトと途中までの出力をモデルの発話として渡し、「続きだけ」を出力させるため、
+    全体を再生成するよりも出力トークンが大幅に少なく済む。
+    request_text(contents, round_index=i) は i 回目 (0始まり) の続きの生成を送信し、テキストを返す。
+    max_rounds 回続けても完結しない、または継ぎ目の検証に失敗した場合は元の partial を返す
+    (呼び出し側は通常の再生成にフォールバックする)。
+    """
+    max_rounds = HTML_CONTINUATION_MAX_ROUNDS if max_rounds is None else max_rounds
+    stitched = partial
+    for round_index in range(max_rounds):
+        print(f"  ↪ 出力が途中で切れています。続きを生成します ({round_index + 1}/{max_rounds}) for {target_filename}")
+        contents = [
+            {"role": "user", "parts": [{"text": prompt_template}]},
+            {"role": "model", "parts": [{"text": stitched}]},
+            {"role": "user", "parts": [{"text": CONTINUATION_INSTRUCTION}]},
+        ]
+        try:
+            continuation = request_text(contents, round_index=round_index)
+        except Exception as e:
+            print(f"  ⚠️ 続きの生成に失敗しました: {e}")
+            return partial
+        if not continuation or not continuation.strip():
+            return partial
+        stitched = stitch_continuation(stitched, continuation)
+        if not is_truncated_html(stitched):
+            if is_valid_stitched_html(stitched):
+                print(f"  ✅ 続きの生成で HTML を補完しました ({len(partial)} → {len(stitched)} 文字)")
+                return stitched
+            print(f"  ⚠️ 継ぎ足したHTMLの構造検証に失敗しました。全体を再生成します。")
+            return partial
+    return partial
+
+def extract_html(raw_output, grid_html=""):
+    """
+    モデルの出力からHTML文書を取り出す。GRID_PLACEHOLDER があれば grid_html に置換する。
+    </html> まで揃った文書が見つからない場合は None を返す。
+    """
+    # --- ⬇️ [追加] プレースホルダーをPython生成のグリッドに置換 (最優先) ---
+    if GRID_PLACEHOLDER in raw_output:
+        print("  > プレースホルダーを検知しました。グリッドHTMLと置換します。")
+        raw_output = raw_output.replace(GRID_PLACEHOLDER, grid_html)
+    elif grid_html:
+        # プレースホルダーがない場合、強制的に mainの終わりの前などに挿入を試みるか、
+        # または AIが指示を無視した場合のリスクヘッジとして警告を出す
+        print("  ⚠️ 警告: GRID_PLACEHOLDER が検出されませんでした。AIが記事リストを自作した可能性があります。")
+    # --- ⬆️ [追加] ---
+
+    # より柔軟な抽出ロジック
+    # 1. ```html ... ``` を探す
+    match = re.search(r"```html\s*(.*?)\s*(?:```|$)", raw_output, re.DOTALL)
+    if match:
+        html_candidate = match.group(1).strip()
+        if "</html>" in html_candidate:
+            return html_candidate
+
+    # 2. マーカーがない場合、<html>...</html> を直接探す
+    match = re.search(r"(<!DOCTYPE html>.*?</html>)", raw_output, re.DOTALL | re.IGNORECASE)
+    if match:
+        return match.group(1).strip()
+    
+    # 3. それでもダメで </html> で終わっているなら、マーカー類を削って返す
+    if "</html>" in raw_output:
+        clean_html = re.sub(r"^[^{]*\[START HTML CODE\]", "", raw_output, flags=re.DOTALL).strip()
+        clean_html = re.sub(r"```.*$", "", clean_html, flags=re.DOTALL).strip()
+        return clean_html
+
+    return None
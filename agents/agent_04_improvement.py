@@ -1,37 +1,123 @@
 import os
 import re
 import json
-import pandas as pd
-from bs4 import BeautifulSoup
-from google import genai
-from google.genai import types
+import importlib.util
+import threading
+from utils.client_utils import generate_content, generate_json
+from utils.cache_utils import FileResultCache
+from utils.lazy_import import lazy_import
+
+# pandas / bs4 / google.genai は使う関数が呼ばれるまで読み込まない
+pd = lazy_import("pandas")
+bs4 = lazy_import("bs4")
+types = lazy_import("google.genai.types")
+
 try:
     from config.settings import MODEL_NAME_PRO
 except ImportError:
     MODEL_NAME_PRO = "gemini-3-flash-preview"
+try:
+    from config import settings
+except ImportError:
+    settings = None
+
+# 1回のパースで取り出すための定数
+_EXCLUDED_TAGS = frozenset(["script", "style", "nav", "header", "footer"])
+_HEADING_TAGS = ("h1", "h2", "h3")
+EXCERPT_CHARS = 500
+# 抽出ロジックを変えたときに上げると、解析結果キャッシュが無効になる
+ARTICLE_STRUCTURE_VERSION = "2"
+
+# lxml は import せずに有無だけを確認する
+HTML_PARSER = "lxml" if importlib.util.find_spec("lxml") else "html.parser"
+
+_STRUCTURE_CACHE = None
+_STRUCTURE_CACHE_LOCK = threading.Lock()
+
+def get_article_structure_cache():
+    """settings に基づいて作成した、記事構造の解析結果のキャッシュ (プロセス共通) を返す。"""
+    global _STRUCTURE_CACHE
+    with _STRUCTURE_CACHE_LOCK:
+        if _STRUCTURE_CACHE is None:
+            cache_root = getattr(settings, 'CACHE_DIR', '.cache')
+            _STRUCTURE_CACHE = FileResultCache(
+                os.path.join(cache_root, "article_structure"),
+                version=f"{ARTICLE_STRUCTURE_VERSION}:{HTML_PARSER}",
+                enabled=getattr(settings, 'ARTICLE_STRUCTURE_CACHE_ENABLED', True),
+            )
+        return _STRUCTURE_CACHE
+
+def extract_article_structure(content, fallback_title):
+    """
+    HTML を1回だけパースし、1回の走査でタイトル・<main> 内の h1〜h3・本文抜粋を取り出す。
+    本文は script/style/nav/header/footer を除いたテキストで、抜粋に必要な長さに達した時点で収集をやめる。
+    """
+    soup = bs4.BeautifulSoup(content, HTML_PARSER)
+    NavigableString, Tag = bs4.NavigableString, bs4.Tag
+    skipped_strings = (bs4.Comment, bs4.Declaration, bs4.Doctype, bs4.ProcessingInstruction)
+    title = None
+    headings = []
+    texts = []
+    text_length = 0
+    main_found = False
+
+    # 再帰の深さに依存しないよう、子要素のイテレータのスタックで文書順に走査する
+    stack = [(iter(soup.children), False)]
+    while stack:
+        children, in_main = stack[-1]
+        node = next(children, None)
+        if node is None:
+            stack.pop()
+            continue
+        if isinstance(node, NavigableString):
+            if text_length <= EXCERPT_CHARS and not isinstance(node, skipped_strings):
+                text = node.strip()
+                if text:
+                    texts.append(text)
+                    text_length += len(text) + 1
+            continue
+        if not isinstance(node, Tag):
+            continue
+
+        name = node.name
+        if name == "title" and title is None:
+            title = node.get_text()
+        if in_main and name in _HEADING_TAGS:
+            headings.append(f"<{name}> {node.get_text().strip()}")
+        child_in_main = in_main
+        if name == "main" and not main_found:
+            main_found = True
+            child_in_main = True
+        if name in _EXCLUDED_TAGS:
+            # 本文からは除くが、<main> 内の <header> にある見出しは構造として残す
+            if child_in_main:
+                headings.extend(f"<{h.name}> {h.get_text().strip()}" for h in node.find_all(_HEADING_TAGS))
+            continue
+        stack.append((iter(node.children), child_in_main))
+
+    clean_text = "\n".join(texts)
+    page_title = title if title is not None else fallback_title
+    return {
+        "page_title": page_title.split('|')[0].strip(),
+        "structure": "\n".join(headings),
+        "full_text_excerpt": clean_text[:EXCERPT_CHARS].replace('\n', ' ').strip() + "..."
+    }
 
-# (analyze_article_structure, generate_article_purpose は変更なし)
 def analyze_article_structure(file_path):
-    """HTMLファイルを読み込み、タイトル、見出し構造、本文テキストを抽出する。"""
+    """
+    HTMLファイルを読み込み、タイトル、見出し構造、本文テキストを抽出する。
+    結果はファイルのパス・mtime・サイズをキーにキャッシュし、ファイルが変わっていなければ再解析しない。
+    """
+    cache = get_article_structure_cache()
     try:
+        cached = cache.get(file_path)
+        if cached is not None:
+            return cached, None
         with open(file_path, 'r', encoding='utf-8') as f:
             content = f.read()
-            soup = BeautifulSoup(content, 'html.parser')
-        page_title = soup.find('title').get_text() if soup.find('title') else os.path.basename(file_path)
-        main_content_area = soup.find('main')
-        temp_soup = BeautifulSoup(content, 'html.parser')
-        for tag in temp_soup.find_all(["script", "style", "nav", "header", "footer"]):
-            tag.decompose()
-        headings = []
-        if main_content_area:
-            for tag in main_content_area.find_all(['h1', 'h2', 'h3']):
-                headings.append(f"<{tag.name}> {tag.get_text().strip()}")
-        clean_text = temp_soup.get_text(separator='\n', strip=True)
-        return {
-            "page_title": page_title.split('|')[0].strip(),
-            "structure": "\n".join(headings),
-            "full_text_excerpt": clean_text[:500].replace('\n', ' ').strip() + "..."
-        }, None
+        article_data = extract_article_structure(content, os.path.basename(file_path))
+        cache.put(file_path, article_data)
+        return article_data, None
     except Exception as e:
         return None, f"❌ 解析エラー: {e}"
 
@@ -51,7 +137,8 @@ def generate_article_purpose(client, article_data, identity):
     生成するPurpose (1文):
     """
     try:
-        response = client.models.generate_content(
+        response = generate_content(
+            client,
             model="gemini-2.5-flash",
             contents=prompt
         )
@@ -106,12 +193,12 @@ def select_priority_section_by_data(client, df_all_data, identity, target_pages_
     """
 
     try:
-        response = client.models.generate_content(
+        parsed_json = generate_json(
+            client,
             model="gemini-2.5-flash",
             contents=prompt,
             config=types.GenerateContentConfig(response_mime_type="application/json")
         )
-        parsed_json = json.loads(response.text.strip().replace("```json", "").replace("```", ""))
         if any(p.get('file_name') == parsed_json.get('file_name') for p in target_pages_list):
             return parsed_json
         else:
@@ -156,12 +243,15 @@ def generate_priority_article_titles(client, section_info, identity, count, star
 
     print(f"📢 AIに {section_info['title']} セクション用の記事 {count} 件の企画を依頼中...")
     try:
-        response = client.models.generate_content(
+        # 壊れたJSONやレート制限は generate_json 内の共通リトライポリシーで再試行される
+        parsed_list = generate_json(
+            client,
             model=MODEL_NAME_PRO,
             contents=prompt,
-            config=types.GenerateContentConfig(response_mime_type="application/json")
+            config=types.GenerateContentConfig(response_mime_type="application/json"),
+            # 空のリストは企画の失敗として再生成する (キャッシュもしない)
+            validate=lambda plans: isinstance(plans, list) and len(plans) > 0
         )
-        parsed_list = json.loads(response.text.strip().replace("```json", "").replace("```", ""))
         print("✅ 記事企画の生成に成功しました。")
         return "", parsed_list
     except Exception as e:
@@ -0,0 +1,128 @@
+"""
+エントリポイントの起動時間 (import 時間) のベンチマーク。
+
+各エントリポイントを `python -X importtime -c "import <モジュール>"` で子プロセスとして import し、
+累積 import 時間の中央値が予算 (ミリ秒) を超えていないか、読み込むべきでない重いモジュール
+(google.genai / pandas / numpy / bs4 / requests) を読み込んでいないかを確認する。
+
+使い方 (リポジトリのルートで実行):
+    python -m benchmarks.import_time
+    python -m benchmarks.import_time --entry-points tools.check_links,tools.update_listings --repeat 10
+
+予算の超過、または重いモジュールの読み込みがあれば終了コード 1 で終了する (CI 用)。
+"""
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# エントリポイントごとの累積 import 時間の予算 (ミリ秒)。
+# どれも重いライブラリは LLM の呼び出しや HTML の解析を始めた時点で読み込むため、import だけなら数十ミリ秒で済む
+BUDGETS_MS = {
+    "tools.check_links": 150,
+    "tools.fix_links": 150,
+    "tools.update_listings": 200,
+    "tools.add_article": 200,
+    "main_03_inject_tags": 150,
+    "main_01_initial_build": 250,
+    "main_02_improvement_cycle": 250,
+}
+# import しただけでは読み込まれてはならないモジュール
+HEAVY_MODULES = ("google.genai", "pandas", "numpy", "bs4", "requests")
+DEFAULT_REPEAT = 5
+
+
+def parse_importtime(stderr):
+    """-X importtime の出力を {モジュール名: (自身の時間, 累積時間, 入れ子の深さ)} に変換する (時間はマイクロ秒)。"""
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = line[len("import time:"):].split("|")
+        if len(fields) != 3 or not fields[0].strip().isdigit():
+            continue  # 見出し行
+        name = fields[2].rstrip()
+        depth = (len(name) - len(name.lstrip())) // 2
+        modules[name.strip()] = (int(fields[0]), int(fields[1]), depth)
+    return modules
+
+
+def measure(module_name):
+    """module_name を新しいプロセスで1回 import し、(累積 import 時間 [ミリ秒], 読み込まれたモジュール名の集合) を返す。"""
+    env = dict(os.environ)
+    env["PYTHONPATH"] = ROOT_DIR + os.pathsep + env.get("PYTHONPATH", "")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module_name}"],
+        cwd=ROOT_DIR, env=env, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"{module_name} の import に失敗しました:\n{result.stderr[-2000:]}")
+    modules = parse_importtime(result.stderr)
+    if module_name not in modules:
+        raise RuntimeError(f"{module_name} の import 時間が出力に見つかりません")
+    return modules[module_name][1] / 1000, set(modules)
+
+
+def run(entry_points, repeat=DEFAULT_REPEAT, scale=1.0):
+    """各エントリポイントを repeat 回計測し、結果のリストを返す (1件ごとに budget_exceeded / heavy_modules を含む)。"""
+    results = []
+    for module_name in entry_points:
+        samples = []
+        loaded = set()
+        for _ in range(repeat):
+            elapsed_ms, modules = measure(module_name)
+            samples.append(elapsed_ms)
+            loaded |= modules
+        budget_ms = BUDGETS_MS.get(module_name)
+        budget_ms = budget_ms * scale if budget_ms is not None else None
+        median_ms = statistics.median(samples)
+        heavy = sorted(name for name in HEAVY_MODULES if name in loaded)
+        results.append({
+            "module": module_name,
+            "median_ms": round(median_ms, 1),
+            "min_ms": round(min(samples), 1),
+            "budget_ms": budget_ms,
+            "budget_exceeded": budget_ms is not None and median_ms > budget_ms,
+            "heavy_modules": heavy,
+        })
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="エントリポイントの import 時間が予算内か確認する")
+    parser.add_argument("--entry-points", default=",".join(BUDGETS_MS), help="計測するモジュール (カンマ区切り)")
+    parser.add_argument("--repeat", type=int, default=DEFAULT_REPEAT, help="1モジュールあたりの計測回数 (中央値を使う)")
+    parser.add_argument("--scale", type=float, default=1.0, help="予算に掛ける倍率 (遅いCI環境向け)")
+    parser.add_argument("--json", dest="json_file", help="結果を JSON で書き出すパス")
+    args = parser.parse_args(argv)
+
+    entry_points = [name.strip() for name in args.entry_points.split(",") if name.strip()]
+    results = run(entry_points, max(1, args.repeat), args.scale)
+
+    print(f"{'module':<30} {'median':>9} {'min':>9} {'budget':>9}  heavy modules")
+    failed = False
+    for r in results:
+        budget = f"{r['budget_ms']:.0f} ms" if r["budget_ms"] is not None else "-"
+        mark = "❌" if r["budget_exceeded"] or r["heavy_modules"] else "✅"
+        print(f"{r['module']:<30} {r['median_ms']:>6.1f} ms {r['min_ms']:>6.1f} ms {budget:>9}  "
+              f"{', '.join(r['heavy_modules']) or '-'} {mark}")
+        failed = failed or r["budget_exceeded"] or bool(r["heavy_modules"])
+
+    if args.json_file:
+        with open(args.json_file, "w", encoding="utf-8") as f:
+            json.dump({"python": sys.version.split()[0], "results": results}, f, ensure_ascii=False, indent=2)
+        print(f"📝 JSON: {args.json_file}")
+
+    if failed:
+        print("\n⚠️ 起動時間の予算超過、または重いモジュールの読み込みがあります。")
+        return 1
+    print("\n✅ 全てのエントリポイントが予算内です。")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
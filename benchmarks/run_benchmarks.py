@@ -0,0 +1,348 @@
+"""
+パイプライン全体のベンチマーク。
+
+フェイクの Gemini バックエンド (utils/fake_client.py) と架空の docs/ ツリー (benchmarks/synthetic_site.py) を使い、
+main_01 / main_02 / main_03 / tools/update_listings / tools/check_links をネットワークなしで実行して、
+壁時計時間・フェーズごとの時間・ピークRSS・リクエスト数を計測する。
+
+使い方 (リポジトリのルートで実行):
+    python -m benchmarks.run_benchmarks --sizes 100,1000 --scenarios main_03,check_links
+    python -m benchmarks.run_benchmarks --latency lognormal:-1,0.5 --baseline benchmarks/results/xxx.json
+
+各シナリオは独立した子プロセスで実行し (ピークRSSを分離するため)、結果は benchmarks/results/ に
+JSON で保存する。前回の結果 (または --baseline) と比較し、閾値を超えて遅く・重くなった項目を報告する。
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import importlib
+import threading
+import subprocess
+from datetime import datetime
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT_DIR not in sys.path:
+    sys.path.insert(0, ROOT_DIR)
+
+RESULTS_DIR = os.path.join(ROOT_DIR, "benchmarks", "results")
+DEFAULT_SIZES = [100, 1000, 10000]
+DEFAULT_TIMEOUT = 1800
+
+# シナリオごとに計測するフェーズ: (モジュール名, 関数名)。
+# エントリポイントのモジュールが import した名前を差し替えるため、入れ子の呼び出しも個別に計測される
+SCENARIOS = {
+    "main_01": [
+        ("main_01_initial_build", "generate_corporate_identity"),
+        ("main_01_initial_build", "generate_site_name_and_slug"),
+        ("main_01_initial_build", "generate_final_sitemap"),
+        ("main_01_initial_build", "generate_content_strategy"),
+        ("main_01_initial_build", "generate_target_page_list"),
+        ("main_01_initial_build", "generate_hub_pages"),
+        ("main_01_initial_build", "generate_single_page_html"),
+    ],
+    "main_02": [
+        ("utils.scan_utils", "scan_site_articles"),
+        ("utils.scan_utils", "generate_article_purpose"),
+        ("main_02_improvement_cycle", "select_priority_section_by_data"),
+        ("main_02_improvement_cycle", "generate_priority_article_titles"),
+        ("main_02_improvement_cycle", "generate_single_page_html"),
+        ("main_02_improvement_cycle", "open_article_registry"),
+        ("utils.article_registry", "render_plan_markdown"),
+        ("main_02_improvement_cycle", "inject_tags_main"),
+    ],
+    "main_03": [
+        ("main_03_inject_tags", "find_files_to_update"),
+        ("main_03_inject_tags", "apply_tag_updates"),
+    ],
+    "update_listings": [
+        ("tools.update_listings", "load_planned_articles"),
+        ("tools.update_listings", "extract_common_parts"),
+        ("tools.update_listings", "generate_single_page_html"),
+        ("utils.listing_utils", "render_archive_page"),
+    ],
+    "check_links": [
+        ("utils.link_graph", "_walk_site"),
+        ("utils.link_graph", "scan_pages"),
+    ],
+}
+
+
+class PhaseTimer:
+    """モジュールの関数を計測用のラッパーに差し替え、呼び出し回数と累積時間を集計する。"""
+
+    def __init__(self):
+        self.phases = {}
+        self._lock = threading.Lock()
+
+    def wrap(self, module_name, attr):
+        module = importlib.import_module(module_name)
+        original = getattr(module, attr)
+        name = attr
+
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                with self._lock:
+                    phase = self.phases.setdefault(name, {"calls": 0, "seconds": 0.0})
+                    phase["calls"] += 1
+                    phase["seconds"] += elapsed
+
+        setattr(module, attr, timed)
+
+
+def peak_rss_mb():
+    """このプロセスのピークRSS (MB) を返す。resource が無い環境では None。"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux は KB、macOS はバイト単位
+    return round(rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024, 1)
+
+
+# --- 子プロセス側: 1シナリオの実行 ---
+
+def _run_main_01(workdir, size):
+    os.makedirs(os.path.join(workdir, "config"), exist_ok=True)
+    shutil.copy(os.path.join(ROOT_DIR, "config", "opinion.txt"), os.path.join(workdir, "config", "opinion.txt"))
+    os.chdir(workdir)
+    importlib.import_module("main_01_initial_build").main(site_type="personal")
+
+
+def _run_main_02(workdir, size):
+    # AS-IS スキャンを計測するため、登録済みの計画は使わずに実ファイルから読み込ませる
+    inject = importlib.import_module("main_03_inject_tags")
+    inject.input_with_timeout = lambda prompt, timeout: None
+    importlib.import_module("main_02_improvement_cycle").main(rescan=True)
+
+
+def _run_main_03(workdir, size):
+    inject = importlib.import_module("main_03_inject_tags")
+    inject.main("GTM-BENCH01", "ca-pub-0000000000000000", interactive=False,
+                base_dir=os.path.join(workdir, "output", "docs"))
+
+
+def _run_update_listings(workdir, size):
+    importlib.import_module("tools.update_listings").update_all_listings(os.path.join(workdir, "output"))
+
+
+def _run_check_links(workdir, size):
+    importlib.import_module("tools.check_links").check_links(os.path.join(workdir, "output"))
+
+
+RUNNERS = {
+    "main_01": _run_main_01,
+    "main_02": _run_main_02,
+    "main_03": _run_main_03,
+    "update_listings": _run_update_listings,
+    "check_links": _run_check_links,
+}
+
+
+def run_single(scenario, size, workdir, result_file):
+    """子プロセスで1シナリオを実行し、計測結果を result_file に書き出す。"""
+    timer = PhaseTimer()
+    for module_name, attr in SCENARIOS[scenario]:
+        timer.wrap(module_name, attr)
+
+    status = "ok"
+    error = None
+    started = time.perf_counter()
+    try:
+        RUNNERS[scenario](workdir, size)
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            status, error = "failed", f"SystemExit({e.code})"
+    except Exception as e:
+        status, error = "failed", repr(e)
+    wall_time = time.perf_counter() - started
+
+    from utils.fake_client import get_fake_backend
+    stats = get_fake_backend().stats
+    result = {
+        "scenario": scenario,
+        "size": size,
+        "status": status,
+        "error": error,
+        "wall_time": round(wall_time, 3),
+        "phases": {name: {"calls": p["calls"], "seconds": round(p["seconds"], 3)} for name, p in timer.phases.items()},
+        "peak_rss_mb": peak_rss_mb(),
+        "requests": {k: v for k, v in sorted(stats.items()) if not k.endswith("_tokens")},
+        "tokens": {k: v for k, v in sorted(stats.items()) if k.endswith("_tokens")},
+    }
+    with open(result_file, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+
+
+# --- 親プロセス側: シナリオの起動・保存・比較 ---
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return "unknown"
+
+
+def _child_env(args, workdir, size):
+    env = dict(os.environ)
+    env.update({
+        "MYSITEGEN_FAKE_LLM": "1",
+        "MYSITEGEN_PROJECT_ROOT": workdir,      # main_02 の入出力先
+        "MYSITEGEN_CACHE_DIR": os.path.join(workdir, ".cache"),  # 実行ごとに空のキャッシュから始める
+        "FAKE_LLM_LATENCY": args.latency,
+        "FAKE_LLM_SEED": str(args.seed),
+        "FAKE_LLM_PAGE_COUNT": str(size),
+        "PYTHONPATH": ROOT_DIR + os.pathsep + env.get("PYTHONPATH", ""),
+    })
+    return env
+
+
+def run_scenario(args, scenario, size, template_dir, work_root):
+    workdir = os.path.join(work_root, f"{scenario}-{size}")
+    if os.path.exists(workdir):
+        shutil.rmtree(workdir)
+    if scenario == "main_01":
+        os.makedirs(workdir)
+    else:
+        shutil.copytree(template_dir, workdir)
+    result_file = os.path.join(work_root, f"{scenario}-{size}.json")
+    log_file = os.path.join(work_root, f"{scenario}-{size}.log")
+    cmd = [sys.executable, "-m", "benchmarks.run_benchmarks", "--single", scenario,
+           "--size", str(size), "--workdir", workdir, "--result-file", result_file]
+    print(f"  ▶ {scenario} ({size} pages) ...", end=" ", flush=True)
+    started = time.perf_counter()
+    try:
+        with open(log_file, "w", encoding="utf-8") as log:
+            subprocess.run(cmd, cwd=ROOT_DIR, env=_child_env(args, workdir, size),
+                           stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT, timeout=args.timeout)
+        with open(result_file, encoding="utf-8") as f:
+            result = json.load(f)
+    except subprocess.TimeoutExpired:
+        result = {"scenario": scenario, "size": size, "status": "timeout", "wall_time": args.timeout}
+    except (OSError, ValueError) as e:
+        result = {"scenario": scenario, "size": size, "status": "failed", "error": f"結果を読み込めません: {e}"}
+    result.setdefault("wall_time", round(time.perf_counter() - started, 3))
+    print(f"{result['status']} {result['wall_time']:.2f}s, RSS {result.get('peak_rss_mb')} MB "
+          f"(log: {log_file})")
+    return result
+
+
+def latest_results_file(exclude=None):
+    if not os.path.isdir(RESULTS_DIR):
+        return None
+    files = sorted(f for f in os.listdir(RESULTS_DIR) if f.endswith(".json") and f != exclude)
+    return os.path.join(RESULTS_DIR, files[-1]) if files else None
+
+
+def compare_results(current, baseline, threshold):
+    """baseline と比べて threshold (割合) 以上悪化した (シナリオ, サイズ, 指標) のリストを返す。"""
+    base_index = {(r["scenario"], r["size"]): r for r in baseline.get("results", [])}
+    regressions = []
+    print(f"\n--- 📊 前回 ({baseline.get('revision')}, {baseline.get('timestamp')}) との比較 ---")
+    for r in current["results"]:
+        base = base_index.get((r["scenario"], r["size"]))
+        if not base or base.get("status") != "ok" or r.get("status") != "ok":
+            continue
+        line = f"  {r['scenario']:<16} {r['size']:>6}"
+        for metric, unit, min_delta in (("wall_time", "s", 0.5), ("peak_rss_mb", "MB", 10)):
+            now, before = r.get(metric), base.get(metric)
+            if now is None or not before:
+                continue
+            change = (now - before) / before
+            line += f"  {metric} {before}{unit} → {now}{unit} ({change:+.0%})"
+            if change > threshold and now - before > min_delta:
+                regressions.append((r["scenario"], r["size"], metric, before, now))
+        print(line)
+    if regressions:
+        print(f"\n⚠️ {len(regressions)} 件の悪化 (閾値 {threshold:.0%}) が見つかりました:")
+        for scenario, size, metric, before, now in regressions:
+            print(f"  - {scenario} ({size} pages): {metric} {before} → {now}")
+    else:
+        print("✅ 閾値を超える悪化はありません。")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="MySiteGen パイプラインのベンチマーク")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)), help="ページ数 (カンマ区切り)")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="実行するシナリオ (カンマ区切り)")
+    parser.add_argument("--latency", default="fixed:0", help="フェイクバックエンドのレイテンシ分布 (FAKE_LLM_LATENCY)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--timeout", type=int, default=DEFAULT_TIMEOUT, help="1シナリオあたりの上限秒数")
+    parser.add_argument("--baseline", help="比較対象の結果ファイル (省略時は benchmarks/results の最新)")
+    parser.add_argument("--threshold", type=float, default=0.2, help="悪化とみなす割合 (既定 0.2 = 20%%)")
+    parser.add_argument("--fail-on-regression", action="store_true", help="悪化があれば終了コード 1 で終了する")
+    parser.add_argument("--keep", action="store_true", help="作業ディレクトリを削除しない")
+    # 子プロセス用の内部オプション
+    parser.add_argument("--single", choices=list(SCENARIOS), help=argparse.SUPPRESS)
+    parser.add_argument("--size", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--workdir", help=argparse.SUPPRESS)
+    parser.add_argument("--result-file", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.single:
+        run_single(args.single, args.size, args.workdir, args.result_file)
+        return 0
+
+    from benchmarks.synthetic_site import build_synthetic_project
+
+    sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = [s for s in scenarios if s not in SCENARIOS]
+    if unknown:
+        parser.error(f"不明なシナリオ: {', '.join(unknown)}")
+
+    work_root = tempfile.mkdtemp(prefix="mysitegen-bench-")
+    print(f"--- ⏱️ ベンチマーク開始 (作業ディレクトリ: {work_root}) ---")
+    results = []
+    try:
+        for size in sizes:
+            template_dir = os.path.join(work_root, f"site-{size}")
+            started = time.perf_counter()
+            build_synthetic_project(template_dir, size, seed=args.seed)
+            print(f"\n📁 {size} ページの架空サイトを生成しました ({time.perf_counter() - started:.1f}s)")
+            for scenario in scenarios:
+                results.append(run_scenario(args, scenario, size, template_dir, work_root))
+    finally:
+        if not args.keep:
+            shutil.rmtree(work_root, ignore_errors=True)
+
+    timestamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    revision = _git_revision()
+    report = {
+        "revision": revision,
+        "timestamp": timestamp,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "latency": args.latency,
+        "seed": args.seed,
+        "results": results,
+    }
+    baseline_file = args.baseline or latest_results_file()
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    result_name = f"{timestamp}_{revision}.json"
+    with open(os.path.join(RESULTS_DIR, result_name), "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"\n✅ 結果を保存しました: {os.path.join('benchmarks', 'results', result_name)}")
+
+    regressions = []
+    if baseline_file and os.path.exists(baseline_file):
+        with open(baseline_file, encoding="utf-8") as f:
+            regressions = compare_results(report, json.load(f), args.threshold)
+    if regressions and args.fail_on_regression:
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,106 @@
+import os
+import random
+from datetime import datetime
+from utils.article_registry import open_article_registry
+
+SECTIONS = ["insights", "solutions", "projects", "philosophy", "about"]
+FIXED_PAGES = [
+    ("ホーム", "index.html"),
+    ("お問い合わせ", "contact/index.html"),
+    ("プライバシーポリシー", "legal/privacy.html"),
+]
+BODY_PARAGRAPH = (
+    "<p>データに基づく意思決定は、個人の生活においても組織と同じように機能します。"
+    "ここでは測定・仮説・検証のサイクルを日常に持ち込むための具体的な手順を解説します。</p>\n"
+)
+
+
+def _relative(from_file, to_file):
+    return os.path.relpath(to_file, os.path.dirname(from_file) or ".").replace(os.path.sep, '/')
+
+
+def _page_html(file_name, title, links, paragraphs):
+    nav = "".join(f'<a href="{_relative(file_name, f"{s}/index.html")}">{s.upper()}</a>' for s in SECTIONS)
+    link_items = "".join(f'<li><a href="{href}">{text}</a></li>' for href, text in links)
+    body = BODY_PARAGRAPH * paragraphs
+    return f"""<!DOCTYPE html>
+<html lang="ja">
+<head>
+<meta charset="UTF-8">
+<title>{title} | LOU-Ark</title>
+<script src="https://cdn.tailwindcss.com"></script>
+</head>
+<body class="bg-gray-900 text-gray-300">
+<header class="bg-gray-900/80 backdrop-blur-sm sticky top-0"><a href="{_relative(file_name, 'index.html')}">LOU-Ark</a><nav>{nav}</nav></header>
+<main>
+<nav class="breadcrumb"><a href="{_relative(file_name, 'index.html')}">ホーム</a> &gt; {title}</nav>
+<h1>{title}</h1>
+<p>公開日: 2025年01月01日</p>
+<div class="prose prose-lg prose-invert max-w-none">
+<h2>概要</h2>
+{body}<h2>関連記事</h2>
+<h3>あわせて読みたい</h3>
+<ul>{link_items}</ul>
+</div>
+</main>
+<footer>© 2025 LOU-Ark Portfolio.</footer>
+</body>
+</html>
+"""
+
+
+def build_synthetic_project(project_root, page_count, seed=0, broken_link_ratio=0.01, paragraphs=6):
+    """
+    ベンチマーク用の架空のサイトを project_root/output 以下に生成する。
+      output/docs/                 … page_count ページの HTML (セクションの index.html と記事)
+      output/output_reports/       … 01_identity.md と記事レジストリ (planned_articles.md)
+    記事は前後の記事とセクションの一覧にリンクし、broken_link_ratio の割合でリンク切れを含む。
+    生成したページのリスト (file_name, title, summary) を返す。
+    """
+    rng = random.Random(seed)
+    output_dir = os.path.join(project_root, "output")
+    docs_dir = os.path.join(output_dir, "docs")
+    reports_dir = os.path.join(output_dir, "output_reports")
+    os.makedirs(reports_dir, exist_ok=True)
+
+    pages = [{"file_name": name, "title": title, "summary": f"{title} の役割"} for title, name in FIXED_PAGES]
+    pages += [{"file_name": f"{s}/index.html", "title": s.upper(), "summary": f"{s} セクションの一覧"} for s in SECTIONS]
+    article_count = max(0, page_count - len(pages))
+    for n in range(1, article_count + 1):
+        section = SECTIONS[(n - 1) % len(SECTIONS)]
+        pages.append({
+            "file_name": f"{section}/article-{n}.html",
+            "title": f"{section.capitalize()} 記事 {n}",
+            "summary": f"{section} に関する {n} 番目の記事の要約",
+        })
+
+    by_section = {}
+    for page in pages:
+        by_section.setdefault(os.path.dirname(page["file_name"]), []).append(page)
+
+    for page in pages:
+        file_name = page["file_name"]
+        siblings = by_section[os.path.dirname(file_name)]
+        if file_name.endswith("index.html"):
+            # 一覧ページは同じセクションの全記事へリンクする
+            links = [(_relative(file_name, p["file_name"]), p["title"]) for p in siblings if p is not page]
+        else:
+            index = siblings.index(page)
+            neighbours = siblings[max(0, index - 2):index] + siblings[index + 1:index + 3]
+            links = [(_relative(file_name, p["file_name"]), p["title"]) for p in neighbours]
+            links.append((_relative(file_name, f"{os.path.dirname(file_name)}/index.html"), "一覧へ戻る"))
+            if rng.random() < broken_link_ratio:
+                links.append(("missing-page.html", "リンク切れ"))
+        path = os.path.join(docs_dir, file_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(_page_html(file_name, page["title"], links, paragraphs))
+
+    with open(os.path.join(reports_dir, "01_identity.md"), "w", encoding="utf-8") as f:
+        f.write("パーソナル・ブランド: データによる個人の生活最適化。\n")
+    now = datetime(2025, 1, 1).isoformat()
+    for page in pages:
+        page["created_at"] = now
+        page["updated_at"] = ""
+    open_article_registry(reports_dir, docs_dir).register_many(pages)
+    return pages
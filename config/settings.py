@@ -48,3 +48,121 @@ MODEL_NAME_PRO = "gemini-3-flash-preview"
 MODEL_NAME_GEN = "gemini-3-flash-preview" 
 
 MODEL_NAME_FLASH = "gemini-3-flash-preview"
+
+# --- 並列生成設定 ---
+# ハブページ (main_01 フェーズ4) を同時に生成するワーカー数の上限
+# .env で GENERATION_CONCURRENCY=1 とすると従来どおり逐次生成になる
+GENERATION_CONCURRENCY = max(1, int(os.environ.get("GENERATION_CONCURRENCY", "4")))
+
+# --- 初回構築のステージ実行 (utils/pipeline_utils.py) ---
+# 依存関係の無いステージ (サイト名とサイトマップなど) を同時に実行する数
+PIPELINE_CONCURRENCY = max(1, int(os.environ.get("PIPELINE_CONCURRENCY", "2")))
+
+# --- AS-IS スキャン (utils/scan_utils.py) ---
+# 計画ファイルが無いときの既存サイトの解析。HTML の解析プロセス数 (既定は CPU 数) と、目的生成の LLM 同時呼び出し数
+AS_IS_SCAN_PARSE_WORKERS = int(os.environ.get("AS_IS_SCAN_PARSE_WORKERS", "0")) or None
+AS_IS_SCAN_LLM_CONCURRENCY = max(1, int(os.environ.get("AS_IS_SCAN_LLM_CONCURRENCY", "4")))
+
+# --- タグ挿入 (main_03_inject_tags.py) ---
+# 挿入する GTM / AdSense の ID。指定すると main_03 (および main_02 のフェーズ11) は入力を待たずにこの ID を使う
+GTM_ID = os.environ.get("GTM_ID") or None
+ADSENSE_CLIENT_ID = os.environ.get("ADSENSE_CLIENT_ID") or None
+# HTML の確認・書き換えを行うプロセス数 (0 で CPU 数)
+INJECT_TAGS_WORKERS = int(os.environ.get("INJECT_TAGS_WORKERS", "0")) or None
+
+# --- リンクチェック (tools/check_links.py) ---
+# HTML からリンクを取り出すプロセス数 (0 で CPU 数)
+CHECK_LINKS_WORKERS = int(os.environ.get("CHECK_LINKS_WORKERS", "0")) or None
+
+# --- APIキープール (utils/key_pool.py) ---
+# キー1本あたりのクォータ。無料枠の既定値に合わせているので、有料プランでは .env で上書きする
+KEY_RPM_LIMIT = int(os.environ.get("KEY_RPM_LIMIT", "10"))       # requests / minute
+KEY_TPM_LIMIT = int(os.environ.get("KEY_TPM_LIMIT", "250000"))   # tokens / minute
+KEY_RPD_LIMIT = int(os.environ.get("KEY_RPD_LIMIT", "250"))      # requests / day
+# 全てのキーの RPM / TPM / RPD が枯渇している場合に、送信を待つ最大秒数 (超えたらレート制限として再試行に回す)
+KEY_MAX_WAIT_SECONDS = float(os.environ.get("KEY_MAX_WAIT_SECONDS", "120"))
+# キーごとの消費状況の保存先 (日次クォータを再起動後も引き継ぐため)
+CACHE_DIR = os.environ.get("MYSITEGEN_CACHE_DIR", os.path.join(ROOT_DIR, ".cache"))
+KEY_USAGE_FILE = os.path.join(CACHE_DIR, "key_usage.json")
+# キー使用状況ファイルを書き出す最短間隔 (秒)。クールダウンの記録と終了時はこの間隔によらず書き出す
+KEY_USAGE_SAVE_INTERVAL = float(os.environ.get("KEY_USAGE_SAVE_INTERVAL", "5"))
+# サイトのリンクグラフ (utils/link_graph.py) の保存先。docs ごとに1ファイルで、変更されたページだけを再解析する
+LINK_GRAPH_DIR = os.path.join(CACHE_DIR, "link_graph")
+
+# --- LLMレスポンスキャッシュ (utils/cache_utils.py) ---
+# 同一の (model, prompt, config, テンプレート版) への応答を .cache/responses に保存して再利用する
+LLM_CACHE_ENABLED = os.environ.get("LLM_CACHE_ENABLED", "1") != "0"
+# 1 にするとキャッシュを読まずに必ずAPIを呼ぶ (結果でキャッシュは更新される)
+LLM_CACHE_BYPASS = os.environ.get("LLM_CACHE_BYPASS", "0") == "1"
+LLM_CACHE_MAX_MB = int(os.environ.get("LLM_CACHE_MAX_MB", "500"))
+LLM_CACHE_MAX_AGE_DAYS = int(os.environ.get("LLM_CACHE_MAX_AGE_DAYS", "30"))
+# 記事構造の解析結果 (agents/agent_04_improvement.py) を .cache/article_structure に保存し、ファイルが変わるまで再利用する
+ARTICLE_STRUCTURE_CACHE_ENABLED = os.environ.get("ARTICLE_STRUCTURE_CACHE_ENABLED", "1") != "0"
+# プロンプトの後処理や出力の解釈を変えたときに上げると、既存のキャッシュが無効になる
+PROMPT_TEMPLATE_VERSION = "1"
+
+# --- 再試行ポリシー (utils/retry_utils.py) ---
+# レート制限・サーバー過負荷・不正な出力は上限付き指数バックオフ + ジッターで再試行し、
+# それ以外 (認証エラー, 不正なリクエスト等) は即座に諦める
+RETRY_MAX_ATTEMPTS = int(os.environ.get("RETRY_MAX_ATTEMPTS", "3"))
+RETRY_BASE_DELAY = float(os.environ.get("RETRY_BASE_DELAY", "2.0"))
+RETRY_MAX_DELAY = float(os.environ.get("RETRY_MAX_DELAY", "60.0"))
+
+# --- ストリーミング生成 (utils/stream_utils.py) ---
+# 1 にすると HTML 生成を generate_content_stream で行い、受信途中の内容を .cache/partials に書き出す
+STREAM_HTML_GENERATION = os.environ.get("STREAM_HTML_GENERATION", "0") == "1"
+# この秒数チャンクが届かなければストリームが停止したとみなして打ち切る
+STREAM_STALL_TIMEOUT = float(os.environ.get("STREAM_STALL_TIMEOUT", "90"))
+# 出力が </html> の前で切れた場合に「続きの生成」を試みる最大回数 (0 で無効、常に全体を再生成)
+HTML_CONTINUATION_MAX_ROUNDS = int(os.environ.get("HTML_CONTINUATION_MAX_ROUNDS", "2"))
+
+# --- ナビゲーションコンテキスト (utils/nav_utils.py) ---
+# ページ生成プロンプトに含めるナビゲーション構造のトークン予算と、関連ページの件数
+NAV_CONTEXT_TOKEN_BUDGET = int(os.environ.get("NAV_CONTEXT_TOKEN_BUDGET", "1500"))
+NAV_RELATED_PAGES = int(os.environ.get("NAV_RELATED_PAGES", "5"))
+
+# --- 共通プレフィックスのコンテキストキャッシュ (utils/context_cache.py) ---
+# ページ生成プロンプトの共通部分 (デザイン要件・アイデンティティ・戦略) を実行ごとに1度だけ
+# Gemini のキャッシュ済みコンテンツとして登録し、各ページではページ固有の部分だけを送る
+CONTEXT_CACHE_ENABLED = os.environ.get("CONTEXT_CACHE_ENABLED", "1") != "0"
+# 1 にすると API のキャッシュ機能を使わないローカル代替で動かす (オフライン検証用)
+CONTEXT_CACHE_LOCAL = os.environ.get("CONTEXT_CACHE_LOCAL", "0") == "1"
+# 実行が異常終了して削除されなかった場合も、この秒数で期限切れになる
+CONTEXT_CACHE_TTL_SECONDS = int(os.environ.get("CONTEXT_CACHE_TTL_SECONDS", "3600"))
+# API がキャッシュを受け付ける最小トークン数 (これより短いプレフィックスは通常どおり送る)
+CONTEXT_CACHE_MIN_TOKENS = int(os.environ.get("CONTEXT_CACHE_MIN_TOKENS", "1024"))
+
+# --- オフライン用フェイククライアント (utils/fake_client.py) ---
+# MYSITEGEN_FAKE_LLM=1 にすると setup_client が APIキー不要の FakeClient を返す (負荷試験・動作確認用)
+FAKE_LLM = os.environ.get("MYSITEGEN_FAKE_LLM", "0") == "1"
+# 応答までのレイテンシ分布: fixed:秒 / uniform:最小,最大 / lognormal:mu,sigma / exponential:平均秒
+FAKE_LLM_LATENCY = os.environ.get("FAKE_LLM_LATENCY", "fixed:0")
+FAKE_LLM_TOKENS_PER_SEC = float(os.environ.get("FAKE_LLM_TOKENS_PER_SEC", "0"))  # 0 で出力時間を待たない
+FAKE_LLM_RATE_LIMIT_PROB = float(os.environ.get("FAKE_LLM_RATE_LIMIT_PROB", "0"))   # 429 を返す確率
+FAKE_LLM_OVERLOAD_PROB = float(os.environ.get("FAKE_LLM_OVERLOAD_PROB", "0"))       # 503 を返す確率
+FAKE_LLM_TRUNCATE_PROB = float(os.environ.get("FAKE_LLM_TRUNCATE_PROB", "0"))       # HTML を途中で切る確率
+FAKE_LLM_MALFORMED_JSON_PROB = float(os.environ.get("FAKE_LLM_MALFORMED_JSON_PROB", "0"))
+FAKE_LLM_RPM_LIMIT = int(os.environ.get("FAKE_LLM_RPM_LIMIT", "0"))  # キー1本あたりの RPM 上限 (0 で無制限)
+FAKE_LLM_SEED = int(os.environ["FAKE_LLM_SEED"]) if os.environ.get("FAKE_LLM_SEED") else None
+# ターゲットページリスト (JSON) として返すページ数 (0 で既定の7ページ。ベンチマークでサイト規模を変えるため)
+FAKE_LLM_PAGE_COUNT = int(os.environ.get("FAKE_LLM_PAGE_COUNT", "0"))
+
+# --- LLMテレメトリ (utils/telemetry.py) ---
+# LLM 呼び出しの試行ごとに (フェーズ, ページ, モデル, キー末尾, トークン数, レイテンシ, 結果) を
+# .cache/telemetry/<run_id>.jsonl に記録し、実行の終わりにフェーズ別の集計を表示する
+TELEMETRY_ENABLED = os.environ.get("TELEMETRY_ENABLED", "1") != "0"
+TELEMETRY_DIR = os.environ.get("TELEMETRY_DIR", os.path.join(CACHE_DIR, "telemetry"))
+# 指定すると node_exporter の textfile collector 形式 (*.prom) で集計値も書き出す
+TELEMETRY_PROMETHEUS_FILE = os.environ.get("TELEMETRY_PROMETHEUS_FILE") or None
+# 概算コストの計算に使う 1M トークンあたりの単価 (USD): {モデル名: (入力, 出力)}。未登録のモデルは 0 として扱う
+MODEL_PRICES = {
+    "gemini-2.5-flash": (0.30, 2.50),
+    "gemini-2.5-pro": (1.25, 10.00),
+    "gemini-3-flash-preview": (0.50, 3.00),
+}
+
+# --- 一覧ページ (utils/listing_utils.py) ---
+# セクション一覧ページの記事カードの並び順: number (連番の昇順) / date (作成日の新しい順) / registry (登録順)
+LISTING_CARD_ORDER = os.environ.get("LISTING_CARD_ORDER", "number")
+# 一覧ページ1枚あたりのカード数。超えた分は <section>/page/2.html, 3.html, ... のアーカイブに分ける (0 で分けない)
+LISTING_PAGE_SIZE = int(os.environ.get("LISTING_PAGE_SIZE", "24"))
@@ -3,9 +3,9 @@ import sys
 import json
 import shutil
 import re 
-from google import genai
-from google.genai import types 
-from utils.client_utils import setup_client
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from utils.client_utils import setup_client, generate_json
 
 # モジュールをインポート
 from agents.agent_01_identity import generate_corporate_identity
@@ -14,18 +14,29 @@ from agents.agent_02_strategy import (
     generate_content_strategy,
     generate_target_page_list
 )
-from agents.agent_03_generation import generate_single_page_html
+from agents.agent_03_generation import generate_single_page_html, build_page_prompt_prefix, page_input_fingerprint
+from utils.context_cache import open_prefix_cache
+from utils.pipeline_utils import Pipeline, PipelineError, StageError
+from utils.manifest_utils import BuildManifest
+from utils.publish_utils import atomic_write_text, StagedDirectory
+from config.settings import GENERATION_CONCURRENCY, MODEL_NAME_GEN, PIPELINE_CONCURRENCY
+from utils.lazy_import import lazy_import
+
+types = lazy_import("google.genai.types")
 
 # --- 0. 設定 ---
 OPINION_FILE = "config/opinion.txt"
 # ⬇️ [修正] メインの出力先を 'output' フォルダに
 MAIN_OUTPUT_DIR = "output"
 REPORTS_DIR = os.path.join(MAIN_OUTPUT_DIR, "output_reports")
+# ステージごとのチェックポイント (再実行時はここから再開する)
+CHECKPOINT_DIR = os.path.join(REPORTS_DIR, "checkpoints")
 # (OUTPUT_DIR と ZIP_FILENAME は main() 内で動的に設定)
 
 def generate_site_name_and_slug(client, identity, SITE_TYPE):
     """
     法人格/ブランドに基づき、サイトの正式名称とディレクトリ用のスラッグ（フォルダ名）を生成する。
+    生成に失敗した場合は None を返す (呼び出し側でデフォルト名をチェックポイントに残さないため)。
     """
     if SITE_TYPE == 'corporate':
         role_desc = "この「法人格」"
@@ -56,28 +67,245 @@ def generate_site_name_and_slug(client, identity, SITE_TYPE):
     """
     print("... 🤖 AI (Flash) がサイト名を動的生成中 ...")
     try:
-        response = client.models.generate_content(
+        data = generate_json(
+            client,
             model="gemini-2.5-flash", 
             contents=prompt,
             config=types.GenerateContentConfig(response_mime_type="application/json")
         )
-        data = json.loads(response.text)
         
-        slug = data.get("slug", "default-site-name").strip().lower()
+        slug = str(data.get("slug") or "").strip().lower()
         slug = re.sub(r"[^a-z0-9-]", "", slug)
-        if not slug: slug = "default-site-name"
+        if not slug:
+            print("❌ サイト名の生成に失敗: 有効なスラッグが含まれていませんでした。")
+            return None
         
         print(f"✅ AIがサイト名を生成しました: {data.get('site_name')} (Slug: {slug})")
         return slug
     except Exception as e:
-        print(f"❌ サイト名の生成に失敗: {e}。デフォルト名を使用します。")
-        return "people-opt-default-site"
+        print(f"❌ サイト名の生成に失敗: {e}")
+        return None
+
+def generate_and_write_page(client, page, identity, strategy, page_list, SITE_TYPE, output_dir, prefix_cache=None):
+    """
+    1ページ分のHTMLを生成して output_dir に書き込み、結果メッセージを返す。
+    ハブページ同士は互いの生成結果に依存しないため、並列に呼び出してよい。
+    """
+    print(f"\n--- 🏭 ページ生成: {page['title']} ({page['file_name']}) ---")
+
+    final_html_code = generate_single_page_html(
+        client,
+        page,
+        identity,
+        strategy,
+        page_list,
+        GTM_ID=None, 
+        ADSENSE_CLIENT_ID=None,
+        SITE_TYPE=SITE_TYPE, 
+        retry_attempts=3,
+        prefix_cache=prefix_cache
+    )
+
+    if "❌" in final_html_code:
+        return final_html_code
+
+    target_file_path = os.path.join(output_dir, page['file_name'])
+
+    try:
+        atomic_write_text(target_file_path, final_html_code)
+        return f"✅ 生成完了: {target_file_path}"
+    except Exception as e:
+        return f"❌ ファイル書き込みエラー: {e}"
 
-def main():
+def select_stale_pages(pages, identity, strategy, SITE_TYPE, output_dir, manifest):
+    """
+    ビルドマニフェストと照合し、入力が前回の生成時から変わったページ (またはファイルが無いページ) だけを返す。
+    戻り値は (再生成するページのリスト, {file_name: 入力の指紋})。
+    """
+    stale_pages = []
+    fingerprints = {}
+    for page in pages:
+        fingerprints[page['file_name']] = page_input_fingerprint(page, identity, strategy, pages, SITE_TYPE=SITE_TYPE)
+        if not manifest.is_fresh(os.path.join(output_dir, page['file_name']), fingerprints[page['file_name']]):
+            stale_pages.append(page)
+    manifest.report()
+    return stale_pages, fingerprints
+
+def generate_hub_pages(client, pages, identity, strategy, SITE_TYPE, output_dir, max_workers=GENERATION_CONCURRENCY, prefix_cache=None, page_list=None, manifest=None, fingerprints=None):
+    """
+    pages の各ページを最大 max_workers 並列で生成する。
+    戻り値の辞書は、完了順ではなく pages と同じ順序で結果を保持する。
+    prefix_cache を渡すと、全ページで共通プレフィックスのキャッシュを共有する。
+    page_list (ナビゲーションに使う全ページ) を省略した場合は pages を使う。
+    manifest と fingerprints (select_stale_pages の戻り値) を渡すと、生成に成功したページをマニフェストに記録する。
+    """
+    page_list = page_list or pages
+    max_workers = max(1, min(max_workers, len(pages)))
+    print(f"  > {len(pages)} ページを最大 {max_workers} 並列で生成します。")
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        # ワーカースレッドにもテレメトリのフェーズを引き継ぐため、タスクごとにコンテキストを複製して実行する
+        futures = [
+            executor.submit(contextvars.copy_context().run, generate_and_write_page,
+                            client, page, identity, strategy, page_list, SITE_TYPE, output_dir, prefix_cache)
+            for page in pages
+        ]
+
+        generated_files = {}
+        for page, future in zip(pages, futures):
+            try:
+                generated_files[page['file_name']] = future.result()
+            except Exception as e:
+                generated_files[page['file_name']] = f"❌ 予期しないエラー: {e}"
+            if manifest is not None and not generated_files[page['file_name']].startswith("❌"):
+                manifest.record(os.path.join(output_dir, page['file_name']), fingerprints[page['file_name']])
+    return generated_files
+
+def _save_report(filename, content):
+    """REPORTS_DIR にレポートを保存する (失敗しても処理は続行する)。"""
+    try:
+        if not isinstance(content, str):
+            content = json.dumps(content, indent=2, ensure_ascii=False)
+        atomic_write_text(os.path.join(REPORTS_DIR, filename), content)
+        print(f"✅ [レポート] {filename} を保存しました。")
+    except Exception as e:
+        print(f"⚠️ [レポート] {filename} の保存中にエラー: {e}")
+
+def _require_text(result, label):
+    """エージェントがエラーメッセージ ("❌ ...") を返した場合は StageError にする。"""
+    if not result or result.startswith("❌"):
+        raise StageError(f"{label}に失敗しました: {result}")
+    return result
+
+def build_pipeline(client, SITE_TYPE, raw_vision_input, fresh=False):
+    """
+    初回構築の各フェーズを、依存関係つきのステージとして組み立てる。
+    identity → (site_name ∥ sitemap) → content_strategy → target_pages → hub_pages → archive
+    """
+    pipeline = Pipeline(
+        CHECKPOINT_DIR,
+        inputs={"site_type": SITE_TYPE, "opinion": raw_vision_input},
+        max_workers=PIPELINE_CONCURRENCY,
+        fresh=fresh
+    )
+
+    @pipeline.stage("identity", deps=("opinion", "site_type"))
+    def identity_stage(opinion, site_type):
+        identity = _require_text(generate_corporate_identity(client, opinion, site_type), "アイデンティティの生成")
+        print(f"✅ [フェーズ2] {site_type} のアイデンティティを生成しました。")
+        _save_report("01_identity.md", identity)
+        return identity
+
+    @pipeline.stage("site_name", deps=("identity", "site_type"))
+    def site_name_stage(identity, site_type):
+        # デフォルト名で続行するとチェックポイントに残り、再実行しても生成し直されないため、失敗として扱う
+        slug = generate_site_name_and_slug(client, identity, site_type)
+        if not slug:
+            raise StageError("サイト名の生成に失敗しました。")
+        return slug
+
+    @pipeline.stage("sitemap", deps=("identity", "site_type"))
+    def sitemap_stage(identity, site_type):
+        sitemap = _require_text(generate_final_sitemap(client, identity, site_type), "サイトマップの生成")
+        _save_report("02_sitemap.md", sitemap)
+        return sitemap
+
+    @pipeline.stage("content_strategy", deps=("identity", "sitemap", "site_type"))
+    def content_strategy_stage(identity, sitemap, site_type):
+        strategy = _require_text(generate_content_strategy(client, identity, sitemap, site_type), "コンテンツ戦略の生成")
+        _save_report("03_content_strategy.md", strategy)
+        return strategy
+
+    @pipeline.stage("target_pages", deps=("identity", "content_strategy"))
+    def target_pages_stage(identity, strategy):
+        target_pages = generate_target_page_list(client, identity, strategy)
+        _save_report("04_target_pages_list.json", target_pages)
+        if not target_pages:
+            raise StageError("ターゲットリストの生成に失敗しました。")
+        print("✅ [フェーズ3] サイト戦略とターゲットリストの生成が完了しました。")
+        return target_pages
+
+    # ハブページはページ単位のビルドマニフェストで再生成の要否を判定するため、ステージとしては毎回実行する
+    @pipeline.stage("hub_pages", deps=("identity", "content_strategy", "target_pages", "site_name", "site_type"), checkpoint=False)
+    def hub_pages_stage(identity, strategy, target_pages, site_slug, site_type):
+        output_dir = os.path.join(MAIN_OUTPUT_DIR, "output_website", site_slug)
+        print(f"\n--- [フェーズ4] 全体（ハブページ）のHTML生成を開始 (出力先: {output_dir}) ---")
+        # ページは output_dir.staging に書き込み、全ページが揃ったところで output_dir と入れ替える。
+        # 途中で失敗した場合はステージングを残し、次回はそこから再開する (fresh の場合は以前の出力を引き継がない)
+        staged = StagedDirectory(output_dir, resume=not fresh, copy_existing=not fresh).open()
+        manifest = BuildManifest(staged.path, force=fresh)
+        stale_pages, fingerprints = select_stale_pages(target_pages, identity, strategy, site_type, staged.path, manifest)
+        generated_files = {page['file_name']: "⏭️ 変更なし (スキップ)" for page in target_pages}
+
+        if stale_pages:
+            # 全ページ共通のプレフィックス (アイデンティティ・戦略・デザイン要件) は1度だけキャッシュし、ステージの終わりに破棄する
+            prefix_cache = open_prefix_cache(
+                client, MODEL_NAME_GEN,
+                build_page_prompt_prefix(identity, strategy, site_type),
+                display_name=f"{site_slug}-page-prefix"
+            )
+            try:
+                generated_files.update(generate_hub_pages(
+                    client,
+                    stale_pages,
+                    identity,
+                    strategy,
+                    site_type,
+                    staged.path,
+                    max_workers=GENERATION_CONCURRENCY,
+                    prefix_cache=prefix_cache,
+                    page_list=target_pages,
+                    manifest=manifest,
+                    fingerprints=fingerprints
+                ))
+            finally:
+                if prefix_cache is not None:
+                    prefix_cache.close()
+
+        print("\n--- 🎉 全ページ生成結果サマリー ---")
+        for filename, status in generated_files.items():
+            print(f"{filename.ljust(30)}: {status}")
+
+        failed_pages = [filename for filename, status in generated_files.items() if status.startswith("❌")]
+        if failed_pages:
+            # ステージングは次回の再開用に残し、ロックだけを解放する
+            staged.release()
+            raise StageError(f"{len(failed_pages)} ページの生成に失敗しました: {', '.join(failed_pages)}"
+                             f" (生成済みのページは {staged.path} に残っています)")
+        if stale_pages or staged.resumed:
+            staged.publish()
+        else:
+            staged.discard()
+        return sorted(generated_files)
+
+    @pipeline.stage("archive", deps=("hub_pages", "site_name"), checkpoint=False)
+    def archive_stage(hub_pages, site_slug):
+        # ⬇️ [修正] 'MAIN_OUTPUT_DIR' ('output' フォルダ) を丸ごとZIP化
+        zip_filename = f"{site_slug}_output.zip" # 例: "anima-cognita-portfolio_output.zip"
+        print(f"\n--- 📦 {zip_filename} にZIP圧縮中 ---")
+        try:
+            shutil.make_archive(
+                zip_filename.replace('.zip', ''),  # ZIPファイル名 (例: 'anima-cognita-portfolio_output')
+                'zip',                             # 形式
+                MAIN_OUTPUT_DIR                    # ⬅️ 圧縮対象 ('output' フォルダ)
+            )
+            print(f"✅ ZIPファイルの作成が完了しました: {zip_filename}")
+        except Exception as e:
+            print(f"❌ ZIPファイルの作成中にエラーが発生しました: {e}")
+        return zip_filename
+
+    return pipeline
+
+def main(site_type=None, fresh=False):
+    """
+    fresh=True の場合はチェックポイントと以前の出力を破棄して最初から構築する。
+    それ以外は、前回の実行で完了したステージと生成済みのページを再利用して続きから再開する。
+    """
     print("--- 🚀 HP初回構築エージェント (フェーズ1-4) 開始 ---")
 
     # --- 0. サイトタイプの選択 ---
-    SITE_TYPE = ''
+    # site_type ('corporate' / 'personal') を渡した場合は対話入力を省略する (ベンチマーク等の非対話実行用)
+    SITE_TYPE = {'corporate': '1', 'personal': '2'}.get(site_type, '')
     while SITE_TYPE not in ['1', '2']:
         SITE_TYPE = input("生成するサイトのタイプを選んでください (1 or 2):\n 1: 法人 (Corporate)\n 2: 個人 (Personal)\n > ")
     
@@ -89,9 +317,6 @@ def main():
     if gemini_client is None:
         sys.exit(1)
 
-    # --- [修正] レポートディレクトリを先に作成 ---
-    os.makedirs(REPORTS_DIR, exist_ok=True) # ⬅️ 'output/output_reports' を作成
-
     # --- 2. 個人の意見をロード ---
     try:
         with open(OPINION_FILE, 'r', encoding='utf-8') as f:
@@ -101,110 +326,21 @@ def main():
         print(f"❌ {OPINION_FILE} の読み込みに失敗: {e}")
         sys.exit(1)
 
-    # --- 3. 法人格/ブランドの生成 ---
-    IDENTITY_TEXT = generate_corporate_identity(gemini_client, RAW_VISION_INPUT, SITE_TYPE)
-    print(f"✅ [フェーズ2] {SITE_TYPE} のアイデンティティを生成しました。")
-    try:
-        with open(os.path.join(REPORTS_DIR, "01_identity.md"), 'w', encoding='utf-8') as f:
-            f.write(IDENTITY_TEXT)
-        print(f"✅ [レポート] 01_identity.md を保存しました。")
-    except Exception as e:
-        print(f"⚠️ [レポート] 01_identity.md の保存中にエラー: {e}")
-
-    # --- 4. サイト名の動的生成 ---
-    SITE_SLUG = generate_site_name_and_slug(gemini_client, IDENTITY_TEXT, SITE_TYPE)
-    # ⬇️ [修正] 出力先を 'output/output_website/[slug]' に変更
-    OUTPUT_DIR = os.path.join(MAIN_OUTPUT_DIR, "output_website", SITE_SLUG)
-    # ⬇️ [修正] ZIPファイル名を変更
-    ZIP_FILENAME = f"{SITE_SLUG}_output.zip" # 例: "anima-cognita-portfolio_output.zip"
-    print(f"✅ 出力先を動的に設定: {OUTPUT_DIR}")
-
-    # --- 5. 戦略の生成 ---
-    print("\n--- [フェーズ3] サイト戦略の生成を開始 ---")
-    
-    sitemap_result = generate_final_sitemap(gemini_client, IDENTITY_TEXT, SITE_TYPE)
-    try:
-        with open(os.path.join(REPORTS_DIR, "02_sitemap.md"), 'w', encoding='utf-8') as f:
-            f.write(sitemap_result)
-        print(f"✅ [レポート] 02_sitemap.md を保存しました。")
-    except Exception as e:
-        print(f"⚠️ [レポート] 02_sitemap.md の保存中にエラー: {e}")
-
-    content_strategy_result = generate_content_strategy(gemini_client, IDENTITY_TEXT, sitemap_result, SITE_TYPE)
-    try:
-        with open(os.path.join(REPORTS_DIR, "03_content_strategy.md"), 'w', encoding='utf-8') as f:
-            f.write(content_strategy_result)
-        print(f"✅ [レポート] 03_content_strategy.md を保存しました。")
-    except Exception as e:
-        print(f"⚠️ [レポート] 03_content_strategy.md の保存中にエラー: {e}")
+    # --- [修正] レポートディレクトリを先に作成 ---
+    os.makedirs(REPORTS_DIR, exist_ok=True) # ⬅️ 'output/output_reports' を作成
 
-    TARGET_PAGES_LIST = generate_target_page_list(gemini_client, IDENTITY_TEXT, content_strategy_result)
+    # --- 3-6. 法人格 → サイト名 / サイトマップ → 戦略 → ターゲットリスト → ハブページ → ZIP ---
+    pipeline = build_pipeline(gemini_client, SITE_TYPE, RAW_VISION_INPUT, fresh=fresh)
     try:
-        with open(os.path.join(REPORTS_DIR, "04_target_pages_list.json"), 'w', encoding='utf-8') as f:
-            json.dump(TARGET_PAGES_LIST, f, indent=2, ensure_ascii=False)
-        print(f"✅ [レポート] 04_target_pages_list.json を保存しました。")
-    except Exception as e:
-        print(f"⚠️ [レポート] 04_target_pages_list.json の保存中にエラー: {e}")
-
-    if not TARGET_PAGES_LIST:
-        print("❌ ターゲットリストの生成に失敗したため、処理を中断します。")
+        results = pipeline.run()
+    except PipelineError as e:
+        print(f"\n❌ {e}")
+        print("💡 完了したステージと生成済みのページは保存されています。もう一度実行すると続きから再開します"
+              " (最初からやり直す場合は --fresh を指定してください)。")
         sys.exit(1)
-    print("✅ [フェーズ3] サイト戦略とターゲットリストの生成が完了しました。")
-
-    # --- 6. 全体（ハブページ）の生成 ---
-    print(f"\n--- [フェーズ4] 全体（ハブページ）のHTML生成を開始 (出力先: {OUTPUT_DIR}) ---")
-    if os.path.exists(OUTPUT_DIR):
-        shutil.rmtree(OUTPUT_DIR)
-
-    generated_files = {}
-
-    for page in TARGET_PAGES_LIST:
-        print(f"\n--- 🏭 ページ生成: {page['title']} ({page['file_name']}) ---")
-
-        final_html_code = generate_single_page_html(
-            gemini_client,
-            page,
-            IDENTITY_TEXT,
-            content_strategy_result,
-            TARGET_PAGES_LIST,
-            GTM_ID=None, 
-            ADSENSE_CLIENT_ID=None,
-            SITE_TYPE=SITE_TYPE, 
-            retry_attempts=3
-        )
-
-        if "❌" not in final_html_code:
-            target_file_path = os.path.join(OUTPUT_DIR, page['file_name'])
-            target_dir = os.path.dirname(target_file_path)
-            os.makedirs(target_dir, exist_ok=True)
-
-            try:
-                with open(target_file_path, "w", encoding="utf-8") as f:
-                    f.write(final_html_code)
-                generated_files[page['file_name']] = f"✅ 生成完了: {target_file_path}"
-            except Exception as e:
-                generated_files[page['file_name']] = f"❌ ファイル書き込みエラー: {e}"
-        else:
-            generated_files[page['file_name']] = final_html_code
-
-    print("\n--- 🎉 全ページ生成結果サマリー ---")
-    for filename, status in generated_files.items():
-        print(f"{filename.ljust(30)}: {status}")
-
-    # ---  ZIP化 ---
-    # ⬇️ [修正] 'MAIN_OUTPUT_DIR' ('output' フォルダ) を丸ごとZIP化
-    print(f"\n--- 📦 {ZIP_FILENAME} にZIP圧縮中 ---")
-    try:
-        shutil.make_archive(
-            ZIP_FILENAME.replace('.zip', ''),  # ZIPファイル名 (例: 'anima-cognita-portfolio_output')
-            'zip',                             # 形式
-            MAIN_OUTPUT_DIR                    # ⬅️ 圧縮対象 ('output' フォルダ)
-        )
-        print(f"✅ ZIPファイルの作成が完了しました: {ZIP_FILENAME}")
-    except Exception as e:
-        print(f"❌ ZIPファイルの作成中にエラーが発生しました: {e}")
 
+    print(f"✅ 出力先: {os.path.join(MAIN_OUTPUT_DIR, 'output_website', results['site_name'])}")
     print("--- 🚀 HP初回構築エージェント 完了 ---")
 
 if __name__ == "__main__":
-    main()
+    main(fresh="--fresh" in sys.argv[1:])
@@ -4,48 +4,42 @@ import json
 import shutil
 import re 
 import time 
-from google import genai
 from datetime import datetime
 
 # モジュールをインポート
-from agents.agent_03_generation import generate_single_page_html
+from agents.agent_03_generation import generate_single_page_html, build_page_prompt_prefix
 from agents.agent_04_improvement import (
-    analyze_article_structure,
-    generate_article_purpose,
     select_priority_section_by_data,
     generate_priority_article_titles
 )
 from utils.file_utils import (
     get_existing_article_count,
-    integrate_content_data,
-    save_to_markdown,
-    load_markdown_table_to_list
+    integrate_content_data
 )
 from utils.analysis_utils import create_placeholder_data
+from utils.scan_utils import scan_site_articles
+from utils.link_graph import LinkGraph
+from utils.article_registry import open_article_registry, split_file_name
+from utils.client_utils import setup_client
+from utils.context_cache import open_prefix_cache
+from utils.publish_utils import atomic_write_text, StagedDirectory
+from utils.manifest_utils import BuildManifest
+from utils.listing_utils import GRID_PLACEHOLDER, sort_cards, plan_section_archive, write_section_archive
+from utils.telemetry import scope as telemetry_scope
+from config.settings import MODEL_NAME_GEN
 from main_03_inject_tags import main as inject_tags_main
 
 # --- 0. 設定 ---
-PROJECT_ROOT_PATH = "/content/MySiteGen-Agent" 
+# 環境変数 MYSITEGEN_PROJECT_ROOT で上書きできる (Colab 以外での実行やベンチマーク用)
+PROJECT_ROOT_PATH = os.environ.get("MYSITEGEN_PROJECT_ROOT", "/content/MySiteGen-Agent")
 BASE_DIR = os.path.join(PROJECT_ROOT_PATH, "output", "docs")
 REPORTS_DIR = os.path.join(PROJECT_ROOT_PATH, "output", "output_reports")
 
 REPORT_FILE = os.path.join(REPORTS_DIR, "planned_articles.md")
+# AS-IS スキャンの途中結果 (中断しても次回はここから再開する)
+SCAN_PROGRESS_FILE = os.path.join(REPORTS_DIR, "as_is_scan.partial.jsonl")
 DEFAULT_ARTICLE_COUNT = 3
 
-def setup_client():
-    try:
-        from google.colab import userdata
-        GOOGLE_API_KEY = userdata.get('GEMINI_API_KEY')
-        if not GOOGLE_API_KEY: raise ValueError("No API KEY")
-        return genai.Client(api_key=GOOGLE_API_KEY)
-    except ImportError:
-        GOOGLE_API_KEY = os.environ.get('GEMINI_API_KEY')
-        if not GOOGLE_API_KEY: raise EnvironmentError("No API KEY")
-        return genai.Client(api_key=GOOGLE_API_KEY)
-    except Exception as e:
-        print(f"❌ クライアント初期化エラー: {e}")
-        return None
-
 def load_corporate_identity():
     identity_file = os.path.join(REPORTS_DIR, "01_identity.md")
     try:
@@ -60,7 +54,8 @@ def load_corporate_identity():
                 return generate_corporate_identity(setup_client(), f.read(), 'personal')
         except: return "パーパス: データによる個人の生活最適化。"
 
-def main():
+def main(rescan=False):
+    """rescan=True (--rescan) の場合は記事レジストリを空にし、既存サイトをスキャンし直して計画を作り直す。"""
     print(f"--- 🔄 HP改善サイクル (フェーズ5-8) [戦略的バランスモード] 開始 ---")
     gemini_client = setup_client()
     if gemini_client is None: sys.exit(1)
@@ -70,28 +65,35 @@ def main():
     else: SITE_TYPE = 'personal'
     print(f"✅ サイトタイプ: {SITE_TYPE}")
 
+    # 計画は記事レジストリから読み込み、連番の払い出しと計画ファイル (planned_articles.md) の書き出しもレジストリで行う
+    registry = open_article_registry(REPORTS_DIR, BASE_DIR)
+    if rescan:
+        registry.reset()
+
     # --- 5a. 戦略（AS-IS分析）---
-    processed_articles = []
-    if os.path.exists(REPORT_FILE):
-        processed_articles = load_markdown_table_to_list(REPORT_FILE)
-        processed_articles = [r for r in processed_articles if not r.get('file_name', '').startswith(':---')]
+    processed_articles = registry.articles()
+    if processed_articles:
         print(f"✅ 計画ファイルから {len(processed_articles)} 件読み込み")
     else:
         print(f"⚠️ 計画ファイルなし。実ファイルスキャン開始。")
         if not os.path.isdir(BASE_DIR): sys.exit(1)
-        current_time_iso = datetime.now().isoformat()
-        for root, _, files in os.walk(BASE_DIR):
-            for filename in files:
-                if filename.lower().endswith(('.html', '.htm')):
-                    full_path = os.path.join(root, filename)
-                    ad, _ = analyze_article_structure(full_path)
-                    if ad:
-                        processed_articles.append({
-                            "file_name": os.path.relpath(full_path, BASE_DIR).replace(os.path.sep, '/'),
-                            "title": ad['page_title'],
-                            "summary": generate_article_purpose(gemini_client, ad, CORPORATE_IDENTITY),
-                            "created_at": current_time_iso, "updated_at": ""
-                        })
+        # 解析はプロセスプール、目的の生成は並列の LLM 呼び出しで行い、途中結果は SCAN_PROGRESS_FILE に逐次保存する
+        with telemetry_scope("as_is_scan"):
+            processed_articles, failed_files = scan_site_articles(
+                gemini_client, BASE_DIR, CORPORATE_IDENTITY, SCAN_PROGRESS_FILE, datetime.now().isoformat()
+            )
+        # 一部でも失敗したまま登録すると、以降の実行ではスキャンが省略されて欠けたままになるため、
+        # 途中結果 (SCAN_PROGRESS_FILE) を残して終了し、再実行で失敗したページだけを解析し直す
+        if failed_files:
+            print(f"❌ {len(failed_files)} ファイルの目的を生成できませんでした: {', '.join(failed_files[:10])}"
+                  f"{' ...' if len(failed_files) > 10 else ''}")
+            print(f"   成功した {len(processed_articles)} 件は {SCAN_PROGRESS_FILE} に保存済みです。再実行してください。")
+            sys.exit(1)
+        # スキャン結果はすぐに計画ファイルとして保存し、以降の実行ではスキャンを省略する
+        os.makedirs(REPORTS_DIR, exist_ok=True)
+        registry.register_many(processed_articles)
+        if os.path.exists(REPORT_FILE) and os.path.exists(SCAN_PROGRESS_FILE):
+            os.remove(SCAN_PROGRESS_FILE)
 
     # 5a-2. バランス分析
     hub_counts = {}
@@ -101,20 +103,29 @@ def main():
         if not p.get('file_name', '').endswith('index.html'):
             parent_hub = os.path.join(os.path.dirname(p.get('file_name', '')), 'index.html').replace(os.path.sep, '/')
             if parent_hub in hub_counts: hub_counts[parent_hub] += 1
-    
-    balance_report = "| ハブページ | 記事数 |\n| :--- | :--- |\n"
+
+    # 実際のリンク構造 (被リンク数・トップからのクリック深さ) はリンクグラフから求める (変更されたページだけを再解析)
+    link_graph = LinkGraph(BASE_DIR).refresh()
+    inbound_counts = link_graph.inbound_counts()
+    click_depths = link_graph.click_depths()
+    orphans = link_graph.orphans()
+    if orphans:
+        print(f"⚠️ どのページからもリンクされていないページ: {len(orphans)} 件 (例: {', '.join(orphans[:5])})")
+
+    balance_report = "| ハブページ | 記事数 | 被リンク数 | クリック深さ |\n| :--- | :--- | :--- | :--- |\n"
     for hub, count in hub_counts.items():
         if 'legal/' not in hub and 'contact/' not in hub and 'projects/' not in hub:
              if 'about/' not in hub:
-                balance_report += f"| {hub} | {count} |\n"
+                balance_report += f"| {hub} | {count} | {inbound_counts.get(hub, 0)} | {click_depths.get(hub, '到達不可')} |\n"
 
     # --- 5b. 戦略的優先度の決定 ---
     print("\n--- [フェーズ5b] ---")
     analysis_target = [p for p in processed_articles if not p.get('file_name', '').startswith('projects/')]
-    priority_result = select_priority_section_by_data(
-        gemini_client, create_placeholder_data(analysis_target), 
-        CORPORATE_IDENTITY, analysis_target, balance_report
-    )
+    with telemetry_scope("priority_section"):
+        priority_result = select_priority_section_by_data(
+            gemini_client, create_placeholder_data(analysis_target), 
+            CORPORATE_IDENTITY, analysis_target, balance_report
+        )
     priority_file = priority_result['file_name']
     try:
         priority_section_info = next(p for p in processed_articles if p['file_name'] == priority_file)
@@ -131,23 +142,24 @@ def main():
 
     # --- 6. 詳細記事の企画 ---
     print("\n--- [フェーズ6] ---")
-    max_num = 0
-    for p in processed_articles:
-        m = re.search(r'-(\d+)\.html$', p.get('file_name', ''))
-        if m and int(m.group(1)) > max_num: max_num = int(m.group(1))
-    start_number = max_num + 1
+    # 連番はレジストリのカウンタから払い出す (同時に実行された add_article などと重複しない)
+    allocated_numbers = registry.allocate_numbers(DEFAULT_ARTICLE_COUNT)
+    start_number = allocated_numbers[0]
     
-    # リトライロジック
-    article_plans = None
-    for attempt in range(3):
+    # 再試行 (レート制限・壊れたJSON) は generate_priority_article_titles 内の共通リトライポリシーが行う
+    with telemetry_scope("article_planning"):
         _, article_plans = generate_priority_article_titles(
             gemini_client, priority_section_info, CORPORATE_IDENTITY, DEFAULT_ARTICLE_COUNT, start_number
         )
-        if article_plans: break
-        print(f"⚠️ 企画失敗。リトライ {attempt+1}/3")
-        time.sleep(10 * (attempt + 1))
 
     if not article_plans: sys.exit(1)
+
+    # モデルが付けた連番はプロンプトの指示通りとは限らないため、払い出した範囲
+    # (start_number ... start_number + DEFAULT_ARTICLE_COUNT - 1) に振り直す (払い出した数を超える企画は捨てる)
+    article_plans = article_plans[:len(allocated_numbers)]
+    for i, (plan, number) in enumerate(zip(article_plans, allocated_numbers)):
+        _, slug, _ = split_file_name(str(plan.get('file_name') or ''))
+        plan['file_name'] = f"{slug or f'article-{i}'}-{number}.html"
     
     current_time_iso = datetime.now().isoformat()
     for plan in article_plans:
@@ -155,60 +167,89 @@ def main():
 
     # --- 7. HTML生成 ---
     print("\n--- [フェーズ7] ---")
-    new_article_files_generated = []
-    nav_list = [{"file_name": p['file_name'], "title": p['title'], "purpose": p.get('summary', '')} for p in processed_articles]
-
-    for i, plan in enumerate(article_plans):
-        target_dir = os.path.dirname(priority_section_info['file_name'])
-        file_name = os.path.join(target_dir, plan.get('file_name', f'error-{i}.html')).replace(os.path.sep, '/')
-        plan['file_name'] = file_name
-        print(f"🏭 {plan['title']}")
+    # フェーズ7・8の全ページで共通のプレフィックスは1度だけキャッシュし、フェーズ8の後に破棄する
+    # (途中で異常終了した場合も CONTEXT_CACHE_TTL_SECONDS で期限切れになる)
+    prefix_cache = open_prefix_cache(
+        gemini_client, MODEL_NAME_GEN,
+        build_page_prompt_prefix(CORPORATE_IDENTITY, None, SITE_TYPE),
+        display_name="improvement-cycle-page-prefix"
+    )
+    try:
+        # 新しい記事とハブの更新はステージングディレクトリに書き込み、フェーズ8の後にまとめて公開する
+        staged_docs = StagedDirectory(BASE_DIR).open()
+        new_article_files_generated = []
+        nav_list = [{"file_name": p['file_name'], "title": p['title'], "purpose": p.get('summary', '')} for p in processed_articles]
+
+        for i, plan in enumerate(article_plans):
+            target_dir = os.path.dirname(priority_section_info['file_name'])
+            file_name = os.path.join(target_dir, plan.get('file_name', f'error-{i}.html')).replace(os.path.sep, '/')
+            plan['file_name'] = file_name
+            print(f"🏭 {plan['title']}")
         
-        code = generate_single_page_html(
-            gemini_client, {'title': plan['title'], 'file_name': file_name, 'purpose': plan['summary']},
-            CORPORATE_IDENTITY, None, nav_list, SITE_TYPE=SITE_TYPE, retry_attempts=3, article_date=plan['created_at']
-        )
-        if "❌" not in code:
-            path = os.path.join(BASE_DIR, file_name)
-            os.makedirs(os.path.dirname(path), exist_ok=True)
-            with open(path, 'w', encoding='utf-8') as f: f.write(code)
-            new_article_files_generated.append(plan)
-
-    # --- 8. ハブ更新 ---
-    print("\n--- [フェーズ8] ---")
-    all_plans = integrate_content_data(processed_articles, article_plans)
-    hub_path = priority_file
-    newly_updated_hubs = []
+            with telemetry_scope("article_html"):
+                code = generate_single_page_html(
+                    gemini_client, {'title': plan['title'], 'file_name': file_name, 'purpose': plan['summary']},
+                    CORPORATE_IDENTITY, None, nav_list, SITE_TYPE=SITE_TYPE, retry_attempts=3, article_date=plan['created_at'],
+                    prefix_cache=prefix_cache
+                )
+            if "❌" not in code:
+                atomic_write_text(staged_docs.staged_path(file_name), code)
+                new_article_files_generated.append(plan)
+
+        # --- 8. ハブ更新 ---
+        print("\n--- [フェーズ8] ---")
+        all_plans = integrate_content_data(processed_articles, article_plans)
+        hub_path = priority_file
+        newly_updated_hubs = []
     
-    try:
-        parent = next(p for p in all_plans if p['file_name'] == hub_path)
-        parent['updated_at'] = current_time_iso
-        newly_updated_hubs.append(parent)
+        try:
+            parent = next(p for p in all_plans if p['file_name'] == hub_path)
+            parent['updated_at'] = current_time_iso
+            newly_updated_hubs.append(parent)
         
-        children = [p for p in all_plans if os.path.dirname(p.get('file_name','')) == os.path.dirname(hub_path) and p['file_name'] != hub_path]
-        links_html = "<ul>" + "".join([f"<li><a href='{os.path.basename(p['file_name'])}' class='text-blue-500 hover:underline'>{p['title']}</a>: {p.get('summary','')}</li>" for p in children]) + "</ul>"
+            # 子記事は一覧ページの表示順に並べ、LISTING_PAGE_SIZE 件ずつのアーカイブ (index.html, page/2.html, ...) に分ける
+            section = os.path.dirname(hub_path)
+            children = sort_cards([
+                {"file_name": p['file_name'], "title": p['title'], "purpose": p.get('summary', ''), "created_at": p.get('created_at') or ''}
+                for p in all_plans if os.path.dirname(p.get('file_name','')) == section and p['file_name'] != hub_path
+            ])
+            archive = plan_section_archive(section, children)
+            # プロンプトには1ページ目の記事だけを渡す (セクションの全記事を並べるとプロンプトが記事数に比例して膨らむ)
+            first_page = archive[0][2]
+            links_html = "<ul>" + "".join([f"<li><a href='{os.path.basename(p['file_name'])}' class='text-blue-500 hover:underline'>{p['title']}</a>: {p['purpose']}</li>" for p in first_page]) + "</ul>"
+            if len(archive) > 1:
+                links_html += f"\n(ほか {len(children) - len(first_page)} 件の記事は {len(archive) - 1} ページのアーカイブに掲載されます)"
         
-        nav_list_hub = [{"file_name": p['file_name'], "title": p['title'], "purpose": p.get('summary', '')} for p in all_plans]
+            nav_list_hub = [{"file_name": p['file_name'], "title": p['title'], "purpose": p.get('summary', '')} for p in all_plans]
         
-        # ⬇️ [修正] summary が None の場合のガード処理を追加
-        parent_summary = parent.get('summary') or parent.get('purpose') or ""
+            # ⬇️ [修正] summary が None の場合のガード処理を追加
+            parent_summary = parent.get('summary') or parent.get('purpose') or ""
         
-        code = generate_single_page_html(
-            gemini_client,
-            # ⬇️ [修正] purposeの結合部分を安全に
-            {'file_name': parent['file_name'], 'title': parent['title'], 'purpose': parent_summary + f"\n\n【記事リスト】\n{links_html}"},
-            CORPORATE_IDENTITY, None, nav_list_hub, SITE_TYPE=SITE_TYPE, retry_attempts=3, article_date=current_time_iso
-        )
-        if "❌" not in code:
-            with open(os.path.join(BASE_DIR, parent['file_name']), 'w', encoding='utf-8') as f: f.write(code)
-            print(f"✅ ハブ更新: {parent['file_name']}")
+            # セクションのハブは GRID_PLACEHOLDER を残したシェルとして生成し、記事カードはアーカイブの各ページに Python で差し込む
+            with telemetry_scope("hub_update"):
+                code = generate_single_page_html(
+                    gemini_client,
+                    # ⬇️ [修正] purposeの結合部分を安全に
+                    {'file_name': parent['file_name'], 'title': parent['title'], 'purpose': parent_summary + f"\n\n【記事リスト】\n{links_html}"},
+                    CORPORATE_IDENTITY, None, nav_list_hub, SITE_TYPE=SITE_TYPE, retry_attempts=3, article_date=current_time_iso,
+                    prefix_cache=prefix_cache, keep_grid_placeholder=bool(section)
+                )
+            if "❌" not in code and section and GRID_PLACEHOLDER in code:
+                written = write_section_archive(staged_docs.path, section, code, children, BuildManifest(staged_docs.path))
+                print(f"✅ ハブ更新: {parent['file_name']} ({len(children)}件の記事, {written}/{len(archive)} ページを書き出し)")
+            elif "❌" not in code:
+                atomic_write_text(staged_docs.staged_path(parent['file_name']), code.replace(GRID_PLACEHOLDER, ""))
+                print(f"✅ ハブ更新: {parent['file_name']}")
             
-    except StopIteration: pass
+        except StopIteration: pass
+    finally:
+        if prefix_cache is not None:
+            prefix_cache.close()
+    staged_docs.publish()
 
     # --- 9. 保存 ---
     print("\n--- [フェーズ9] ---")
-    os.makedirs(REPORTS_DIR, exist_ok=True)
-    save_to_markdown(all_plans, REPORT_FILE)
+    registry.register_many(all_plans)
 
     # --- 10. X投稿用JSON生成 (URL自動解決版) ---
     print("\n--- [フェーズ10: X投稿リスト生成] ---")
@@ -242,11 +283,13 @@ def main():
 
     # --- 11. タグ挿入 ---
     print("\n--- [フェーズ11] ---")
-    try: inject_tags_main()
+    # ID は環境変数 GTM_ID / ADSENSE_CLIENT_ID から渡す (未設定で端末から実行した場合のみ入力を待つ)
+    try: inject_tags_main(base_dir=BASE_DIR)
     except: pass
 
     print("--- 完了 ---")
 
 if __name__ == "__main__":
     if PROJECT_ROOT_PATH not in sys.path: sys.path.append(PROJECT_ROOT_PATH)
-    main()
+    # --rescan: 登録済みの計画を破棄し、既存サイトのスキャンからやり直す
+    main(rescan="--rescan" in sys.argv[1:])
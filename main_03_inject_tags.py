@@ -1,9 +1,15 @@
 import os
 import sys
 import re
+import argparse
 import threading
 import time
-from bs4 import BeautifulSoup
+from concurrent.futures import ProcessPoolExecutor
+from utils.publish_utils import atomic_write_text, StagedDirectory
+try:
+    from config import settings
+except ImportError:
+    settings = None
 
 # --- 0. 設定 ---
 try:
@@ -76,23 +82,176 @@ def input_with_timeout(prompt, timeout):
         return None
 
 
-def main():
-    GTM_ID = None
-    ADSENSE_CLIENT_ID = None
 
-    # --- 1. タイムアウト付き入力でIDを取得 ---
-    
-    # GTM ID の入力待ち
-    user_input_gtm = input_with_timeout("GTM IDを入力してください (例: GTM-XXXXXX)", INPUT_TIMEOUT_SECONDS)
-    if user_input_gtm:
-        GTM_ID = user_input_gtm
-        print(f"👉 GTM_ID: {GTM_ID} を適用します。")
-
-    # AdSense ID の入力待ち
-    user_input_ads = input_with_timeout("AdSense Client IDを入力してください (例: ca-pub-XXXXXX)", INPUT_TIMEOUT_SECONDS)
-    if user_input_ads:
-        ADSENSE_CLIENT_ID = user_input_ads
+
+# --- 既存タグの検出・挿入 (文字列の切り貼り) ---
+# 文書全体をパースして再シリアライズせず、<head>/<body> の開始タグ直後だけを書き換える
+HEAD_OPEN_RE = re.compile(r"<head\b[^>]*>", re.IGNORECASE)
+HEAD_CLOSE_RE = re.compile(r"</head\s*>", re.IGNORECASE)
+BODY_OPEN_RE = re.compile(r"<body\b[^>]*>", re.IGNORECASE)
+# 前後の空白と直後の改行も一緒に取り除き、再挿入のたびに空行が増えないようにする
+ADSENSE_SCRIPT_RE = re.compile(
+    r"[ \t]*<script\b[^>]*\bsrc\s*=\s*[\"'][^\"']*adsbygoogle\.js[^\"']*[\"'][^>]*>\s*</script\s*>[ \t]*\n?",
+    re.IGNORECASE)
+GTM_SCRIPT_RE = re.compile(
+    r"[ \t]*<script\b[^>]*>(?:(?!</script).)*?gtm\.js(?:(?!</script).)*?</script\s*>[ \t]*\n?",
+    re.IGNORECASE | re.DOTALL)
+GTM_NOSCRIPT_RE = re.compile(
+    r"[ \t]*<noscript\b[^>]*>\s*<iframe\b[^>]*googletagmanager\.com[^>]*>\s*(?:</iframe\s*>)?\s*</noscript\s*>[ \t]*\n?",
+    re.IGNORECASE)
+
+TARGET_EXTENSIONS = ('.html', '.htm')
+
+
+def _insertion_points(html):
+    """(<head> の開始タグ, </head>, <body> の開始タグ) のマッチを返す。どれかが無ければ None。"""
+    head_open = HEAD_OPEN_RE.search(html)
+    head_close = HEAD_CLOSE_RE.search(html, head_open.end()) if head_open else None
+    body_open = BODY_OPEN_RE.search(html, head_close.end()) if head_close else None
+    if not body_open:
+        return None
+    return head_open, head_close, body_open
+
+
+def inject_tags(html, gtm_id=None, adsense_client_id=None):
+    """
+    html に GTM / AdSense のタグを挿入した文字列を返す。既に正しいタグが1つずつ入っている場合と、
+    <head>/<body> が見つからない場合は None を返す (書き込み不要)。
+    - AdSense: <head> 内の adsbygoogle.js の script を全て取り除き、<head> の先頭に挿入する。
+    - GTM: <head> 内の同じ ID の gtm.js の script と、<body> 内の googletagmanager の noscript を取り除き、
+      それぞれ先頭 (AdSense がある場合はその次) に挿入する。
+    """
+    points = _insertion_points(html)
+    if not points:
+        return None
+    head_open, head_close, body_open = points
+
+    head = html[head_open.end():head_close.start()]
+    body = html[body_open.end():]
+    adsense_tag = ADSENSE_HEAD_TEMPLATE.format(ADSENSE_CLIENT_ID=adsense_client_id) if adsense_client_id else None
+    gtm_head_tag = GTM_HEAD_TEMPLATE.format(GTM_ID=gtm_id) if gtm_id else None
+    gtm_body_tag = GTM_BODY_TEMPLATE.format(GTM_ID=gtm_id) if gtm_id else None
+
+    # --- 現在の状態の判定 (キーワードの出現回数が期待どおりなら正規表現は使わない) ---
+    def is_current(text, pattern, expected, keyword, match_filter=None):
+        if text.count(expected) != 1:
+            return False
+        if text.count(keyword) == expected.count(keyword):
+            return True
+        matches = [m for m in pattern.finditer(text) if not match_filter or match_filter(m)]
+        return len(matches) == 1
+
+    same_gtm = lambda m: gtm_id in m.group(0)
+    if ((not adsense_tag or is_current(head, ADSENSE_SCRIPT_RE, adsense_tag, "adsbygoogle"))
+            and (not gtm_id or (is_current(head, GTM_SCRIPT_RE, gtm_head_tag, "gtm.js", same_gtm)
+                                and is_current(body, GTM_NOSCRIPT_RE, gtm_body_tag, "googletagmanager")))):
+        return None
+
+    # --- 既存タグの削除 (重複防止) ---
+    if adsense_tag and "adsbygoogle" in head:
+        head = ADSENSE_SCRIPT_RE.sub("", head)
+    if gtm_id:
+        if "gtm.js" in head:
+            head = GTM_SCRIPT_RE.sub(lambda m: "" if same_gtm(m) else m.group(0), head)
+        if "googletagmanager" in body:
+            body = GTM_NOSCRIPT_RE.sub("", body)
+
+    # --- 挿入 ---
+    head_tags = "".join("\n" + tag for tag in (adsense_tag, gtm_head_tag) if tag)
+    if not head.startswith("\n"):
+        head_tags += "\n"
+    if gtm_body_tag:
+        body = "\n" + gtm_body_tag + ("" if body.startswith("\n") else "\n") + body
+    return (html[:head_open.end()] + head_tags + head
+            + html[head_close.start():body_open.end()] + body)
+
+
+def _inject_file(path, gtm_id, adsense_client_id, write):
+    """
+    ワーカーで実行する: path のタグの状態を確認し、(path, 状態) を返す。状態は "updated" (write=False なら "stale")、
+    "current" (既に正しい)、"skipped" (<head>/<body> なし)、または "error: ..."。
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            html = f.read()
+        if not _insertion_points(html):
+            return path, "skipped"
+        new_html = inject_tags(html, gtm_id, adsense_client_id)
+        if new_html is None:
+            return path, "current"
+        if not write:
+            return path, "stale"
+        atomic_write_text(path, new_html)
+        return path, "updated"
+    except Exception as e:
+        return path, f"error: {e}"
+
+
+def _list_html_files(base_dir):
+    paths = []
+    for root, dirs, files in os.walk(base_dir):
+        dirs.sort()
+        paths.extend(os.path.join(root, name) for name in sorted(files) if name.lower().endswith(TARGET_EXTENSIONS))
+    return paths
+
+
+def _map_files(paths, gtm_id, adsense_client_id, write, workers):
+    """paths を workers プロセスで _inject_file に掛け、{path: 状態} を返す。"""
+    args = (paths, [gtm_id] * len(paths), [adsense_client_id] * len(paths), [write] * len(paths))
+    if workers <= 1 or len(paths) < 2:
+        return dict(map(_inject_file, *args))
+    chunksize = max(1, len(paths) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return dict(pool.map(_inject_file, *args, chunksize=chunksize))
+
+
+def find_files_to_update(base_dir, gtm_id, adsense_client_id, workers):
+    """公開中のディレクトリを読み取りだけで走査し、タグの更新が必要なファイルの相対パスと集計を返す。"""
+    states = _map_files(_list_html_files(base_dir), gtm_id, adsense_client_id, False, workers)
+    stale = [os.path.relpath(path, base_dir) for path, state in states.items() if state == "stale"]
+    counts = {"current": 0, "skipped": 0, "error": 0}
+    for path, state in states.items():
+        if state.startswith("error"):
+            counts["error"] += 1
+            print(f"❌ エラー ({os.path.basename(path)}): {state[len('error: '):]}")
+        elif state in counts:
+            counts[state] += 1
+    return stale, counts
+
+
+def apply_tag_updates(staged, rel_paths, gtm_id, adsense_client_id, workers):
+    """ステージングディレクトリ内の rel_paths にタグを書き込み、更新できた件数を返す。"""
+    states = _map_files([staged.staged_path(rel) for rel in rel_paths], gtm_id, adsense_client_id, True, workers)
+    for path, state in states.items():
+        if state.startswith("error"):
+            print(f"❌ エラー ({os.path.basename(path)}): {state[len('error: '):]}")
+    return sum(1 for state in states.values() if state == "updated")
+
+
+def resolve_tag_ids(gtm_id=None, adsense_client_id=None, interactive=None):
+    """
+    挿入する ID を 引数 → 環境変数 (config/settings.py の GTM_ID / ADSENSE_CLIENT_ID) → 対話入力 の順に決める。
+    interactive=None の場合、どちらの ID も決まらず、標準入力が端末のときだけ入力を待つ。
+    """
+    gtm_id = gtm_id or getattr(settings, 'GTM_ID', None)
+    adsense_client_id = adsense_client_id or getattr(settings, 'ADSENSE_CLIENT_ID', None)
+    if interactive is None:
+        interactive = not gtm_id and not adsense_client_id and sys.stdin is not None and sys.stdin.isatty()
+    if interactive:
+        if not gtm_id:
+            gtm_id = input_with_timeout("GTM IDを入力してください (例: GTM-XXXXXX)", INPUT_TIMEOUT_SECONDS)
+        if not adsense_client_id:
+            adsense_client_id = input_with_timeout("AdSense Client IDを入力してください (例: ca-pub-XXXXXX)", INPUT_TIMEOUT_SECONDS)
+    if gtm_id:
+        print(f"👉 GTM_ID: {gtm_id} を適用します。")
+    if adsense_client_id:
         print(f"👉 AdSense ID を適用します。")
+    return gtm_id, adsense_client_id
+
+
+def main(gtm_id=None, adsense_client_id=None, interactive=None, base_dir=None, workers=None):
+    # --- 1. ID の決定 ---
+    GTM_ID, ADSENSE_CLIENT_ID = resolve_tag_ids(gtm_id, adsense_client_id, interactive)
 
     # IDがどちらもない場合は終了
     if not GTM_ID and not ADSENSE_CLIENT_ID:
@@ -103,93 +262,41 @@ def main():
     print(f"--- 🏷️ タグ挿入スクリプト開始 ---")
 
     # --- 2. サイトディレクトリのスキャン ---
-    if not os.path.isdir(BASE_DIR):
+    BASE_DIR_TARGET = base_dir or BASE_DIR
+    if not os.path.isdir(BASE_DIR_TARGET):
         # 代替パスの確認
         ALT_BASE_DIR = os.path.join(SCRIPT_DIR, "reports", "docs")
-        if os.path.isdir(ALT_BASE_DIR):
+        if not base_dir and os.path.isdir(ALT_BASE_DIR):
             BASE_DIR_TARGET = ALT_BASE_DIR
         else:
-            print(f"❌ サイトディレクトリ ({BASE_DIR}) が見つかりません。スキップします。")
+            print(f"❌ サイトディレクトリ ({BASE_DIR_TARGET}) が見つかりません。スキップします。")
             return
-    else:
-        BASE_DIR_TARGET = BASE_DIR
 
+    workers = workers or getattr(settings, 'INJECT_TAGS_WORKERS', None) or os.cpu_count() or 1
+    started = time.perf_counter()
+    stale, counts = find_files_to_update(BASE_DIR_TARGET, GTM_ID, ADSENSE_CLIENT_ID, workers)
+    print(f"🔎 {len(stale) + sum(counts.values())} ファイル中 {counts['current']} 件は設定済み、"
+          f"{len(stale)} 件を更新します ({workers} プロセス)。")
+
+    # --- 3. 書き換え (更新が必要なファイルがある場合のみステージングして公開) ---
     files_processed = 0
-    files_skipped = 0
-    TARGET_EXTENSIONS = ('.html', '.htm')
-
-    for root, _, files in os.walk(BASE_DIR_TARGET):
-        for filename in files:
-            if filename.lower().endswith(TARGET_EXTENSIONS):
-                full_path = os.path.join(root, filename)
-
-                try:
-                    with open(full_path, 'r', encoding='utf-8') as f:
-                        soup = BeautifulSoup(f, 'html.parser')
-
-                    modified = False
-
-                    if not soup.head or not soup.body:
-                         continue
-
-                    # --- 3. 既存タグの削除 (重複防止) ---
-                    # AdSense
-                    if ADSENSE_CLIENT_ID:
-                        existing_adsense = soup.head.find_all("script", {"src": re.compile(r"adsbygoogle\.js")})
-                        for tag in existing_adsense:
-                            tag.extract()
-                            modified = True
-
-                    # GTM
-                    if GTM_ID:
-                        # Headタグ
-                        existing_gtm_head = soup.head.find_all("script", string=re.compile(r"gtm\.js"))
-                        for tag in existing_gtm_head:
-                            if GTM_ID in tag.string:
-                                tag.extract()
-                                modified = True
-                        # Bodyタグ
-                        existing_gtm_body = soup.body.find_all("iframe", src=re.compile(r"googletagmanager\.com"))
-                        for tag in existing_gtm_body:
-                             if tag.parent.name == 'noscript':
-                                 tag.parent.extract()
-                                 modified = True
-
-                    # --- 4. AdSenseタグの挿入 ---
-                    if ADSENSE_CLIENT_ID:
-                        adsense_script_tag = BeautifulSoup(ADSENSE_HEAD_TEMPLATE.format(ADSENSE_CLIENT_ID=ADSENSE_CLIENT_ID), 'html.parser')
-                        soup.head.insert(0, adsense_script_tag)
-                        modified = True
-
-                    # --- 5. GTMタグの挿入 ---
-                    if GTM_ID:
-                        # Head挿入 (AdSenseがある場合はその次、なければ先頭)
-                        gtm_script_tag = BeautifulSoup(GTM_HEAD_TEMPLATE.format(GTM_ID=GTM_ID), 'html.parser')
-                        insert_position = 1 if ADSENSE_CLIENT_ID else 0
-                        soup.head.insert(insert_position, gtm_script_tag)
-
-                        # Body挿入 (先頭)
-                        gtm_noscript_tag = BeautifulSoup(GTM_BODY_TEMPLATE.format(GTM_ID=GTM_ID), 'html.parser')
-                        soup.body.insert(0, gtm_noscript_tag)
-                        modified = True
-
-                    # --- 6. 保存 ---
-                    if modified:
-                        html_output = str(soup)
-                        # bs4による属性の崩れを修正
-                        html_output = re.sub(r'async=""', 'async', html_output)
-                        html_output = re.sub(r'crossorigin=""', 'crossorigin', html_output)
-
-                        with open(full_path, 'w', encoding='utf-8') as f:
-                            f.write(html_output)
-                        files_processed += 1
-                    else:
-                        files_skipped += 1
-
-                except Exception as e:
-                    print(f"❌ エラー ({filename}): {e}")
-
-    print(f"✅ 合計 {files_processed} 件のファイルにタグを挿入/更新しました。")
+    if stale:
+        staged = StagedDirectory(BASE_DIR_TARGET).open()
+        files_processed = apply_tag_updates(staged, stale, GTM_ID, ADSENSE_CLIENT_ID, workers)
+        if files_processed:
+            staged.publish()
+        else:
+            staged.discard()
+    print(f"✅ 合計 {files_processed} 件のファイルにタグを挿入/更新しました。({time.perf_counter() - started:.1f} 秒)")
+
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="サイト内の全HTMLに GTM / AdSense タグを挿入する")
+    parser.add_argument("--gtm-id", help="GTM ID (例: GTM-XXXXXX)。省略時は環境変数 GTM_ID")
+    parser.add_argument("--adsense-client-id", help="AdSense Client ID (例: ca-pub-XXXXXX)。省略時は環境変数 ADSENSE_CLIENT_ID")
+    parser.add_argument("--base-dir", help=f"対象のサイトディレクトリ (既定: {BASE_DIR})")
+    parser.add_argument("--workers", type=int, help="並列プロセス数 (既定: INJECT_TAGS_WORKERS または CPU 数)")
+    parser.add_argument("--no-input", action="store_true", help="ID を対話入力で尋ねない")
+    args = parser.parse_args()
+    main(args.gtm_id, args.adsense_client_id, interactive=False if args.no_input else None,
+         base_dir=args.base_dir, workers=args.workers)
@@ -4,10 +4,6 @@ import importlib
 import json
 import re
 from datetime import datetime
-from google import genai
-from google.genai import types
-import requests
-from bs4 import BeautifulSoup
 import xml.etree.ElementTree as ET
 
 # --- 1. Botのセットアップ ---
@@ -41,6 +37,16 @@ except ImportError as e:
     sys.exit(1)
 # ⬆️ [修正] ここまで
 
+# テレメトリ: Bot の config を読み込んだ後に import する (config.settings が無いため設定は既定値で動作する)
+from utils.telemetry import scope as telemetry_scope, traced_generate_content
+from utils.lazy_import import lazy_import
+
+# google.genai / requests / bs4 は実際に使うときまで読み込まない
+genai = lazy_import("google.genai")
+types = lazy_import("google.genai.types")
+requests = lazy_import("requests")
+bs4 = lazy_import("bs4")
+
 # --- 定数定義 ---
 PERSONA_FILE_PATH = os.path.join(BOT_DIR, 'data', 'knowledge_base', 'persona.txt')
 try:
@@ -49,15 +55,18 @@ except ImportError:
     MODEL_NAME_PRO = "gemini-3-flash-preview"
 
 # --- ペルソナファイルの作成 ---
-try:
-    os.makedirs(os.path.dirname(PERSONA_FILE_PATH), exist_ok=True)
-    persona_content = """
+PERSONA_CONTENT = """
 A-Kカルマ: 大清水さち著『ツインシグナル』におけるリュケイオンの市長ロボットの包括的ペルソナ分析序論大清水さち著『ツインシグナル』は、音井博士によって生み出されたHFR（ヒューマンフォームロボット＝人間形態ロボット）であるシグナルと、その孫である信彦の関係性を軸に展開される、ロボットコミックの傑作として広く認知されています。この作品は、人間と高度なロボットが織りなす複雑な関係性、アイデンティティ、そして技術倫理といったテーマを深く掘り下げています。その広範な登場人物の中でも、A-Kカルマは特に多角的で進化するキャラクターとして際立っています。彼は当初、海洋都市リュケイオンの市長ロボットとして登場しますが、その旅路は単なる高機能な管理者にとどまらず、深い感情とリーダーシップを兼ね備えた存在へと変貌していきます。本報告書の目的は、カルマの起源、独自の能力、多面的な性格、物語における重要な変遷、そして『ツインシグナル』の物語全体に与える永続的な影響を詳細に分析し、彼の包括的なペルソナを明確にすることにあります。カルマのキャラクターは、単なる機能的な役割を超え、物語の核心的なテーマを深く探求する上で重要な役割を果たしています。彼が持つ「デリケートな感情プログラム」という設定は、彼が単なる機械的な存在ではなく、人間のような繊細な内面を持つことを示唆しています。また、彼が経験する「壮大な再生の儀式」と呼ばれる物語上の大きな転換点は、ロボットがどのようにして自己のアイデンティティを確立し、感情的に成長していくのかという、シリーズの根底にある問いかけを具現化しています。彼のペルソナの探求は、彼の行動や役割だけでなく、彼がどのようにして「人間性」や「ロボットらしさ」の境界線を曖昧にし、最終的にはそれを超越し得る存在として描かれているかを明らかにします。このキャラクターの複雑な描写は、『ツインシグナル』が単なるロボットアクション漫画に留まらず、人工知能、アイデンティティ、そして非人間的存在における感情的・心理的発展の可能性といった深遠なテーマを探る作品であることを示しています。
 """
-    with open(PERSONA_FILE_PATH, 'w', encoding='utf-8') as f:
-        f.write(persona_content)
-except Exception as e:
-    print(f"⚠️ ペルソナ書き込みエラー: {e}")
+
+def write_persona_file():
+    """ペルソナファイルを Bot の knowledge_base に書き出す (import 時ではなく実行時に呼ぶ)。"""
+    try:
+        os.makedirs(os.path.dirname(PERSONA_FILE_PATH), exist_ok=True)
+        with open(PERSONA_FILE_PATH, 'w', encoding='utf-8') as f:
+            f.write(PERSONA_CONTENT)
+    except Exception as e:
+        print(f"⚠️ ペルソナ書き込みエラー: {e}")
 
 # --- 補助関数 ---
 def scrape_website_text(url: str) -> str:
@@ -66,7 +75,7 @@ def scrape_website_text(url: str) -> str:
         headers = {'User-Agent': 'Mozilla/5.0'}
         response = requests.get(url, headers=headers, timeout=10)
         response.raise_for_status()
-        soup = BeautifulSoup(response.text, 'html.parser')
+        soup = bs4.BeautifulSoup(response.text, 'html.parser')
         for script_or_style in soup(["script", "style", "nav", "footer", "header", "aside"]):
             script_or_style.decompose()
         text = soup.get_text()
@@ -158,11 +167,13 @@ def generate_rich_content_from_topic(topic_data: dict) -> dict:
     """
     try:
         json_config = types.GenerateContentConfig(response_mime_type="application/json")
-        response_phase2 = client.models.generate_content(
-            model=MODEL_NAME_PRO, 
-            contents=prompt_phase2, 
-            config=json_config
-        )
+        with telemetry_scope("x_bot_tweet", page=main_url_for_tweet):
+            response_phase2 = traced_generate_content(
+                client,
+                model=MODEL_NAME_PRO, 
+                contents=prompt_phase2, 
+                config=json_config
+            )
         character_post = json.loads(response_phase2.text)
         print("--- [フェーズ2] ツイート生成完了。 ---")
     except Exception as e:
@@ -175,6 +186,7 @@ def generate_rich_content_from_topic(topic_data: dict) -> dict:
 
 if __name__ == "__main__":
     print("\n--- Bot Bridge Started ---")
+    write_persona_file()
     
     # パスの調整
     INPUT_JSON_PATH = os.path.abspath(os.path.join(PROJECT_ROOT, "../newly_updated_articles.json"))
@@ -3,8 +3,6 @@ import sys
 import re
 import json
 import random
-from google import genai
-from google.genai import types
 from datetime import datetime
 # --- 設定 ---
 # 環境変数の読み込みは config/settings.py で行われるためここでは不要
@@ -15,21 +13,32 @@ ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 # 親ディレクトリのMySiteGen-Agentのユーティリティをインポートするためのパス追加
 sys.path.append(ROOT_DIR)
 try:
-    from utils.client_utils import setup_client
+    from utils.client_utils import setup_client, generate_content, generate_json
+    from utils.telemetry import scope as telemetry_scope
     from agents.agent_03_generation import generate_single_page_html
-    from tools.update_listings import update_all_listings
+    from tools.update_listings import update_listing_card
+    from utils.publish_utils import atomic_write_text, directory_lock
+    from utils.article_registry import open_article_registry, REGISTRY_NAME
     from config.settings import MODEL_NAME_PRO
 except ImportError:
     print("Error: MySiteGen-Agentのユーティリティまたは設定をインポートできませんでした。")
     sys.exit(1)
+from utils.lazy_import import lazy_import
+
+types = lazy_import("google.genai.types")
+
+def has_article_plan(project_path):
+    """output_reports に計画ファイル (planned_articles.md) または記事レジストリがあるかを返す"""
+    reports_dir = os.path.join(project_path, "output_reports")
+    return any(os.path.exists(os.path.join(reports_dir, name)) for name in ("planned_articles.md", REGISTRY_NAME))
 
 def find_projects():
-    """output_reports/planned_articles.md を含むディレクトリを探す"""
+    """output_reports に計画ファイル (planned_articles.md) または記事レジストリを含むディレクトリを探す"""
     projects = []
     for item in os.listdir(ROOT_DIR):
         item_path = os.path.join(ROOT_DIR, item)
         if os.path.isdir(item_path) and item not in ["agents", "config", "tools", "utils", "venv", "__pycache__", ".git"]:
-            if os.path.exists(os.path.join(item_path, "output_reports", "planned_articles.md")):
+            if has_article_plan(item_path):
                 projects.append(item_path)
     
     projects_dir = os.path.join(ROOT_DIR, "projects")
@@ -37,42 +46,11 @@ def find_projects():
         for item in os.listdir(projects_dir):
             item_path = os.path.join(projects_dir, item)
             if os.path.isdir(item_path):
-                if os.path.exists(os.path.join(item_path, "output_reports", "planned_articles.md")):
+                if has_article_plan(item_path):
                     if item_path not in projects:
                         projects.append(item_path)
     return projects
 
-def get_next_number(base_docs_dir):
-    """docs 配下の全ディレクトリ内のファイル名から最大の数字を探して +1 を返す"""
-    max_num = 0
-    if not os.path.exists(base_docs_dir):
-        return 1
-    
-    # 探索対象のサブディレクトリ
-    subdirs = ['projects', 'insights', 'philosophy', 'about', 'legal']
-    
-    for subdir in subdirs:
-        target_dir = os.path.join(base_docs_dir, subdir)
-        if os.path.exists(target_dir):
-            for f in os.listdir(target_dir):
-                # ファイル名の末尾の数字を抽出 (例: name-37.html -> 37)
-                match = re.search(r"-(\d+)\.html$", f)
-                if match:
-                    num = int(match.group(1))
-                    if num > max_num:
-                        max_num = num
-    
-    # ルート直下のリテラルファイルも一応チェック
-    for f in os.listdir(base_docs_dir):
-        if f.endswith('.html'):
-            match = re.search(r"-(\d+)\.html$", f)
-            if match:
-                num = int(match.group(1))
-                if num > max_num:
-                    max_num = num
-
-    return max_num + 1
-
 def get_multiline_input(prompt):
     print(prompt)
     print("(入力を完了するには、Windowsなら Ctrl+Z、または 'END' とだけ入力してEnter)")
@@ -146,6 +124,8 @@ def main():
     REPORTS_DIR = os.path.join(project_root, "output_reports")
     PLANNED_FILE = os.path.join(REPORTS_DIR, "planned_articles.md")
     IDENTITY_FILE = os.path.join(REPORTS_DIR, "01_identity.md")
+    # 連番の払い出しと計画ファイルへの登録は記事レジストリで行う (同時に実行しても番号や行が重複しない)
+    registry = open_article_registry(REPORTS_DIR, DOCS_DIR)
 
     # 設定ファイルのロード (GTM_ID 等)
     settings = {}
@@ -196,14 +176,17 @@ def main():
         }}
         """
         try:
-            resp = client.models.generate_content(
-                model=MODEL_NAME, 
-                contents=prompt,
-                config=types.GenerateContentConfig(response_mime_type="application/json")
-            )
-            data = json.loads(resp.text)
+            # 壊れたJSONや項目の欠けた応答は generate_json 内で再生成される (キャッシュもされない)
+            with telemetry_scope("add_article_plan"):
+                data = generate_json(
+                    client,
+                    model=MODEL_NAME,
+                    contents=prompt,
+                    config=types.GenerateContentConfig(response_mime_type="application/json"),
+                    validate=lambda plan: isinstance(plan, dict) and all(plan.get(k) for k in ("title", "purpose", "slug"))
+                )
             
-            next_num = get_next_number(DOCS_DIR)
+            next_num = registry.allocate_numbers()[0]
             target_article = {
                 "title": data["title"],
                 "file_name": f"projects/{data['slug']}-{next_num}.html",
@@ -234,10 +217,11 @@ def main():
         
         print("AIにファイル名を相談中...")
         prompt = f"「{title}」のスラッグを考案してください。出力はスラッグのみ。"
-        resp = client.models.generate_content(model=MODEL_NAME, contents=prompt)
+        with telemetry_scope("add_article_slug"):
+            resp = generate_content(client, model=MODEL_NAME, contents=prompt)
         slug = resp.text.strip().lower().replace(".html", "")
         
-        next_num = get_next_number(DOCS_DIR)
+        next_num = registry.allocate_numbers()[0]
         target_article = {
             "title": title,
             "file_name": f"{section}/{slug}-{next_num}.html",
@@ -250,22 +234,16 @@ def main():
 
     elif mode == "3":
         # 既存計画モード
-        with open(PLANNED_FILE, "r", encoding="utf-8") as f:
-            content = f.read()
-        articles = []
-        for line in content.splitlines():
-            if line.startswith("|") and not "ファイル名" in line and not "---" in line:
-                parts = [p.strip() for p in line.split("|")]
-                if len(parts) >= 4:
-                    articles.append({"file_name": parts[1], "title": parts[2], "purpose": parts[3]})
-        
-        sections = sorted(list(set([a["file_name"].split("/")[0] for a in articles])))
+        sections = registry.sections()
         print("\nセクションを選択:")
         for i, s in enumerate(sections): print(f"[{i}] {s}")
         sel = int(input("選択: "))
         target_section = sections[sel]
         
-        section_articles = [a for a in articles if a["file_name"].startswith(target_section + "/")]
+        section_articles = [
+            {"file_name": a["file_name"], "title": a["title"], "purpose": a["summary"]}
+            for a in registry.articles(target_section)
+        ]
         for i, a in enumerate(section_articles):
             status = "[済]" if os.path.exists(os.path.join(DOCS_DIR, a["file_name"])) else "[未]"
             print(f"[{i}] {status} {a['title']}")
@@ -295,24 +273,20 @@ def main():
     )
     if html_content:
         output_path = os.path.join(DOCS_DIR, target_article["file_name"])
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        with open(output_path, "w", encoding="utf-8") as f:
-            f.write(html_content)
-        print(f"\n✅ 生成成功: {output_path}")
+        # 公開中の docs に直接書き込むため、ステージング中の他のプロセス (main_02 など) の公開を待ってから書き込む
+        with directory_lock(DOCS_DIR):
+            atomic_write_text(output_path, html_content)
+            print(f"\n✅ 生成成功: {output_path}")
 
-        if target_article.get("is_new"):
-            with open(PLANNED_FILE, "a", encoding="utf-8") as f:
-                f.write(f"\n| {target_article['file_name']} | {target_article['title']} | {target_article['purpose']} |")
-            print(f"  > 計画ファイルに追記しました: {PLANNED_FILE}")
-            
-            # --- 一覧ページを自動更新 ---
-            # 記事が属するセクション名を取得 (例: projects/slug.html -> projects)
-            target_section = None
-            if "/" in target_article['file_name']:
-                target_section = target_article['file_name'].split('/')[0]
-            
-            print(f"\n一覧ページ({target_section})を自動更新中...")
-            update_all_listings(project_root, target_section)
+            if target_article.get("is_new"):
+                registry.register(target_article['file_name'], target_article['title'], target_article['purpose'],
+                                  created_at=today_str)
+                print(f"  > 計画ファイルに追記しました: {PLANNED_FILE}")
+
+                # --- 一覧ページを自動更新 ---
+                # 記事が属するセクションの一覧ページに、この記事のカードだけを差し込む (例: projects/slug.html -> projects/index.html)
+                print("\n一覧ページにカードを追加中...")
+                update_listing_card(project_root, target_article['file_name'])
     else:
         print("❌ 生成に失敗しました。")
 
@@ -1,59 +1,105 @@
 import os
 import sys
-import bs4
+import json
+import argparse
+import xml.etree.ElementTree as ET
 
-def check_links(project_root):
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+from utils.link_graph import LinkGraph
+from utils.publish_utils import atomic_write_text
+try:
+    from config import settings
+except ImportError:
+    settings = None
+
+
+def check_links(project_root, workers=None, json_file=None, junit_file=None):
+    """
+    <project_root>/docs 内の全 HTML の内部リンク (ページ内アンカーを含む) を検証し、結果の辞書を返す。
+    - ページの解析結果は utils/link_graph.py のリンクグラフに保存され、次回は変更されたページだけを解析する。
+    - リンク先の存在確認は走査時に作るパスの集合で行い、ファイルシステムには問い合わせない。
+    - 同じディレクトリからの同じ href (ヘッダーのナビゲーションなど) は1度だけ解決する。
+    - json_file / junit_file を指定すると、CI で扱える形式でも結果を書き出す。
+    docs が無い場合は None を返す。
+    """
     docs_root = os.path.join(project_root, "docs")
     if not os.path.exists(docs_root):
-        print(f"Error: {docs_root} が見見つかりません。")
-        return
+        print(f"Error: {docs_root} が見つかりません。")
+        return None
 
+    workers = workers or getattr(settings, 'CHECK_LINKS_WORKERS', None) or os.cpu_count() or 1
     print(f"Scanning files in {docs_root}...")
-    html_files = []
-    for root, dirs, files in os.walk(docs_root):
-        for file in files:
-            if file.endswith(".html"):
-                html_files.append(os.path.relpath(os.path.join(root, file), docs_root))
-
-    broken_links = []
-    total_links = 0
-    for rel_path in html_files:
-        full_path = os.path.join(docs_root, rel_path)
-        with open(full_path, "r", encoding="utf-8") as f:
-            soup = bs4.BeautifulSoup(f, "html.parser")
-            
-        for a in soup.find_all("a", href=True):
-            href = a["href"]
-            if href.startswith(("http", "mailto", "#")):
-                continue
-            
-            total_links += 1
-            # 内部リンクの存在確認
-            target_path = os.path.normpath(os.path.join(os.path.dirname(full_path), href))
-            if not os.path.exists(target_path):
-                broken_links.append({
-                    "source": rel_path,
-                    "href": href,
-                    "target": target_path
-                })
+    # 前回から変更されたページだけを解析し直し、保存済みのリンクグラフからリンク切れを求める
+    graph = LinkGraph(docs_root).refresh(workers)
+    html_files = sorted(graph.pages, key=lambda rel: rel.split("/"))
+    broken_links = graph.broken_edges()
+    total_links = graph.link_count
+
+    report = {
+        "docs_root": docs_root,
+        "files_checked": len(html_files),
+        "links_checked": total_links,
+        "unique_links": graph.unique_links,
+        "broken_links": broken_links,
+    }
 
     print(f"\n--- Scan Complete ---")
-    print(f"Files checked: {len(html_files)}")
-    print(f"Total internal links checked: {total_links}")
+    print(f"Files checked: {report['files_checked']}")
+    print(f"Total internal links checked: {total_links} (unique: {report['unique_links']})")
 
     if broken_links:
         print(f"\n[ERROR] {len(broken_links)} 件のリンク切れが見つかりました:")
         for link in broken_links:
             print(f"  Source: {link['source']}")
             print(f"  Href:   {link['href']}")
-            print(f"  Reason: Target not found at {link['target']}")
+            print(f"  Reason: {link['reason']} ({link['target']})")
             print("-" * 20)
     else:
         print("\n[SUCCESS] リンク切れは見つかりませんでした！")
 
+    if json_file:
+        atomic_write_text(json_file, json.dumps(report, ensure_ascii=False, indent=2))
+        print(f"📝 JSON レポート: {json_file}")
+    if junit_file:
+        atomic_write_text(junit_file, to_junit_xml(report, html_files))
+        print(f"📝 JUnit レポート: {junit_file}")
+    return report
+
+
+def to_junit_xml(report, html_files):
+    """ページごとに1つのテストケースとし、リンク切れを failure として表す JUnit XML を返す。"""
+    by_source = {}
+    for link in report["broken_links"]:
+        by_source.setdefault(link["source"], []).append(link)
+    suite = ET.Element("testsuite", {
+        "name": "check_links",
+        "tests": str(len(html_files)),
+        "failures": str(len(by_source)),
+        "errors": "0",
+    })
+    for rel_path in html_files:
+        case = ET.SubElement(suite, "testcase", {"classname": "check_links", "name": rel_path})
+        links = by_source.get(rel_path)
+        if links:
+            failure = ET.SubElement(case, "failure", {
+                "message": f"{len(links)} 件のリンク切れ",
+                "type": "BrokenLink",
+            })
+            failure.text = "\n".join(f"{link['href']}: {link['reason']} ({link['target']})" for link in links)
+    return ET.tostring(ET.ElementTree(suite).getroot(), encoding="unicode", xml_declaration=True) + "\n"
+
+
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python check_links.py <project_root>")
-        sys.exit(1)
-    
-    check_links(sys.argv[1])
+    parser = argparse.ArgumentParser(description="docs 内の内部リンク切れを検出する (リンク切れがあれば終了コード 1)")
+    parser.add_argument("project_root")
+    parser.add_argument("--workers", type=int, help="解析のプロセス数 (既定: CHECK_LINKS_WORKERS または CPU 数)")
+    parser.add_argument("--json", dest="json_file", help="結果を JSON で書き出すパス")
+    parser.add_argument("--junit", dest="junit_file", help="結果を JUnit XML で書き出すパス")
+    args = parser.parse_args()
+
+    report = check_links(args.project_root, args.workers, args.json_file, args.junit_file)
+    if report is None:
+        sys.exit(2)
+    sys.exit(1 if report["broken_links"] else 0)
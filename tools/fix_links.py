@@ -1,6 +1,13 @@
 import os
 import sys
-import bs4
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+from utils.publish_utils import atomic_write_text, StagedDirectory
+from utils.lazy_import import lazy_import
+
+bs4 = lazy_import("bs4")
 
 def fix_links(project_root):
     docs_root = os.path.join(project_root, "docs")
@@ -9,8 +16,10 @@ def fix_links(project_root):
         return
 
     print(f"Fixing links in {docs_root}...")
+    # 修正はステージングディレクトリで行い、最後に docs と入れ替える
+    staged = StagedDirectory(docs_root).open()
     html_files = []
-    for root, dirs, files in os.walk(docs_root):
+    for root, dirs, files in os.walk(staged.path):
         for file in files:
             if file.endswith(".html"):
                 html_files.append(os.path.join(root, file))
@@ -21,7 +30,7 @@ def fix_links(project_root):
             content = f.read()
 
         soup = bs4.BeautifulSoup(content, "html.parser")
-        rel_dir = os.path.relpath(os.path.dirname(file_path), docs_root)
+        rel_dir = os.path.relpath(os.path.dirname(file_path), staged.path)
         
         # 階層の深さを判定
         if rel_dir == ".":
@@ -45,10 +54,14 @@ def fix_links(project_root):
                     made_changes = True
 
         if made_changes:
-            with open(file_path, "w", encoding="utf-8") as f:
-                f.write(str(soup))
+            atomic_write_text(file_path, str(soup))
             modified_count += 1
 
+    if modified_count:
+        staged.publish()
+    else:
+        staged.discard()
+
     print(f"\n--- Repair Complete ---")
     print(f"Files modified: {modified_count}")
 
@@ -2,7 +2,6 @@ import os
 import sys
 import json
 import re
-from google import genai
 # .env wait handled by config/settings.py
 # load_dotenv(os.path.join(ROOT_DIR, ".env"))
 
@@ -11,31 +10,26 @@ ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(ROOT_DIR)
 
 from utils.client_utils import setup_client
-from agents.agent_03_generation import generate_single_page_html
+from agents.agent_03_generation import generate_single_page_html, page_input_fingerprint
+from utils.listing_utils import (
+    GRID_PLACEHOLDER, ListingShellStore, listing_fingerprint, render_archive_page, sort_cards, paginate,
+    write_section_archive, read_archive_cards, upsert_card, remove_card
+)
+from utils.manifest_utils import BuildManifest
+from utils.publish_utils import atomic_write_text, directory_lock, StagedDirectory
+from utils.article_registry import open_article_registry, REGISTRY_NAME
 from config import settings
 
-def load_planned_articles(planned_file):
-    """planned_articles.md から記事リストを読み込む"""
-    articles = []
-    if not os.path.exists(planned_file):
-        return articles
-    
-    try:
-        with open(planned_file, "r", encoding="utf-8") as f:
-            content = f.read()
-            for line in content.splitlines():
-                if line.startswith("|") and not "ファイル名" in line and not "---" in line:
-                    parts = [p.strip() for p in line.split("|")]
-                    if len(parts) >= 4:
-                        articles.append({
-                            "file_name": parts[1],
-                            "title": parts[2],
-                            "purpose": parts[3]
-                        })
-            print(f"  > {len(articles)} 件の記事を計画ファイルから読み込みました。")
-    except Exception as e:
-        print(f"計画ファイル読み込み失敗: {e}")
-    return articles
+def load_planned_articles(registry, section=None):
+    """記事レジストリから記事リスト (section 指定時はそのセクションのみ) を読み込む"""
+    return [
+        {"file_name": a["file_name"], "title": a["title"], "purpose": a["summary"], "created_at": a["created_at"]}
+        for a in registry.articles(section)
+    ]
+
+def load_section_cards(registry, section):
+    """セクション一覧ページに並べる記事 (一覧ページ自身を除く) を表示順で返す"""
+    return sort_cards([a for a in load_planned_articles(registry, section) if not a["file_name"].endswith("index.html")])
 
 def extract_gtm_id(html_path):
     if not os.path.exists(html_path): return None
@@ -54,31 +48,61 @@ def extract_common_parts(html_path):
         if f: snippets["footer"] = f.group(0)
     return snippets
 
-def update_all_listings(project_root, target_section=None):
-    """プロジェクト内の全一覧ページ（または指定セクションのみ）を再生成する"""
+def update_all_listings(project_root, target_section=None, force=False, refresh_shell=False):
+    """
+    プロジェクト内の全一覧ページ（または指定セクションのみ）を更新する。
+    一覧ページはセクションごとのシェル (LLM で1度だけ生成し、記事カードの位置に GRID_PLACEHOLDER を残したページ) に
+    Python で組み立てたカードグリッドを差し込んで作るため、記事の追加・削除では API を呼ばない。
+    シェルはアイデンティティ・共通パーツ等が変わった場合か refresh_shell=True の場合だけ作り直す。
+    シェルと記事リストが前回から変わっていないページはスキップする (force=True の場合は全て書き直す)。
+    """
+    # 公開中の一覧ページの読み取りからステージングの公開までを、他のプロセス (記事の追加など) と排他にする
+    with directory_lock(os.path.join(project_root, "docs")):
+        _update_all_listings(project_root, target_section, force, refresh_shell)
+
+def _update_all_listings(project_root, target_section, force, refresh_shell):
     docs_dir = os.path.join(project_root, "docs")
     reports_dir = os.path.join(project_root, "output_reports")
     planned_file = os.path.join(reports_dir, "planned_articles.md")
+    registry_file = os.path.join(reports_dir, REGISTRY_NAME)
     identity_file = os.path.join(reports_dir, "01_identity.md")
     
-    if not os.path.exists(planned_file):
+    # 計画ファイルはレジストリのビューなので、レジストリがあれば (ビューが消えていても書き出し直して) 続行する
+    if not os.path.exists(planned_file) and not os.path.exists(registry_file):
         print(f"  > 計画ファイルが見つかりません: {planned_file}")
         return
 
-    articles = load_planned_articles(planned_file)
+    registry = open_article_registry(reports_dir, docs_dir)
+    articles = load_planned_articles(registry)
+    print(f"  > {len(articles)} 件の記事を計画ファイルから読み込みました。")
     with open(identity_file, "r", encoding="utf-8") as f:
         identity = f.read()
     
-    client = setup_client()
+    client = None
+    shells = ListingShellStore(reports_dir)
+    manifest = BuildManifest(docs_dir, force=force)
+    # 書き換えが必要なページが見つかった時点で docs のステージングを開始し、最後にまとめて公開する
+    staged = None
+
+    def open_staging():
+        nonlocal staged
+        if staged is None:
+            staged = StagedDirectory(docs_dir).open()
+            manifest.rebase(staged.path)
+        return staged.path
+
     index_path = os.path.join(docs_dir, "index.html")
     gtm_id = extract_gtm_id(index_path)
     common_snippets = extract_common_parts(index_path)
 
     # セクションの特定 (projects, insights, philosophy, etc.)
-    all_sections = sorted(list(set([a["file_name"].split("/")[0] for a in articles if "/" in a["file_name"]])))
+    all_sections = registry.sections()
     
     # 指定がある場合はそのセクションのみ、なければ全て
     sections = [target_section] if target_section else all_sections
+    if refresh_shell:
+        for section in sections:
+            shells.invalidate(section)
     
     for section in sections:
         # 指定されたセクションが存在しない場合のガード
@@ -87,7 +111,7 @@ def update_all_listings(project_root, target_section=None):
             continue
 
         list_file = f"{section}/index.html"
-        section_articles = [a for a in articles if a["file_name"].startswith(f"{section}/") and not a["file_name"].endswith("index.html")]
+        section_articles = load_section_cards(registry, section)
         
         target_page = {
             "title": f"{section.capitalize()} | LOU-Ark",
@@ -95,37 +119,129 @@ def update_all_listings(project_root, target_section=None):
             "purpose": f"「{section}」セクションの一覧ページです。登録されている全記事をカード形式で魅力的に紹介してください。"
         }
 
-        print(f"  > 一覧ページ生成中: {list_file} ({len(section_articles)}件の記事)...")
-        # Debug: 記事リストの末尾を確認
-        if section_articles:
-            print(f"    Last article: {section_articles[-1]['file_name']}")
-
-        html = generate_single_page_html(
-            client, 
-            target_page, 
-            identity, 
-            None, 
-            section_articles, # ここにそのセクションの記事リストを渡す
+        # シェルは記事リストに依存しないため、記事を除いた入力の指紋で管理する
+        shell_fingerprint = page_input_fingerprint(
+            target_page, identity, None, [],
             GTM_ID=gtm_id,
             SITE_TYPE="personal",
             header_snippet=common_snippets.get("header"),
             footer_snippet=common_snippets.get("footer")
         )
+        shell = shells.get(section, shell_fingerprint)
+        if shell is None:
+            if client is None:
+                client = setup_client()
+            print(f"  > 一覧ページのシェルを生成中: {list_file}...")
+            shell = generate_single_page_html(
+                client, 
+                target_page, 
+                identity, 
+                None, 
+                section_articles, # ナビゲーションの文脈として渡す (カードはシェルに含めない)
+                GTM_ID=gtm_id,
+                SITE_TYPE="personal",
+                header_snippet=common_snippets.get("header"),
+                footer_snippet=common_snippets.get("footer"),
+                keep_grid_placeholder=True
+            )
+            if not shell or "❌" in shell or GRID_PLACEHOLDER not in shell:
+                print(f"  ❌ シェルの生成に失敗しました (GRID_PLACEHOLDER がありません): {list_file}")
+                continue
+            shells.save(section, shell_fingerprint, shell)
+
+        # 記事が多いセクションは index.html, page/2.html, ... に分け、カードの組が変わったページだけを書き出す。
+        # ステージング開始後は、マニフェストの判定もステージング内のファイルに対して行う
+        page_count = len(paginate(section_articles))
+        written = write_section_archive(
+            staged.path if staged else docs_dir, section, shell, section_articles, manifest,
+            open_root=None if staged else open_staging
+        )
+        if written:
+            print(f"  ✅ 更新完了: {list_file} ({len(section_articles)}件の記事, {written}/{page_count} ページを書き出し)")
+        else:
+            print(f"  ⏭️ 変更なし: {list_file} ({len(section_articles)}件の記事, {page_count} ページ)")
+
+    if staged is not None:
+        staged.publish()
+    manifest.report()
+
+def update_listing_card(project_root, file_name):
+    """
+    1記事の追加・更新・削除を、その記事のセクションの一覧ページ (アーカイブ) に反映する。
+    カードのマーカーを頼りに、影響を受ける1ページだけでカードを差し込み・置き換え・削除し、他のカードやシェルには触れない
+    (記事がレジストリにあれば差し込み・置き換え、無ければ削除)。
+    一覧ページやマーカーが無い場合、またはカードがページをまたいで移動する場合は update_all_listings でセクションを更新する。
+    """
+    if "/" not in file_name:
+        return
+    section = file_name.split("/", 1)[0]
+    docs_dir = os.path.join(project_root, "docs")
+    # 公開中の一覧ページを直接書き換えるため、ステージング中の他のプロセスの公開で変更が失われないようロックする
+    with directory_lock(docs_dir):
+        _update_listing_card(project_root, section, file_name)
+
+def _update_listing_card(project_root, section, file_name):
+    docs_dir = os.path.join(project_root, "docs")
+    reports_dir = os.path.join(project_root, "output_reports")
+
+    registry = open_article_registry(reports_dir, docs_dir)
+    section_articles = load_section_cards(registry, section)
+    page = next((a for a in section_articles if a["file_name"] == file_name), None)
+    chunks = paginate(section_articles)
+    current = read_archive_cards(docs_dir, section)
+
+    # 変更が1ページに収まり、そのページに必要なカードが揃っている場合だけ、そのページを書き換える
+    target = None
+    if current is not None and len(current) == len(chunks):
+        changed = [
+            i for i, ((_, _, cards), chunk) in enumerate(zip(current, chunks))
+            if list(cards) != [a["file_name"] for a in chunk] or (page is not None and page in chunk)
+        ]
+        if len(changed) == 1 and all(a["file_name"] in current[changed[0]][2] or a is page for a in chunks[changed[0]]):
+            target = changed[0]
+        elif not changed:
+            print(f"  ⏭️ 変更なし: {section}/index.html")
+            return
+    if target is None:
+        print(f"  > {section} の一覧ページはカード単位で更新できないため、セクション全体を更新します。")
+        update_all_listings(project_root, section)
+        return
+
+    rel_path, html, _ = current[target]
+    page_number = target + 1
+    order = [a["file_name"] for a in chunks[target]]
+    if page is not None:
+        patched = upsert_card(html, page, order, base="" if page_number == 1 else "../")
+    else:
+        patched = remove_card(html, file_name)
+    if patched == html:
+        print(f"  ⏭️ 変更なし: {rel_path}")
+        return
 
-        if html and "❌" not in html:
-            output_path = os.path.join(docs_dir, list_file)
-            os.makedirs(os.path.dirname(output_path), exist_ok=True)
-            with open(output_path, "w", encoding="utf-8") as f:
-                f.write(html)
-            print(f"  ✅ 更新完了: {list_file}")
+    list_path = os.path.join(docs_dir, *rel_path.split("/"))
+    atomic_write_text(list_path, patched)
+    # シェルから描画した結果と一致していれば、マニフェストも更新して次回の一括更新で書き直さないようにする
+    shell = ListingShellStore(reports_dir).latest(section)
+    if shell is not None and render_archive_page(shell, chunks[target], page_number, len(chunks)) == patched:
+        BuildManifest(docs_dir).record(list_path, listing_fingerprint(shell, chunks[target], page_number, len(chunks)))
+    if page is None:
+        action = "削除"
+    else:
+        action = "更新" if f"<!-- CARD:{file_name} -->" in html else "追加"
+    print(f"  ✅ カードを{action}しました: {rel_path} ({file_name}, {len(section_articles)}件の記事)")
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python update_listings.py <project_root_path> [section_name]")
+    # --force: 入力が変わっていないページも含めて全て書き直す
+    # --refresh-shell: 一覧ページのシェルを LLM で作り直す (デザインや導入文を更新したい場合)
+    force = "--force" in sys.argv[1:]
+    refresh_shell = "--refresh-shell" in sys.argv[1:]
+    args = [a for a in sys.argv[1:] if a not in ("--force", "--refresh-shell")]
+    if len(args) < 1:
+        print("Usage: python update_listings.py <project_root_path> [section_name] [--force] [--refresh-shell]")
         sys.exit(1)
     
-    project_root = sys.argv[1]
+    project_root = args[0]
     # 第2引数があればセクション指定として扱う
-    target_section = sys.argv[2] if len(sys.argv) > 2 else None
+    target_section = args[1] if len(args) > 1 else None
     
-    update_all_listings(project_root, target_section)
+    update_all_listings(project_root, target_section, force=force, refresh_shell=refresh_shell)
@@ -1,5 +1,8 @@
-import pandas as pd
-import numpy as np
+from utils.lazy_import import lazy_import
+
+# pandas は DataFrame を作るときまで読み込まない
+pd = lazy_import("pandas")
+
 
 def create_placeholder_data(target_articles):
     """全記事のファイル名をインデックスとし、ダミーのパフォーマンスDFを生成する。"""
@@ -0,0 +1,319 @@
+import os
+import re
+import sqlite3
+import posixpath
+import threading
+from contextlib import contextmanager
+from utils.publish_utils import atomic_write_text
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# output_reports 内に置くレジストリと、そのビューとして書き出す計画ファイル
+REGISTRY_NAME = "articles.sqlite3"
+PLANNED_FILE_NAME = "planned_articles.md"
+MARKDOWN_HEADING = "## 📜 コンテンツ全体計画 (既存 + 新規)"
+MARKDOWN_COLUMNS = {"ファイル名": "file_name", "タイトル": "title", "概要・目的": "summary", "生成された目的": "summary"}
+# 記事の連番 (例: insights/data-driven-life-12.html -> 12)
+ARTICLE_NUMBER_RE = re.compile(r"-(\d+)\.html?$", re.IGNORECASE)
+SEPARATOR_ROW_RE = re.compile(r"^\|[\s:\-|]+\|$")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS articles (
+    file_name  TEXT PRIMARY KEY,
+    section    TEXT NOT NULL,
+    slug       TEXT NOT NULL,
+    number     INTEGER,
+    title      TEXT NOT NULL DEFAULT '',
+    summary    TEXT NOT NULL DEFAULT '',
+    created_at TEXT NOT NULL DEFAULT '',
+    updated_at TEXT NOT NULL DEFAULT '',
+    position   INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS articles_section ON articles (section, position);
+CREATE TABLE IF NOT EXISTS sequences (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+ARTICLE_FIELDS = ("file_name", "section", "slug", "number", "title", "summary", "created_at", "updated_at")
+
+
+def split_file_name(file_name):
+    """"section/slug-12.html" を (セクション, スラッグ, 連番) に分ける。連番が無ければ None。"""
+    section = file_name.split("/", 1)[0] if "/" in file_name else ""
+    base = posixpath.basename(file_name)
+    match = ARTICLE_NUMBER_RE.search(base)
+    if match:
+        return section, base[:match.start()], int(match.group(1))
+    return section, posixpath.splitext(base)[0], None
+
+
+def _cell(value):
+    # 素朴に "|" で分割する読み手がいるため、セル内の区切り文字と改行は置き換える
+    return str(value or "").replace("|", "｜").replace("\r", " ").replace("\n", " ").strip()
+
+
+def parse_plan_markdown(text):
+    """計画ファイルの Markdown テーブルを [{file_name, title, summary}, ...] として読み込む。"""
+    columns = None
+    records = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line.startswith("|") or SEPARATOR_ROW_RE.match(line):
+            continue
+        cells = [c.strip().replace("**", "") for c in line.strip("|").split("|")]
+        if columns is None:
+            if "ファイル名" in cells:
+                columns = [MARKDOWN_COLUMNS.get(c) for c in cells]
+            continue
+        record = {key: value for key, value in zip(columns, cells) if key}
+        if record.get("file_name"):
+            records.append(record)
+    return records
+
+
+def render_plan_markdown(records):
+    """[{file_name, title, summary}, ...] を計画ファイルの Markdown テーブルにする。"""
+    lines = [MARKDOWN_HEADING, "", "| ファイル名 | タイトル | 概要・目的 |", "|---|---|---|"]
+    lines.extend(f"| {_cell(r['file_name'])} | {_cell(r.get('title'))} | {_cell(r.get('summary'))} |" for r in records)
+    return "\n".join(lines) + "\n"
+
+
+def _file_signature(path):
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+
+def _max_number_in_docs(docs_dir):
+    """docs 以下の全 HTML ファイル名から最大の連番を返す (レジストリの初回作成時に1度だけ使う)。"""
+    max_number = 0
+    if docs_dir and os.path.isdir(docs_dir):
+        for _, _, files in os.walk(docs_dir):
+            for filename in files:
+                match = ARTICLE_NUMBER_RE.search(filename)
+                if match:
+                    max_number = max(max_number, int(match.group(1)))
+    return max_number
+
+
+class ArticleRegistry:
+    """
+    記事 (ファイル名・セクション・スラッグ・連番・タイトル・概要・日時) と連番カウンタを保持する SQLite のレジストリ。
+    - 連番は allocate_numbers() がトランザクション内でカウンタを進めて払い出すため、同時に実行しても重複しない。
+    - 書き込みはプロセス間のファイルロック (<db>.lock) と BEGIN IMMEDIATE の中で行い、
+      終わるたびに markdown_path (planned_articles.md) をビューとして書き出す。
+    - 計画ファイルが外部で編集されていた場合 (最後に書き出したときと mtime・サイズが違う場合) は、
+      開くときにその内容を取り込む。計画ファイルが無くなっていた場合はレジストリを正とし、書き出し直す
+      (記事を消すのは reset() を明示的に呼んだときだけ)。連番カウンタは戻さないため、一度払い出した番号は再利用されない。
+    """
+
+    SEQUENCE = "article"
+
+    def __init__(self, db_path, markdown_path=None, docs_dir=None):
+        self.db_path = db_path
+        self.markdown_path = markdown_path
+        self.lock_path = db_path + ".lock"
+        self._thread_lock = threading.RLock()
+        self._lock_depth = 0
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(db_path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._file_lock():
+            self._conn.executescript(SCHEMA)
+        with self._transaction() as conn:
+            if self._sequence_value(conn) is None:
+                seed = max(_max_number_in_docs(docs_dir), self._max_registered_number(conn))
+                conn.execute("INSERT INTO sequences (name, value) VALUES (?, ?)", (self.SEQUENCE, seed))
+            imported = self._import_markdown_if_changed(conn)
+        if imported:
+            self.export_markdown()
+
+    # --- ロックとトランザクション ---
+
+    @contextmanager
+    def _file_lock(self):
+        # 同じスレッドからの入れ子の呼び出しでは flock を取り直さない (別の fd での flock は自分自身と競合する)
+        with self._thread_lock:
+            if self._lock_depth:
+                self._lock_depth += 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth -= 1
+                return
+            with open(self.lock_path, "a") as lock_file:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                self._lock_depth = 1
+                try:
+                    yield
+                finally:
+                    self._lock_depth = 0
+                    if fcntl:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    @contextmanager
+    def _transaction(self):
+        with self._file_lock():
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _sequence_value(self, conn):
+        row = conn.execute("SELECT value FROM sequences WHERE name = ?", (self.SEQUENCE,)).fetchone()
+        return row["value"] if row else None
+
+    @staticmethod
+    def _max_registered_number(conn):
+        return conn.execute("SELECT COALESCE(MAX(number), 0) FROM articles").fetchone()[0]
+
+    # --- 連番 ---
+
+    def allocate_numbers(self, count=1):
+        """連番を count 個払い出して昇順のリストで返す。"""
+        with self._transaction() as conn:
+            conn.execute("UPDATE sequences SET value = value + ? WHERE name = ?", (count, self.SEQUENCE))
+            start = self._sequence_value(conn) - count
+        return list(range(start + 1, start + count + 1))
+
+    # --- 記事 ---
+
+    def register(self, file_name, title=None, summary=None, created_at=None, updated_at=None):
+        self.register_many([{
+            "file_name": file_name, "title": title, "summary": summary,
+            "created_at": created_at, "updated_at": updated_at,
+        }])
+
+    def register_many(self, records):
+        """
+        記事を追加・更新して計画ファイルを書き出す。値が None の項目は既存の値を残す
+        (summary の代わりに generated_purpose / purpose も受け付ける)。新しい記事は末尾に追加される。
+        """
+        with self._transaction() as conn:
+            self._upsert(conn, records)
+        self.export_markdown()
+
+    def _upsert(self, conn, records):
+        position = conn.execute("SELECT COALESCE(MAX(position), 0) FROM articles").fetchone()[0]
+        max_number = 0
+        for record in records:
+            file_name = (record.get("file_name") or "").strip()
+            if not file_name:
+                continue
+            summary = record.get("summary")
+            if summary is None:
+                summary = record.get("generated_purpose", record.get("purpose"))
+            values = {"title": record.get("title"), "summary": summary,
+                      "created_at": record.get("created_at"), "updated_at": record.get("updated_at")}
+            existing = conn.execute("SELECT * FROM articles WHERE file_name = ?", (file_name,)).fetchone()
+            if existing:
+                merged = {key: existing[key] if value is None else value for key, value in values.items()}
+                if all(merged[key] == existing[key] for key in merged):
+                    continue
+                conn.execute(
+                    "UPDATE articles SET title = ?, summary = ?, created_at = ?, updated_at = ? WHERE file_name = ?",
+                    (merged["title"], merged["summary"], merged["created_at"], merged["updated_at"], file_name))
+                continue
+            section, slug, number = split_file_name(file_name)
+            position += 1
+            max_number = max(max_number, number or 0)
+            conn.execute(
+                "INSERT INTO articles (file_name, section, slug, number, title, summary, created_at, updated_at, position)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (file_name, section, slug, number, values["title"] or "", values["summary"] or "",
+                 values["created_at"] or "", values["updated_at"] or "", position))
+        # 手動で付けた番号とも重複しないよう、カウンタを登録済みの最大値まで進める
+        conn.execute("UPDATE sequences SET value = MAX(value, ?) WHERE name = ?", (max_number, self.SEQUENCE))
+
+    def get(self, file_name):
+        row = self._conn.execute(f"SELECT {', '.join(ARTICLE_FIELDS)} FROM articles WHERE file_name = ?", (file_name,)).fetchone()
+        return dict(row) if row else None
+
+    def sections(self):
+        """記事のあるセクション名 (トップ直下のページを除く) の一覧。"""
+        rows = self._conn.execute("SELECT DISTINCT section FROM articles WHERE section != '' ORDER BY section")
+        return [row["section"] for row in rows]
+
+    def articles(self, section=None):
+        """登録順の記事のリスト。section を指定するとそのセクションだけを返す。"""
+        query = f"SELECT {', '.join(ARTICLE_FIELDS)} FROM articles"
+        params = ()
+        if section is not None:
+            query += " WHERE section = ?"
+            params = (section,)
+        cursor = self._conn.cursor()
+        cursor.row_factory = None
+        return [dict(zip(ARTICLE_FIELDS, row)) for row in cursor.execute(query + " ORDER BY position", params)]
+
+    # --- 計画ファイル (ビュー) ---
+
+    def export_markdown(self, path=None):
+        """登録順の記事を計画ファイルとして書き出す。既定の markdown_path に書いた場合は、そのシグネチャを記録する。"""
+        path = path or self.markdown_path
+        if not path:
+            return
+        with self._file_lock():
+            atomic_write_text(path, render_plan_markdown(self.articles()))
+            if path == self.markdown_path:
+                self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('markdown_signature', ?)",
+                                   (_file_signature(path),))
+
+    def reset(self):
+        """
+        登録済みの記事を全て削除し、空の計画ファイルを書き出す (既存サイトをスキャンし直す場合に使う)。
+        連番カウンタは戻さない。
+        """
+        with self._transaction() as conn:
+            count = conn.execute("SELECT COUNT(*) FROM articles").fetchone()[0]
+            conn.execute("DELETE FROM articles")
+        self.export_markdown()
+        print(f"🧹 記事レジストリを空にしました ({count} 件を削除、連番カウンタは維持)")
+
+    def _import_markdown_if_changed(self, conn):
+        """
+        計画ファイルが最後の書き出し以降に変更されていれば、その内容で記事を置き換える。
+        計画ファイルが無くなっていた場合は記事を消さずに True を返す (呼び出し側でレジストリから書き出し直す)。
+        計画ファイルを書き出し直す必要があれば True。
+        """
+        if not self.markdown_path:
+            return False
+        row = conn.execute("SELECT value FROM meta WHERE key = 'markdown_signature'").fetchone()
+        recorded = row["value"] if row else None
+        current = _file_signature(self.markdown_path)
+        if current == recorded or (current is None and recorded is None):
+            return False
+        if current is None:
+            # 計画ファイルはビューにすぎないため、誤って消えた場合はレジストリの内容で復元する
+            print(f"♻️ 計画ファイルが見つからないため、記事レジストリから書き出し直します: {self.markdown_path}")
+            return True
+        with open(self.markdown_path, "r", encoding="utf-8") as f:
+            records = parse_plan_markdown(f.read())
+        keep = {r["file_name"] for r in records}
+        for existing in conn.execute("SELECT file_name FROM articles").fetchall():
+            if existing["file_name"] not in keep:
+                conn.execute("DELETE FROM articles WHERE file_name = ?", (existing["file_name"],))
+        self._upsert(conn, records)
+        # 計画ファイルの行順を登録順とする
+        for position, record in enumerate(records, start=1):
+            conn.execute("UPDATE articles SET position = ? WHERE file_name = ?", (position, record["file_name"]))
+        print(f"📥 計画ファイルの変更を記事レジストリに取り込みました ({len(records)} 件): {self.markdown_path}")
+        return True
+
+    def close(self):
+        self._conn.close()
+
+
+def open_article_registry(reports_dir, docs_dir=None):
+    """reports_dir (output_reports) の記事レジストリを開く。初回は計画ファイルと docs の既存ファイルから作成する。"""
+    return ArticleRegistry(
+        os.path.join(reports_dir, REGISTRY_NAME),
+        markdown_path=os.path.join(reports_dir, PLANNED_FILE_NAME),
+        docs_dir=docs_dir,
+    )
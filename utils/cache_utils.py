@@ -0,0 +1,237 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from types import SimpleNamespace
+try:
+    from config import settings
+except ImportError:
+    settings = None
+
+# put() を何回行うごとにエビクション (ディレクトリ走査) を実行するか
+EVICT_EVERY_N_PUTS = 50
+
+
+def _to_jsonable(value):
+    """プロンプトや GenerateContentConfig をハッシュ可能な JSON 互換の値に変換する。"""
+    if value is None or isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, dict):
+        return {str(k): _to_jsonable(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_jsonable(v) for v in value]
+    if hasattr(value, 'model_dump'):
+        # google.genai.types の各クラス (pydantic モデル)
+        return _to_jsonable(value.model_dump(exclude_none=True, mode='json'))
+    return repr(value)
+
+
+def is_valid_json(text):
+    """```json フェンスを除いた上で JSON としてパースできるかを返す。"""
+    try:
+        json.loads(text.strip().replace("```json", "").replace("```", ""))
+        return True
+    except (ValueError, AttributeError):
+        return False
+
+
+class CachedResponse:
+    """キャッシュから復元したレスポンス。agents が使う .text / .usage_metadata だけを持つ。"""
+
+    from_cache = True
+
+    def __init__(self, text, usage=None):
+        self.text = text
+        self.usage_metadata = SimpleNamespace(**usage) if usage else None
+
+
+class ResponseCache:
+    """
+    generate_content のレスポンスを (model, prompt, config, テンプレート版) のハッシュをキーに
+    ディスクへ保存するコンテンツアドレス型キャッシュ。
+    エントリの mtime を最終アクセス時刻として使い、max_age 超過分と、
+    max_bytes を超えた分を古い順 (LRU) に削除する。
+    """
+
+    def __init__(self, cache_dir, max_bytes=500 * 1024 * 1024, max_age_seconds=30 * 24 * 3600, bypass=False):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.bypass = bypass
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        self._lock = threading.Lock()
+
+    def make_key(self, model, contents, config=None, template_version=None):
+        payload = json.dumps({
+            "model": model,
+            "contents": _to_jsonable(contents),
+            "config": _to_jsonable(config),
+            "template_version": template_version,
+        }, ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def get(self, key):
+        """キャッシュ済みのエントリ (dict) を返す。無い・期限切れ・bypass 時は None。"""
+        if self.bypass:
+            with self._lock:
+                self.misses += 1
+            return None
+        path = self._path(key)
+        try:
+            if self.max_age_seconds and time.time() - os.path.getmtime(path) > self.max_age_seconds:
+                os.remove(path)
+                raise FileNotFoundError(path)
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            # LRU 用に最終アクセス時刻を更新する
+            os.utime(path, None)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return entry
+
+    def put(self, key, entry):
+        """エントリを書き込み (一時ファイル経由)、必要ならエビクションを行う。"""
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️ レスポンスキャッシュの書き込みに失敗しました: {e}")
+            return
+        # ディレクトリ全体の走査を毎回行わないよう、一定件数ごとにエビクションする
+        with self._lock:
+            self._puts += 1
+            should_evict = self._puts % EVICT_EVERY_N_PUTS == 1
+        if should_evict:
+            self.evict()
+
+    def _entries(self):
+        entries = []
+        if not os.path.isdir(self.cache_dir):
+            return entries
+        for root, _, files in os.walk(self.cache_dir):
+            for filename in files:
+                if filename.endswith('.json'):
+                    path = os.path.join(root, filename)
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    entries.append((st.st_mtime, st.st_size, path))
+        return entries
+
+    def evict(self):
+        """期限切れのエントリを削除し、合計サイズが max_bytes 以下になるまで古い順に削除する。"""
+        now = time.time()
+        with self._lock:
+            entries = sorted(self._entries())
+            total = sum(size for _, size, _ in entries)
+            removed = 0
+            for mtime, size, path in entries:
+                expired = self.max_age_seconds and now - mtime > self.max_age_seconds
+                if not expired and (not self.max_bytes or total <= self.max_bytes):
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                    removed += 1
+                except OSError:
+                    pass
+            return removed
+
+    def clear(self):
+        """全エントリを削除する。"""
+        with self._lock:
+            for _, _, path in self._entries():
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+_CACHE = None
+_CACHE_LOCK = threading.Lock()
+
+def get_response_cache():
+    """settings に基づいて作成したプロセス共通の ResponseCache を返す。"""
+    global _CACHE
+    with _CACHE_LOCK:
+        if _CACHE is None:
+            cache_root = getattr(settings, 'CACHE_DIR', '.cache')
+            _CACHE = ResponseCache(
+                os.path.join(cache_root, "responses"),
+                max_bytes=getattr(settings, 'LLM_CACHE_MAX_MB', 500) * 1024 * 1024,
+                max_age_seconds=getattr(settings, 'LLM_CACHE_MAX_AGE_DAYS', 30) * 24 * 3600,
+                bypass=getattr(settings, 'LLM_CACHE_BYPASS', False),
+            )
+        return _CACHE
+
+
+class FileResultCache:
+    """
+    ファイルから導出した結果 (HTML の解析結果など) を、ファイルパスごとに1エントリずつ保存するキャッシュ。
+    エントリには元ファイルの mtime とサイズを記録し、どちらかが変わっていれば無効として扱う。
+    パスごとに上書きするため、ファイルが何度更新されてもエントリは増えない。
+    """
+
+    def __init__(self, cache_dir, version=None, enabled=True):
+        self.cache_dir = cache_dir
+        self.version = version
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def _path(self, file_path):
+        key = hashlib.sha256(os.path.abspath(file_path).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    @staticmethod
+    def _signature(file_path):
+        st = os.stat(file_path)
+        return [st.st_mtime_ns, st.st_size]
+
+    def get(self, file_path):
+        """file_path が変わっていなければ保存済みの結果を返す。無い・古い場合は None。"""
+        entry = None
+        if self.enabled:
+            try:
+                with open(self._path(file_path), 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+                if entry.get("signature") != self._signature(file_path) or entry.get("version") != self.version:
+                    entry = None
+            except (OSError, ValueError):
+                entry = None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry["data"] if entry else None
+
+    def put(self, file_path, data):
+        if not self.enabled:
+            return
+        path = self._path(file_path)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"path": os.path.abspath(file_path), "signature": self._signature(file_path),
+                           "version": self.version, "data": data}, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️ 解析結果キャッシュの書き込みに失敗しました: {e}")
@@ -1,16 +1,38 @@
 import os
 import sys
-from google import genai
+import json
+import time
+import threading
 try:
     from google.colab import userdata
 except ImportError:
     # Colab以外の環境（ローカル実行など）のためのフォールバック
     userdata = None
 
-import random
 from config import settings
+from utils.key_pool import get_key_pool
+from utils.nav_utils import estimate_tokens
+from utils.cache_utils import get_response_cache, CachedResponse, is_valid_json
+from utils.retry_utils import (
+    InvalidOutputError, RetryPolicy, RATE_LIMIT, SERVER_OVERLOAD, INVALID_OUTPUT, call_with_retry, classify_error
+)
+from utils.telemetry import get_telemetry
+from utils.fake_client import FakeClient
+from utils.lazy_import import lazy_import
+
+# google.genai は import に時間がかかるため、実際に Client を作るまで読み込まない
+genai = lazy_import("google.genai")
+
+# APIキー -> そのキーのクライアント (リクエストごとにキーを選ぶため、キーごとに1つ作って使い回す)
+_CLIENTS = {}
+_CLIENTS_LOCK = threading.Lock()
 
 def setup_client():
+    if getattr(settings, 'FAKE_LLM', False):
+        # オフライン検証: APIキーは KeyPool の振り分けだけに使い、ネットワークには接続しない
+        api_key = get_key_pool().select_key() if settings.API_KEYS else "fake-key-0000"
+        print(f"  🧪 フェイククライアントを使用します (MYSITEGEN_FAKE_LLM=1, key=...{api_key[-4:]})")
+        return FakeClient.from_settings(api_key)
     try:
         if userdata:
             # Colab環境
@@ -18,15 +40,14 @@ def setup_client():
             if not GOOGLE_API_KEY:
                 # Colabでもsettingsからキーを拾えるようにする（Secrets未設定時など）
                 if settings.API_KEYS:
-                     GOOGLE_API_KEY = random.choice(settings.API_KEYS)
+                     GOOGLE_API_KEY = get_key_pool().select_key()
                 else:
                     raise ValueError("GEMINI_API_KEY が Colab Secrets に設定されていません。")
         else:
             # ローカル環境
-            # settings.py でロード・パース済みのリストからランダムに選択
+            # settings.py でロード・パース済みのリストから、最も負荷の低い健全なキーを選択
             if settings.API_KEYS:
-                GOOGLE_API_KEY = random.choice(settings.API_KEYS)
-                # Debug: リストが複数ある場合、どれが選ばれたか（末尾4桁）を表示しても良いが、一旦シンプルに
+                GOOGLE_API_KEY = get_key_pool().select_key()
             else:
                 # 万が一 settings.py 経由で取れなかった場合の最終フォールバック (os.environ directly)
                 GOOGLE_API_KEY = os.environ.get('GEMINI_API_KEY')
@@ -45,3 +66,155 @@ def setup_client():
     except Exception as e:
         print(f"❌ クライアント初期化エラー: {e}")
         return None
+
+def get_client_api_key(client):
+    """クライアントが使用しているAPIキーを返す (取得できない場合は None)。"""
+    api_client = getattr(client, '_api_client', None)
+    return getattr(api_client, 'api_key', None)
+
+def client_for_key(client, api_key):
+    """client と同じ種類 (genai.Client / FakeClient) で api_key を使うクライアントを返す。キーごとに使い回す。"""
+    if not api_key or get_client_api_key(client) == api_key:
+        return client
+    with _CLIENTS_LOCK:
+        cached = _CLIENTS.get(api_key)
+        if cached is not None and isinstance(cached, FakeClient) == isinstance(client, FakeClient):
+            return cached
+        if isinstance(client, FakeClient):
+            cached = client.with_api_key(api_key)
+        else:
+            cached = genai.Client(api_key=api_key)
+        _CLIENTS[api_key] = cached
+        return cached
+
+def estimate_request_tokens(contents):
+    """contents (文字列 または role/parts 形式のリスト) の入力トークン数を見積もる (TPM の枠の予約に使う)。"""
+    if isinstance(contents, str):
+        return estimate_tokens(contents)
+    total = 0
+    for message in contents or []:
+        if isinstance(message, dict):
+            total += sum(estimate_tokens(str(part.get("text", ""))) for part in message.get("parts") or []
+                         if isinstance(part, dict))
+        else:
+            total += estimate_tokens(str(message))
+    return total
+
+def acquire_client(client, tokens=0, exclude=None, pin=False):
+    """
+    KeyPool から今すぐ送信できるキーを選んで枠を予約し、(キー, そのキーのクライアント) を返す。
+    全てのキーの枠が埋まっている場合は空くまで待つ (KeyPool.acquire)。送信後は必ず pool.finish_request を呼ぶこと。
+    pin=True の場合は client のキーだけを使う (キャッシュ済みコンテンツは作成したキーからしか参照できないため)。
+    キーがプールに無い場合 (キー未設定・Colab Secrets のキー) は client をそのまま使う。
+    """
+    pool = get_key_pool()
+    current_key = get_client_api_key(client)
+    if not len(pool) or (pin and current_key not in pool):
+        pool.start_request(current_key, tokens)
+        return current_key, client
+    api_key = pool.acquire(tokens=tokens, exclude=exclude, only=[current_key] if pin else None)
+    return api_key, client_for_key(client, api_key)
+
+def response_token_count(response):
+    """レスポンスの usage_metadata から消費トークン数 (合計) を返す。"""
+    usage = getattr(response, 'usage_metadata', None)
+    return getattr(usage, 'total_token_count', 0) or 0
+
+def _usage_to_dict(response):
+    usage = getattr(response, 'usage_metadata', None)
+    if usage is None:
+        return None
+    return {
+        "prompt_token_count": getattr(usage, 'prompt_token_count', None),
+        "candidates_token_count": getattr(usage, 'candidates_token_count', None),
+        "total_token_count": getattr(usage, 'total_token_count', None),
+    }
+
+def generate_content(client, model, contents, config=None, use_cache=True, cache_if=None, retry_policy=None, cache_key_parts=None):
+    """
+    client.models.generate_content の共通ラッパー。
+    - (model, contents, config, PROMPT_TEMPLATE_VERSION) が同一の過去の応答があればディスクキャッシュから返す
+    - 試行ごとに KeyPool が選んだキー (RPM / TPM / RPD の枠が空いているもの) で送信する。全てのキーの枠が
+      埋まっている場合は空くまで待つ。キャッシュ済みコンテンツ (config.cached_content) を参照するリクエストは
+      client のキーに固定する
+    - レート制限 / サーバー過負荷は retry_policy (既定は settings の RETRY_*) に従って再試行し、
+      その際は失敗したキーを避けて別のキーで送る。FATAL なエラーはそのまま送出する
+    - 実際に API を呼んだ場合は KeyPool にリクエスト数・トークン数・エラーを記録する
+    - 試行ごと (キャッシュヒットを含む) にテレメトリへイベントを記録する (utils/telemetry.py)
+    cache_if を渡した場合、cache_if(text) が True の応答だけをキャッシュする (途中で切れたHTMLなどを除外するため)。
+    cache_key_parts=(contents, config) を渡すと、実際に送る内容の代わりにそれをキャッシュキーに使う
+    (キャッシュ済みプレフィックスを参照するリクエストでも、完全なプロンプトと同じキーにするため)。
+    """
+    cache = get_response_cache()
+    cache_key = None
+    if use_cache and getattr(settings, 'LLM_CACHE_ENABLED', True):
+        key_contents, key_config = cache_key_parts or (contents, config)
+        cache_key = cache.make_key(model, key_contents, key_config, getattr(settings, 'PROMPT_TEMPLATE_VERSION', None))
+        entry = cache.get(cache_key)
+        if entry is not None:
+            print(f"  💾 キャッシュ済みの応答を使用します ({model}, key={cache_key[:8]})")
+            get_telemetry().record(model, "cache_hit", 0.0, usage=entry.get("usage"))
+            return CachedResponse(entry["text"], entry.get("usage"))
+
+    pool = get_key_pool()
+    telemetry = get_telemetry()
+    reserved_tokens = estimate_request_tokens(contents)
+    pin = bool(getattr(config, 'cached_content', None))
+    state = {"api_key": None, "exclude": None}
+
+    def attempt_call(attempt):
+        api_key, active_client = acquire_client(client, reserved_tokens, exclude=state["exclude"], pin=pin)
+        state["api_key"] = api_key
+        started = time.perf_counter()
+        try:
+            response = active_client.models.generate_content(model=model, contents=contents, config=config)
+        except Exception as e:
+            pool.finish_request(api_key, error=e, reserved_tokens=reserved_tokens)
+            telemetry.record(model, classify_error(e), time.perf_counter() - started,
+                             api_key=api_key, attempt=attempt + 1, error=e)
+            raise
+        pool.finish_request(api_key, tokens=response_token_count(response), reserved_tokens=reserved_tokens)
+        telemetry.record(model, "ok", time.perf_counter() - started, api_key=api_key, attempt=attempt + 1,
+                         usage=getattr(response, 'usage_metadata', None))
+        return response
+
+    def on_retry(error, category):
+        # 次の試行では、レート制限・過負荷になったキーを (他に候補がある限り) 避ける
+        if category in (RATE_LIMIT, SERVER_OVERLOAD) and state["api_key"]:
+            state["exclude"] = [state["api_key"]]
+
+    response = call_with_retry(attempt_call, policy=retry_policy, label=model, on_retry=on_retry)
+
+    text = response.text
+    if cache_key and text and (cache_if is None or cache_if(text)):
+        cache.put(cache_key, {"model": model, "text": text, "usage": _usage_to_dict(response)})
+    return response
+
+def generate_json(client, model, contents, config=None, retry_policy=None, validate=None):
+    """
+    JSON モードで generate_content を呼び、パース済みのオブジェクトを返す。
+    壊れた JSON は INVALID_OUTPUT として retry_policy に従い再生成する (壊れた応答はキャッシュされない)。
+    レート制限・過負荷は generate_content の中で再試行されるため、ここでは INVALID_OUTPUT だけを再試行する。
+    validate(parsed) を渡すと、False を返す応答 (空のリストなど) も INVALID_OUTPUT として扱い、キャッシュしない。
+    """
+    policy = (retry_policy or RetryPolicy.from_settings()).only(INVALID_OUTPUT)
+
+    def parse(text):
+        return json.loads((text or "").strip().replace("```json", "").replace("```", ""))
+
+    def is_acceptable(text):
+        if not is_valid_json(text):
+            return False
+        return validate is None or bool(validate(parse(text)))
+
+    def attempt_parse(attempt):
+        response = generate_content(client, model, contents, config=config, cache_if=is_acceptable, retry_policy=retry_policy)
+        try:
+            parsed = parse(response.text)
+        except ValueError as e:
+            raise InvalidOutputError(f"JSONのパースに失敗しました: {e}") from e
+        if validate is not None and not validate(parsed):
+            raise InvalidOutputError("JSONの内容が期待した形式ではありませんでした。")
+        return parsed
+
+    return call_with_retry(attempt_parse, policy=policy, label=f"{model} (JSON)")
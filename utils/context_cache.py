@@ -0,0 +1,151 @@
+import copy
+import threading
+try:
+    from config import settings
+except ImportError:
+    settings = None
+from utils.nav_utils import estimate_tokens
+from utils.lazy_import import lazy_import
+
+types = lazy_import("google.genai.types")
+
+
+def prepend_prefix(prefix_text, contents):
+    """contents (文字列 または role/parts 形式のリスト) の先頭のユーザー発話に prefix_text を前置する。"""
+    if isinstance(contents, str):
+        return prefix_text + contents
+    contents = copy.deepcopy(list(contents))
+    for message in contents:
+        if isinstance(message, dict) and message.get("role", "user") == "user":
+            parts = message.get("parts") or [{"text": ""}]
+            parts[0] = {**parts[0], "text": prefix_text + parts[0].get("text", "")}
+            message["parts"] = parts
+            break
+    return contents
+
+
+def is_cache_access_error(error):
+    """
+    キャッシュ済みコンテンツを参照できなかったエラー (403 / 404) かを返す。
+    cachedContents は作成したキーにだけ属するため、KeyPool が別のキーに切り替えた後のリクエストではこのエラーになる。
+    """
+    return getattr(error, 'code', None) in (403, 404)
+
+
+class LocalPrefixCache:
+    """
+    プレフィックスキャッシュのローカル代替。API のキャッシュ機能を使わず、
+    毎回プレフィックスを前置して送る (オフラインのテストや、キャッシュ作成に失敗した場合に使う)。
+    カウンタは「API のキャッシュを使っていれば節約できたトークン数」を記録する。
+    """
+
+    remote = False
+
+    def __init__(self, model, prefix_text):
+        self.model = model
+        self.prefix_text = prefix_text
+        self.prefix_tokens = estimate_tokens(prefix_text)
+        self.requests = 0
+        self.tokens_saved = 0
+        self._lock = threading.Lock()
+
+    def matches(self, prefix_text, model):
+        return self.prefix_text == prefix_text and self.model == model
+
+    def apply(self, contents, config=None):
+        """ページ固有の contents / config を、実際に送信する形に変換して返す。"""
+        return prepend_prefix(self.prefix_text, contents), config
+
+    def key_contents(self, contents):
+        """レスポンスキャッシュのキーに使う、プレフィックスを含めた完全な contents を返す。"""
+        return prepend_prefix(self.prefix_text, contents)
+
+    def record_use(self, usage_metadata=None):
+        cached = getattr(usage_metadata, 'cached_content_token_count', None)
+        with self._lock:
+            self.requests += 1
+            self.tokens_saved += cached or self.prefix_tokens
+
+    def stats(self):
+        with self._lock:
+            return {
+                "remote": self.remote,
+                "requests": self.requests,
+                "prefix_tokens": self.prefix_tokens,
+                "tokens_saved": self.tokens_saved,
+            }
+
+    def close(self):
+        stats = self.stats()
+        label = "API キャッシュ" if self.remote else "ローカル代替"
+        print(f"🧠 共通プレフィックス ({label}): {stats['requests']} リクエストで "
+              f"約 {stats['tokens_saved']} トークン (1回あたり {stats['prefix_tokens']}) を再送せずに済みました。")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+
+class PrefixCache(LocalPrefixCache):
+    """
+    Gemini のキャッシュ済みコンテンツ (client.caches) に共通プレフィックスを1度だけ登録し、
+    各リクエストではページ固有の部分だけを送る。close() でキャッシュを削除する。
+    """
+
+    remote = True
+
+    def __init__(self, client, model, prefix_text, ttl_seconds=3600, display_name=None):
+        super().__init__(model, prefix_text)
+        self.client = client
+        cached = client.caches.create(
+            model=model,
+            config=types.CreateCachedContentConfig(
+                contents=[prefix_text],
+                ttl=f"{int(ttl_seconds)}s",
+                display_name=display_name,
+            ),
+        )
+        self.name = cached.name
+        usage = getattr(cached, 'usage_metadata', None)
+        self.prefix_tokens = getattr(usage, 'total_token_count', None) or self.prefix_tokens
+
+    def apply(self, contents, config=None):
+        if config is None:
+            config = types.GenerateContentConfig(cached_content=self.name)
+        else:
+            config = config.model_copy(update={"cached_content": self.name})
+        return contents, config
+
+    def close(self):
+        try:
+            self.client.caches.delete(name=self.name)
+        except Exception as e:
+            print(f"⚠️ キャッシュ済みコンテンツの削除に失敗しました (TTL で自動的に期限切れになります): {e}")
+        super().close()
+
+
+def open_prefix_cache(client, model, prefix_text, display_name=None):
+    """
+    共通プレフィックス用のキャッシュを作成する。
+    プレフィックスが API の最小トークン数に満たない場合、CONTEXT_CACHE_LOCAL=1 の場合、
+    または作成に失敗した場合は LocalPrefixCache を返す。無効化されている場合は None を返す。
+    """
+    if not getattr(settings, 'CONTEXT_CACHE_ENABLED', True):
+        return None
+    if getattr(settings, 'CONTEXT_CACHE_LOCAL', False) or client is None or not hasattr(client, 'caches'):
+        return LocalPrefixCache(model, prefix_text)
+    if estimate_tokens(prefix_text) < getattr(settings, 'CONTEXT_CACHE_MIN_TOKENS', 1024):
+        print("ℹ️ 共通プレフィックスが短いため、API のキャッシュ機能は使わずに送信します。")
+        return LocalPrefixCache(model, prefix_text)
+    try:
+        cache = PrefixCache(client, model, prefix_text,
+                            ttl_seconds=getattr(settings, 'CONTEXT_CACHE_TTL_SECONDS', 3600),
+                            display_name=display_name)
+        print(f"🧠 共通プレフィックスをキャッシュしました ({cache.name}, 約 {cache.prefix_tokens} トークン)")
+        return cache
+    except Exception as e:
+        print(f"⚠️ キャッシュ済みコンテンツの作成に失敗しました。ローカル代替で続行します: {e}")
+        return LocalPrefixCache(model, prefix_text)
@@ -0,0 +1,375 @@
+import re
+import json
+import time
+import random
+import threading
+from collections import defaultdict, deque
+try:
+    from config import settings
+except ImportError:
+    settings = None
+from utils.nav_utils import estimate_tokens
+from utils.lazy_import import lazy_import
+
+types = lazy_import("google.genai.types")
+errors = lazy_import("google.genai.errors")
+
+# 生成されるフェイクHTMLの本文に繰り返し埋める段落 (出力サイズの調整用)
+FILLER_PARAGRAPH = "<p>これはオフライン検証用のフェイク応答です。データに基づく生活最適化の考え方を説明します。</p>\n"
+DEFAULT_PAGES = [
+    ("ホーム", "index.html"),
+    ("ABOUT", "about/index.html"),
+    ("PROJECTS", "projects/index.html"),
+    ("INSIGHTS", "insights/index.html"),
+    ("SOLUTIONS", "solutions/index.html"),
+    ("CONTACT", "contact/index.html"),
+    ("プライバシーポリシー", "legal/privacy.html"),
+]
+
+
+def parse_latency(spec):
+    """
+    レイテンシ分布の指定文字列を、秒数を返す関数に変換する。
+      fixed:0.5 / uniform:0.1,0.8 / lognormal:mu,sigma / exponential:平均秒数
+    数値だけを渡した場合は fixed として扱う。
+    """
+    spec = str(spec or "fixed:0").strip()
+    kind, _, args = spec.partition(":")
+    if not args:
+        kind, args = "fixed", kind
+    values = [float(v) for v in args.split(",") if v.strip()]
+    if kind == "fixed":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(values[0], values[1])
+    if kind == "exponential":
+        return lambda rng: rng.expovariate(1.0 / values[0]) if values[0] > 0 else 0.0
+    raise ValueError(f"不明なレイテンシ分布です: {spec}")
+
+
+def _contents_messages(contents):
+    """contents (文字列 / 文字列のリスト / role・parts 形式 / types.Content) を (role, text) のリストに変換する。"""
+    if isinstance(contents, (str, types.Content)) or isinstance(contents, dict):
+        contents = [contents]
+    messages = []
+    for item in contents or []:
+        if isinstance(item, str):
+            messages.append(("user", item))
+        elif isinstance(item, types.Content):
+            messages.append((item.role or "user", "".join(p.text or "" for p in item.parts or [])))
+        elif isinstance(item, dict):
+            parts = item.get("parts") or []
+            text = "".join(p.get("text", "") if isinstance(p, dict) else str(p) for p in parts)
+            messages.append((item.get("role", "user"), text))
+    return messages
+
+
+def _make_response(text, finish_reason, prompt_tokens, cached_tokens=None, output_tokens=None):
+    # ストリーミングでは API と同様、usage_metadata にそれまでの累計の出力トークン数を入れる
+    output_tokens = estimate_tokens(text) if output_tokens is None else output_tokens
+    return types.GenerateContentResponse(
+        candidates=[types.Candidate(
+            content=types.Content(role="model", parts=[types.Part(text=text)]),
+            finish_reason=finish_reason,
+        )],
+        usage_metadata=types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=prompt_tokens,
+            candidates_token_count=output_tokens,
+            total_token_count=prompt_tokens + output_tokens,
+            cached_content_token_count=cached_tokens,
+        ),
+    )
+
+
+class FakeBackend:
+    """
+    FakeClient が共有する「サーバー側」の状態。キーを切り替えたクライアント同士でも、
+    乱数・キャッシュ済みコンテンツ・RPM 制限・カウンタを共有する。
+    """
+
+    def __init__(self, latency="fixed:0", tokens_per_sec=0, rate_limit_prob=0.0, overload_prob=0.0,
+                 truncate_prob=0.0, malformed_json_prob=0.0, rpm_limit=0, html_size=4000,
+                 page_count=None, seed=None, sleep=time.sleep):
+        self.latency = parse_latency(latency)
+        self.tokens_per_sec = tokens_per_sec
+        self.rate_limit_prob = rate_limit_prob
+        self.overload_prob = overload_prob
+        self.truncate_prob = truncate_prob
+        self.malformed_json_prob = malformed_json_prob
+        self.rpm_limit = rpm_limit
+        self.html_size = html_size
+        self.page_count = page_count
+        self.sleep = sleep
+        self.rng = random.Random(seed)
+        self.cached_contents = {}
+        self.stats = defaultdict(int)
+        self._requests_by_key = defaultdict(deque)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, **overrides):
+        params = dict(
+            latency=getattr(settings, 'FAKE_LLM_LATENCY', "fixed:0"),
+            tokens_per_sec=getattr(settings, 'FAKE_LLM_TOKENS_PER_SEC', 0),
+            rate_limit_prob=getattr(settings, 'FAKE_LLM_RATE_LIMIT_PROB', 0.0),
+            overload_prob=getattr(settings, 'FAKE_LLM_OVERLOAD_PROB', 0.0),
+            truncate_prob=getattr(settings, 'FAKE_LLM_TRUNCATE_PROB', 0.0),
+            malformed_json_prob=getattr(settings, 'FAKE_LLM_MALFORMED_JSON_PROB', 0.0),
+            rpm_limit=getattr(settings, 'FAKE_LLM_RPM_LIMIT', 0),
+            seed=getattr(settings, 'FAKE_LLM_SEED', None),
+            page_count=getattr(settings, 'FAKE_LLM_PAGE_COUNT', 0) or None,
+        )
+        params.update(overrides)
+        return cls(**params)
+
+    def _roll(self, probability):
+        with self._lock:
+            return probability > 0 and self.rng.random() < probability
+
+    def _sample_latency(self):
+        with self._lock:
+            return max(0.0, self.latency(self.rng))
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.stats[name] += amount
+
+    def check_limits(self, api_key):
+        """RPM 制限と確率的な 429 / 503 を判定し、該当すれば API と同じ形の例外を送出する。"""
+        if self.rpm_limit:
+            now = time.time()
+            with self._lock:
+                window = self._requests_by_key[api_key]
+                while window and now - window[0] >= 60:
+                    window.popleft()
+                limited = len(window) >= self.rpm_limit
+                if not limited:
+                    window.append(now)
+            if limited:
+                retry_after = max(1, int(60 - (now - window[0])) + 1)
+                self.count("rate_limited")
+                raise errors.ClientError(429, {"error": {
+                    "code": 429, "status": "RESOURCE_EXHAUSTED",
+                    "message": f"Quota exceeded for requests per minute (fake). Please retry in {retry_after}s.",
+                    "details": [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": f"{retry_after}s"}],
+                }})
+        if self._roll(self.rate_limit_prob):
+            self.count("rate_limited")
+            raise errors.ClientError(429, {"error": {
+                "code": 429, "status": "RESOURCE_EXHAUSTED",
+                "message": "Resource has been exhausted (fake). Please retry in 1s.",
+                "details": [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": "1s"}],
+            }})
+        if self._roll(self.overload_prob):
+            self.count("overloaded")
+            raise errors.ServerError(503, {"error": {
+                "code": 503, "status": "UNAVAILABLE", "message": "The model is overloaded (fake).",
+            }})
+
+    # --- 応答テキストの組み立て ---
+
+    def render(self, messages, config):
+        """プロンプトの内容から、エージェントが期待する形のフェイク応答テキストを返す。"""
+        prompt = "\n".join(text for role, text in messages if role == "user")
+        if getattr(config, 'response_mime_type', None) == "application/json":
+            return json.dumps(self.render_json(prompt), ensure_ascii=False)
+        if "[START HTML CODE]" in prompt:
+            return self.render_html(prompt)
+        return f"# フェイク応答\n\n- 入力 {estimate_tokens(prompt)} トークンに対するオフライン検証用のテキストです。\n"
+
+    def render_json(self, prompt):
+        if '"site_name"' in prompt:
+            return {"site_name": "フェイク・ポートフォリオ", "slug": "fake-portfolio"}
+        match = re.search(r"seo-optimized-slug-(\d+)\.html", prompt)
+        if match:
+            start = int(match.group(1))
+            count_match = re.search(r"を (\d+) 件生成", prompt)
+            count = int(count_match.group(1)) if count_match else 3
+            return [{"title": f"フェイク記事 {n}", "summary": f"フェイク記事 {n} の要約", "file_name": f"fake-article-{n}.html"}
+                    for n in range(start, start + count)]
+        if '"reason"' in prompt:
+            hubs = [h for h in re.findall(r"([\w-]+/index\.html)", prompt)
+                    if not h.startswith(("legal/", "contact/", "projects/", "about/"))]
+            return {"file_name": hubs[0] if hubs else "insights/index.html", "reason": "フェイク: 記事数が最も少ないセクション"}
+        if '"purpose"' in prompt:
+            pages = [{"title": title, "file_name": name, "purpose": f"{title} の役割 (フェイク)"} for title, name in DEFAULT_PAGES]
+            for n in range(len(pages), self.page_count or 0):
+                pages.append({"title": f"セクション {n}", "file_name": f"section-{n}/index.html", "purpose": f"セクション {n} の役割 (フェイク)"})
+            return pages
+        return {}
+
+    def render_html(self, prompt):
+        match = re.search(r"\*\*(.+?) \(([^)\s]+)\) 用", prompt)
+        title, file_name = match.groups() if match else ("フェイクページ", "index.html")
+        body = FILLER_PARAGRAPH * max(1, self.html_size // len(FILLER_PARAGRAPH))
+        return (
+            "```html\n<!DOCTYPE html>\n<html lang=\"ja\">\n<head>\n<meta charset=\"UTF-8\">\n"
+            f"<title>{title}</title>\n</head>\n<body class=\"bg-gray-900 text-gray-300\">\n"
+            f"<header><a href=\"index.html\">LOU-Ark</a></header>\n<main>\n<h1>{title}</h1>\n"
+            f"<p>{file_name}</p>\n<!-- GRID_PLACEHOLDER -->\n{body}</main>\n"
+            "<footer>© 2025 LOU-Ark Portfolio.</footer>\n</body>\n</html>\n```"
+        )
+
+    def generate(self, api_key, model, contents, config):
+        """1リクエスト分の (応答テキスト, finish_reason, 入力トークン数, キャッシュ済みトークン数) を返す。"""
+        self.check_limits(api_key)
+        messages = _contents_messages(contents)
+        cached_tokens = None
+        cached_name = getattr(config, 'cached_content', None)
+        if cached_name:
+            with self._lock:
+                cached = self.cached_contents.get(cached_name)
+            if cached is None:
+                raise errors.ClientError(404, {"error": {
+                    "code": 404, "status": "NOT_FOUND", "message": f"CachedContent not found (fake): {cached_name}",
+                }})
+            messages = [("user", cached["text"])] + messages
+            cached_tokens = cached["tokens"]
+        prompt_tokens = sum(estimate_tokens(text) for _, text in messages)
+
+        # 続きの生成: 元のプロンプトに対する完全な応答のうち、途中まで出力された部分の続きを返す
+        if len(messages) >= 3 and messages[-2][0] == "model":
+            full = self.render(messages[:-2], config)
+            partial = messages[-2][1]
+            text = full[len(partial):] if full.startswith(partial) else full
+        else:
+            text = self.render(messages, config)
+
+        finish_reason = types.FinishReason.STOP
+        if getattr(config, 'response_mime_type', None) == "application/json":
+            if self._roll(self.malformed_json_prob):
+                self.count("malformed_json")
+                text = text[:max(1, len(text) // 2)]
+        elif self._roll(self.truncate_prob):
+            self.count("truncated")
+            with self._lock:
+                cut = int(len(text) * self.rng.uniform(0.3, 0.9))
+            text = text[:cut]
+            finish_reason = types.FinishReason.MAX_TOKENS
+        self.count("requests")
+        self.count("prompt_tokens", prompt_tokens)
+        self.count("output_tokens", estimate_tokens(text))
+        return text, finish_reason, prompt_tokens, cached_tokens
+
+    def generation_seconds(self, text):
+        return estimate_tokens(text) / self.tokens_per_sec if self.tokens_per_sec else 0.0
+
+
+_default_backend = None
+_default_backend_lock = threading.Lock()
+
+
+def get_fake_backend():
+    """settings (FAKE_LLM_*) から作る、プロセス内で共有のフェイクバックエンドを返す。"""
+    global _default_backend
+    with _default_backend_lock:
+        if _default_backend is None:
+            _default_backend = FakeBackend.from_settings()
+        return _default_backend
+
+
+class FakeModels:
+    """client.models と同じ generate_content / generate_content_stream を提供する。"""
+
+    def __init__(self, client):
+        self._client = client
+
+    def generate_content(self, *, model, contents, config=None):
+        backend = self._client.backend
+        self._client.count_request()
+        delay = backend._sample_latency()
+        text, finish_reason, prompt_tokens, cached_tokens = backend.generate(self._client.api_key, model, contents, config)
+        backend.sleep(delay + backend.generation_seconds(text))
+        return _make_response(text, finish_reason, prompt_tokens, cached_tokens)
+
+    def generate_content_stream(self, *, model, contents, config=None, chunk_chars=400):
+        backend = self._client.backend
+        self._client.count_request()
+        backend.count("stream_requests")
+        # API と同様、レート制限などのエラーは最初のチャンクを取り出した時点で表面化する
+        def chunks():
+            delay = backend._sample_latency()
+            text, finish_reason, prompt_tokens, cached_tokens = backend.generate(self._client.api_key, model, contents, config)
+            backend.sleep(delay)
+            pieces = [text[i:i + chunk_chars] for i in range(0, len(text), chunk_chars)] or [""]
+            sent = 0
+            for index, piece in enumerate(pieces):
+                backend.sleep(backend.generation_seconds(piece))
+                sent += len(piece)
+                last = index == len(pieces) - 1
+                yield _make_response(piece, finish_reason if last else None, prompt_tokens,
+                                     cached_tokens if last else None, output_tokens=estimate_tokens(text[:sent]))
+        return chunks()
+
+
+class FakeCaches:
+    """client.caches の create / get / delete を提供する (キャッシュ済みコンテンツはバックエンドに保持)。"""
+
+    def __init__(self, client):
+        self._client = client
+
+    def create(self, *, model, config=None):
+        backend = self._client.backend
+        text = "\n".join(text for _, text in _contents_messages(getattr(config, 'contents', None) or []))
+        tokens = estimate_tokens(text)
+        with backend._lock:
+            name = f"cachedContents/fake-{len(backend.cached_contents) + backend.stats['cache_deletes'] + 1}"
+            backend.cached_contents[name] = {"text": text, "tokens": tokens, "model": model}
+        backend.count("cache_creates")
+        return self.get(name=name)
+
+    def get(self, *, name, config=None):
+        cached = self._client.backend.cached_contents.get(name)
+        if cached is None:
+            raise errors.ClientError(404, {"error": {"code": 404, "status": "NOT_FOUND", "message": f"{name} not found (fake)"}})
+        return types.CachedContent(name=name, model=cached["model"],
+                                   usage_metadata=types.CachedContentUsageMetadata(total_token_count=cached["tokens"]))
+
+    def delete(self, *, name, config=None):
+        backend = self._client.backend
+        with backend._lock:
+            backend.cached_contents.pop(name, None)
+        backend.count("cache_deletes")
+
+
+class _FakeApiClient:
+    def __init__(self, api_key):
+        self.api_key = api_key
+
+
+class FakeClient:
+    """
+    genai.Client の代わりに使える、ネットワークに接続しないクライアント。
+    models.generate_content / generate_content_stream (JSON モードを含む) と caches を提供し、
+    プロンプトに応じた定型の HTML / JSON を返す。レイテンシ・429・503・途切れ・壊れた JSON を
+    FakeBackend の設定に従って発生させるため、並列化・再試行・キャッシュの負荷試験に使える。
+    """
+
+    def __init__(self, api_key="fake-key-0000", backend=None, **backend_options):
+        self.backend = backend or FakeBackend(**backend_options)
+        self._api_client = _FakeApiClient(api_key)
+        self.models = FakeModels(self)
+        self.caches = FakeCaches(self)
+
+    @classmethod
+    def from_settings(cls, api_key="fake-key-0000"):
+        return cls(api_key=api_key, backend=get_fake_backend())
+
+    @property
+    def api_key(self):
+        return self._api_client.api_key
+
+    def with_api_key(self, api_key):
+        """同じバックエンドを共有し、キーだけを差し替えたクライアントを返す (client_for_key 用)。"""
+        return FakeClient(api_key=api_key, backend=self.backend)
+
+    def count_request(self):
+        self.backend.count("calls")
+        self.backend.count(f"calls_by_key:{self.api_key[-4:]}")
+
+    @property
+    def stats(self):
+        with self.backend._lock:
+            return dict(self.backend.stats)
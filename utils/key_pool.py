@@ -0,0 +1,395 @@
+import os
+import json
+import time
+import atexit
+import hashlib
+import threading
+try:
+    from config import settings
+except ImportError:
+    settings = None
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# 1分 / 1日 の秒数 (トークンバケットの補充周期)
+MINUTE_SECONDS = 60
+DAY_SECONDS = 24 * 60 * 60
+
+# 429 (RESOURCE_EXHAUSTED) / 503 (UNAVAILABLE) 後の基本クールダウン秒数。
+# 連続で失敗するたびに倍になり、MAX_COOLDOWN_SECONDS で頭打ちになる。
+RATE_LIMIT_COOLDOWN_SECONDS = 60
+OVERLOAD_COOLDOWN_SECONDS = 15
+MAX_COOLDOWN_SECONDS = 10 * 60
+
+
+class KeyPoolExhaustedError(Exception):
+    """全てのキーのクォータが枯渇し、待機の上限内に送信できなかったことを表す (レート制限として再試行される)。"""
+
+    code = 429
+    status = "RESOURCE_EXHAUSTED"
+
+
+def key_id(api_key):
+    """APIキーを保存・ログ用の短いハッシュIDに変換する (生のキーはファイルに残さない)。"""
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:12]
+
+
+def key_suffix(api_key):
+    """ログ表示用にキーの末尾4桁だけを返す。"""
+    return f"****{api_key[-4:]}" if api_key and len(api_key) > 4 else "****"
+
+
+class TokenBucket:
+    """capacity 個のトークンを period 秒で満タンまで連続的に補充するバケット。"""
+
+    def __init__(self, capacity, period, tokens=None, updated_at=None):
+        self.capacity = float(capacity)
+        self.period = float(period)
+        self.tokens = self.capacity if tokens is None else min(float(tokens), self.capacity)
+        self.updated_at = time.time() if updated_at is None else float(updated_at)
+
+    def _refill(self, now):
+        elapsed = max(0.0, now - self.updated_at)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.capacity / self.period)
+        self.updated_at = now
+
+    def available(self, now=None):
+        self._refill(time.time() if now is None else now)
+        return self.tokens
+
+    def usage_ratio(self, now=None):
+        """0.0 (未使用) 〜 1.0 (枯渇) の負荷率を返す。"""
+        if self.capacity <= 0:
+            return 1.0
+        return 1.0 - self.available(now) / self.capacity
+
+    def consume(self, amount, now=None):
+        """トークンを消費する。実績値との差分の精算にも使うため、残量が負になることも許容する (負の amount で返却)。"""
+        self._refill(time.time() if now is None else now)
+        self.tokens -= amount
+
+    def seconds_until(self, amount, now=None):
+        """amount 個のトークンが使えるようになるまでの秒数を返す。"""
+        missing = amount - self.available(now)
+        if missing <= 0:
+            return 0.0
+        return missing * self.period / self.capacity
+
+    def to_dict(self):
+        return {"tokens": self.tokens, "updated_at": self.updated_at}
+
+
+class KeyState:
+    """1つのAPIキーのクォータ消費状況とクールダウン状態。"""
+
+    def __init__(self, api_key, rpm, tpm, rpd, saved=None):
+        saved = saved or {}
+        self.api_key = api_key
+        self.id = key_id(api_key)
+        self.rpm = TokenBucket(rpm, MINUTE_SECONDS, **saved.get("rpm", {}))
+        self.tpm = TokenBucket(tpm, MINUTE_SECONDS, **saved.get("tpm", {}))
+        self.rpd = TokenBucket(rpd, DAY_SECONDS, **saved.get("rpd", {}))
+        self.cooldown_until = float(saved.get("cooldown_until", 0.0))
+        self.consecutive_failures = int(saved.get("consecutive_failures", 0))
+        self.total_requests = int(saved.get("total_requests", 0))
+        self.total_tokens = int(saved.get("total_tokens", 0))
+        self.in_flight = 0
+        # 前回の保存以降にこのプロセスで消費した量 (保存時に、他のプロセスが書いた最新の状態へ加算する)
+        self.pending = {"rpm": 0.0, "tpm": 0.0, "rpd": 0.0, "requests": 0, "tokens": 0}
+
+    def consume(self, name, amount, now):
+        """name ("rpm" / "tpm" / "rpd") のバケットから amount を消費し、未保存の消費量にも加える。"""
+        getattr(self, name).consume(amount, now)
+        self.pending[name] += amount
+
+    def merge_saved(self, saved, now):
+        """
+        他のプロセスが保存した状態 saved に、このプロセスの未保存の消費量を加えた状態へ置き換える。
+        クールダウンは遅い方を採る。呼び出し後、未保存の消費量は 0 に戻る。
+        """
+        for name, period in (("rpm", MINUTE_SECONDS), ("tpm", MINUTE_SECONDS), ("rpd", DAY_SECONDS)):
+            if name in saved:
+                bucket = TokenBucket(getattr(self, name).capacity, period, **saved[name])
+                bucket.consume(self.pending[name], now)
+                setattr(self, name, bucket)
+        if saved:
+            self.cooldown_until = max(self.cooldown_until, float(saved.get("cooldown_until", 0.0)))
+            self.total_requests = int(saved.get("total_requests", 0)) + self.pending["requests"]
+            self.total_tokens = int(saved.get("total_tokens", 0)) + self.pending["tokens"]
+        self.pending = {"rpm": 0.0, "tpm": 0.0, "rpd": 0.0, "requests": 0, "tokens": 0}
+
+    def is_healthy(self, now):
+        return now >= self.cooldown_until and self.rpd.available(now) >= 1
+
+    def is_ready(self, now, tokens=0):
+        """クールダウン中でなく、RPM / RPD に1リクエスト分、TPM に tokens 分の枠が残っているかを返す。"""
+        return self.ready_at(now, tokens) <= now
+
+    def load(self, now):
+        """キーの負荷スコア。最も逼迫しているバケットの使用率 + 実行中リクエスト数。"""
+        return max(self.rpm.usage_ratio(now), self.tpm.usage_ratio(now), self.rpd.usage_ratio(now)) + self.in_flight
+
+    def ready_at(self, now, tokens=0):
+        """このキーで次のリクエスト (入力 tokens トークン) を送れるようになる時刻。"""
+        tokens = min(max(tokens, 1), self.tpm.capacity)
+        return max(self.cooldown_until, now + self.rpm.seconds_until(1, now), now + self.rpd.seconds_until(1, now),
+                   now + self.tpm.seconds_until(tokens, now))
+
+    def reserve(self, now, tokens=0):
+        """送信前に RPM / RPD の1リクエスト分と TPM の tokens 分を予約する。"""
+        self.consume("rpm", 1, now)
+        self.consume("rpd", 1, now)
+        self.consume("tpm", tokens or 0, now)
+        self.in_flight += 1
+
+    def to_dict(self):
+        return {
+            "rpm": self.rpm.to_dict(),
+            "tpm": self.tpm.to_dict(),
+            "rpd": self.rpd.to_dict(),
+            "cooldown_until": self.cooldown_until,
+            "consecutive_failures": self.consecutive_failures,
+            "total_requests": self.total_requests,
+            "total_tokens": self.total_tokens,
+        }
+
+
+class KeyPool:
+    """
+    複数のAPIキーを、キーごとのトークンバケット (RPM / TPM / RPD) と
+    429/503 後のクールダウンで管理し、最も負荷の低い健全なキーを払い出す。
+    リクエストごとに acquire() でキーを選んで枠を予約し、finish_request() で実績を精算する。
+    全てのキーの枠が枯渇している場合は、送信せずに枠が空くまで待つ (最大 max_wait 秒)。
+    消費状況は state_file に保存され、日次クォータは再起動後も引き継がれる。保存は save_interval 秒に1回までに間引き、
+    <state_file>.lock の flock の中で最新のファイルを読み直して、このプロセスの消費量を加算してから書き込む
+    (同時に動いている別のプロセスの消費量を上書きしないため)。
+    """
+
+    def __init__(self, api_keys, rpm=10, tpm=250000, rpd=250, state_file=None, max_wait=120, save_interval=5):
+        self.state_file = state_file
+        self.max_wait = max_wait
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+        self._last_saved = 0.0
+        saved = self._load_state()
+        self.keys = {}
+        for api_key in api_keys:
+            if api_key and api_key not in self.keys:
+                state = KeyState(api_key, rpm, tpm, rpd, saved.get(key_id(api_key)))
+                self.keys[api_key] = state
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, api_key):
+        return api_key in self.keys
+
+    # --- キーの選択 ---
+    def select_key(self, exclude=None):
+        """
+        最も負荷の低い、今すぐ送信できるキーを返す (枠の予約はしない。クライアントの初期キーの選択に使う)。
+        exclude に含まれるキーは (他に候補がある限り) 避ける。全キーが送信できない場合は、最も早く復帰するキーを返す。
+        """
+        if not self.keys:
+            return None
+        exclude = set(exclude or [])
+        now = time.time()
+        with self._lock:
+            candidates = [s for k, s in self.keys.items() if k not in exclude] or list(self.keys.values())
+            healthy = [s for s in candidates if s.is_ready(now)]
+            if healthy:
+                chosen = min(healthy, key=lambda s: (s.load(now), s.ready_at(now)))
+            else:
+                chosen = min(candidates, key=lambda s: s.ready_at(now))
+                wait = chosen.ready_at(now) - now
+                print(f"  ⚠️ 全てのAPIキーがクールダウン中、または枠が埋まっています。"
+                      f"{key_suffix(chosen.api_key)} が約 {wait:.0f} 秒後に復帰します。")
+            return chosen.api_key
+
+    def acquire(self, tokens=0, exclude=None, only=None):
+        """
+        今すぐ送信できるキーのうち最も負荷の低いものを選び、枠を予約して返す (finish_request と対で使う)。
+        only を渡すとそのキーだけから選ぶ (キャッシュ済みコンテンツを参照するリクエストなど、キーを固定したい場合)。
+        exclude に含まれるキーは (他に候補がある限り) 避ける。
+        送信できるキーが無ければ最も早く空くキーの ready_at まで待ち、max_wait 秒を超える場合は
+        KeyPoolExhaustedError を送出する。
+        """
+        exclude = set(exclude or [])
+        deadline = time.time() + self.max_wait
+        announced = False
+        while True:
+            now = time.time()
+            with self._lock:
+                pool = [s for k, s in self.keys.items() if only is None or k in only]
+                if not pool:
+                    return None
+                candidates = [s for s in pool if s.api_key not in exclude] or pool
+                ready = [s for s in candidates if s.is_ready(now, tokens)]
+                if ready:
+                    chosen = min(ready, key=lambda s: (s.load(now), s.ready_at(now, tokens)))
+                    chosen.reserve(now, tokens)
+                    return chosen.api_key
+                soonest = min(candidates, key=lambda s: s.ready_at(now, tokens))
+                ready_at = soonest.ready_at(now, tokens)
+            if ready_at > deadline:
+                raise KeyPoolExhaustedError(
+                    f"全てのAPIキーのクォータが枯渇しています ({key_suffix(soonest.api_key)} の復帰まで約 {ready_at - now:.0f} 秒)")
+            if not announced and ready_at - now >= 1:
+                print(f"  ⏳ 全てのAPIキーの枠が埋まっているため、約 {ready_at - now:.0f} 秒待ちます "
+                      f"({key_suffix(soonest.api_key)})。")
+                announced = True
+            time.sleep(max(0.0, ready_at - now) + 0.01)
+
+    def is_healthy(self, api_key):
+        """キーがクールダウン中でなく、日次クォータも残っているかを返す。"""
+        with self._lock:
+            state = self.keys.get(api_key)
+            return state is None or state.is_healthy(time.time())
+
+    def start_request(self, api_key, tokens=0):
+        """
+        acquire() を使わずに決めたキーで送信する前に呼び、そのキーの枠を予約する (待機はしない)。
+        finish_request() と対で使う。
+        """
+        with self._lock:
+            state = self.keys.get(api_key)
+            if state:
+                state.reserve(time.time(), tokens)
+
+    def finish_request(self, api_key, tokens=0, error=None, reserved_tokens=0):
+        """
+        acquire() / start_request() と対で呼び、結果 (成功時のトークン数 / 失敗時のエラー) を記録する。
+        reserved_tokens には予約時に渡した見積もりトークン数を渡し、実績との差を TPM で精算する。
+        """
+        with self._lock:
+            state = self.keys.get(api_key)
+            if state:
+                state.in_flight = max(0, state.in_flight - 1)
+                if error is None:
+                    state.consume("tpm", (tokens or 0) - (reserved_tokens or 0), time.time())
+        if error is None:
+            self.record_success(api_key, tokens)
+        else:
+            self.record_error(api_key, error)
+
+    # --- 結果の記録 ---
+    def record_success(self, api_key, tokens=0):
+        """成功したリクエスト1件と消費トークン数を記録する (RPM / RPD / TPM の枠は送信前に予約済み)。"""
+        with self._lock:
+            state = self.keys.get(api_key)
+            if not state:
+                return
+            state.total_requests += 1
+            state.total_tokens += int(tokens or 0)
+            state.pending["requests"] += 1
+            state.pending["tokens"] += int(tokens or 0)
+            state.consecutive_failures = 0
+        self.save()
+
+    def record_error(self, api_key, error):
+        """
+        失敗したリクエストを記録する。429/503 の場合はキーをクールダウンさせ、
+        連続失敗のたびにクールダウン時間を倍にする。失敗したリクエストも予約した RPM / RPD の枠を消費したものとして扱う。
+        """
+        now = time.time()
+        code = getattr(error, 'code', None)
+        status = str(getattr(error, 'status', '') or '')
+        with self._lock:
+            state = self.keys.get(api_key)
+            if not state:
+                return
+            if code == 429 or status == 'RESOURCE_EXHAUSTED':
+                base = RATE_LIMIT_COOLDOWN_SECONDS
+            elif code == 503 or status == 'UNAVAILABLE':
+                base = OVERLOAD_COOLDOWN_SECONDS
+            else:
+                base = 0
+            if base:
+                state.consecutive_failures += 1
+                cooldown = min(MAX_COOLDOWN_SECONDS, base * (2 ** (state.consecutive_failures - 1)))
+                state.cooldown_until = max(state.cooldown_until, now + cooldown)
+                print(f"  ⏸️ APIキー {key_suffix(api_key)} を {cooldown:.0f} 秒間クールダウンします。")
+        # クールダウンは他のプロセスにもすぐ伝わるよう、間引かずに保存する
+        self.save(force=bool(base))
+
+    # --- 永続化 ---
+    def _load_state(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return {}
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            print(f"⚠️ キー使用状況ファイルの読み込みに失敗しました: {e}")
+            return {}
+
+    def save(self, force=False):
+        """
+        消費状況を state_file に書き出す。force=False の場合は前回の保存から save_interval 秒以内なら何もしない。
+        flock の中で最新のファイルを読み直し、他のプロセスの消費量とこのプロセスの未保存の消費量を合算して書き込む。
+        """
+        if not self.state_file:
+            return
+        if not force and time.time() - self._last_saved < self.save_interval:
+            return
+        with self._save_lock:
+            try:
+                os.makedirs(os.path.dirname(self.state_file) or '.', exist_ok=True)
+                with open(self.state_file + ".lock", "a") as lock_file:
+                    if fcntl:
+                        fcntl.flock(lock_file, fcntl.LOCK_EX)
+                    try:
+                        saved = self._load_state()
+                        now = time.time()
+                        with self._lock:
+                            for state in self.keys.values():
+                                state.merge_saved(saved.get(state.id, {}), now)
+                                saved[state.id] = state.to_dict()
+                        tmp_path = f"{self.state_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+                        with open(tmp_path, 'w', encoding='utf-8') as f:
+                            json.dump(saved, f, indent=2)
+                        os.replace(tmp_path, self.state_file)
+                        self._last_saved = now
+                    finally:
+                        if fcntl:
+                            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            except Exception as e:
+                print(f"⚠️ キー使用状況ファイルの保存に失敗しました: {e}")
+
+    def summary(self):
+        """キーごとの状態を表示用の辞書リストで返す。"""
+        now = time.time()
+        with self._lock:
+            return [{
+                "key": key_suffix(s.api_key),
+                "healthy": s.is_healthy(now),
+                "rpm_left": int(s.rpm.available(now)),
+                "tpm_left": int(s.tpm.available(now)),
+                "rpd_left": int(s.rpd.available(now)),
+                "cooldown": max(0, int(s.cooldown_until - now)),
+            } for s in self.keys.values()]
+
+
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+def get_key_pool():
+    """settings.API_KEYS から作成したプロセス共通の KeyPool を返す。"""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = KeyPool(
+                getattr(settings, 'API_KEYS', []),
+                rpm=getattr(settings, 'KEY_RPM_LIMIT', 10),
+                tpm=getattr(settings, 'KEY_TPM_LIMIT', 250000),
+                rpd=getattr(settings, 'KEY_RPD_LIMIT', 250),
+                state_file=getattr(settings, 'KEY_USAGE_FILE', None),
+                max_wait=getattr(settings, 'KEY_MAX_WAIT_SECONDS', 120),
+                save_interval=getattr(settings, 'KEY_USAGE_SAVE_INTERVAL', 5),
+            )
+            # 間引かれて未保存のまま残った消費量を、終了時に書き出す
+            atexit.register(_POOL.save, force=True)
+        return _POOL
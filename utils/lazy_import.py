@@ -0,0 +1,44 @@
+import sys
+import importlib
+
+
+class LazyModule:
+    """
+    最初に属性へアクセスした時点でモジュールを import する代理オブジェクト。
+    google.genai / pandas / bs4 のように import だけで数百ミリ秒かかるモジュールを、
+    実際に使う関数が呼ばれるまで読み込まないために使う (ファイルを扱うだけの CLI の起動を速くする)。
+    """
+
+    def __init__(self, name):
+        self.__dict__["_lazy_name"] = name
+        self.__dict__["_lazy_module"] = None
+
+    def _load(self):
+        module = self.__dict__["_lazy_module"]
+        if module is None:
+            # import_module は import ロックで保護されるため、複数スレッドから同時に呼ばれても安全
+            module = importlib.import_module(self.__dict__["_lazy_name"])
+            self.__dict__["_lazy_module"] = module
+        return module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = "loaded" if self.__dict__["_lazy_module"] is not None else "not loaded"
+        return f"<lazy module '{self.__dict__['_lazy_name']}' ({state})>"
+
+
+def lazy_import(name):
+    """
+    name のモジュールを遅延 import する。既に読み込まれていればそのモジュールをそのまま返す。
+    例: types = lazy_import("google.genai.types")  (types.GenerateContentConfig に触れた時点で import される)
+    """
+    module = sys.modules.get(name)
+    return module if module is not None else LazyModule(name)
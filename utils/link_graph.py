@@ -0,0 +1,199 @@
+import os
+import json
+import time
+import hashlib
+import posixpath
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from utils.link_utils import HTML_EXTENSIONS, read_page_links, resolve_href, check_target, page_for_target
+from utils.publish_utils import atomic_write_text
+try:
+    from config import settings
+except ImportError:
+    settings = None
+
+DEFAULT_LINK_GRAPH_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), ".cache", "link_graph")
+
+
+def _scan_page(docs_root, rel_path):
+    """プロセスプールで実行する: 1ページの (相対パス, href のリスト, id の集合) を返す。"""
+    hrefs, anchors = read_page_links(os.path.join(docs_root, *rel_path.split("/")))
+    return rel_path, hrefs, anchors
+
+
+def scan_pages(docs_root, rel_paths, workers):
+    """rel_paths を workers プロセスで解析し、{相対パス: (href のリスト, id の集合)} を返す。"""
+    roots = [docs_root] * len(rel_paths)
+    if workers <= 1 or len(rel_paths) < 2:
+        results = map(_scan_page, roots, rel_paths)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(_scan_page, roots, rel_paths, chunksize=max(1, len(rel_paths) // (workers * 4))))
+    return {rel_path: (hrefs, anchors) for rel_path, hrefs, anchors in results}
+
+
+def _walk_site(docs_root):
+    """docs_root 以下を1度だけ走査し、(全ファイルの集合, 全ディレクトリの集合, {HTML の相対パス: [mtime_ns, サイズ]}) を返す。"""
+    files, dirs, signatures = set(), {"."}, {}
+    stack = [("", docs_root)] if os.path.isdir(docs_root) else []
+    while stack:
+        prefix, directory = stack.pop()
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                rel_path = prefix + entry.name
+                if entry.is_dir(follow_symlinks=False):
+                    dirs.add(rel_path)
+                    stack.append((rel_path + "/", entry.path))
+                    continue
+                files.add(rel_path)
+                if entry.name.lower().endswith(HTML_EXTENSIONS):
+                    stat = entry.stat()
+                    signatures[rel_path] = [stat.st_mtime_ns, stat.st_size]
+    return files, dirs, signatures
+
+
+def default_index_file(docs_root):
+    """docs_root ごとのリンクグラフの保存先 (.cache/link_graph/<パスのハッシュ>.json)。"""
+    cache_dir = getattr(settings, 'LINK_GRAPH_DIR', None) or DEFAULT_LINK_GRAPH_DIR
+    key = hashlib.sha256(os.path.abspath(docs_root).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir, f"{key}.json")
+
+
+class LinkGraph:
+    """
+    サイト内のページ間リンクの索引。ページごとに href と id を保存し、そこから外向き・内向きの辺を組み立てる。
+    - refresh() はファイルの mtime とサイズが変わったページだけを再解析し、索引を保存する。
+    - 孤立ページ・トップからのクリック深さ・被リンク数・リンク切れは、保存済みの索引からサイトを読み直さずに求める。
+    ページはサイトルート (docs) からの "/" 区切りの相対パスで表す。
+    """
+
+    VERSION = 1
+
+    def __init__(self, docs_root, index_file=None):
+        self.docs_root = os.path.abspath(docs_root)
+        self.index_file = index_file or default_index_file(docs_root)
+        self.pages = {}
+        self.files = set()
+        self.dirs = {"."}
+        try:
+            with open(self.index_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") == self.VERSION and data.get("docs_root") == self.docs_root:
+                self.pages = data["pages"]
+                self.files = set(data["files"])
+                self.dirs = set(data["dirs"])
+        except (OSError, ValueError, KeyError):
+            pass
+        self._build()
+
+    def refresh(self, workers=None):
+        """サイトを走査し、追加・変更されたページを再解析、削除されたページを索引から外す。self を返す。"""
+        workers = workers or os.cpu_count() or 1
+        started = time.perf_counter()
+        files, dirs, signatures = _walk_site(self.docs_root)
+        changed = sorted(rel for rel, sig in signatures.items() if self.pages.get(rel, {}).get("signature") != sig)
+        removed = [rel for rel in self.pages if rel not in signatures]
+        scanned = scan_pages(self.docs_root, changed, workers)
+
+        for rel in removed:
+            del self.pages[rel]
+        for rel, (hrefs, anchors) in scanned.items():
+            self.pages[rel] = {"signature": signatures[rel], "hrefs": hrefs, "anchors": sorted(anchors)}
+        structure_changed = files != self.files or dirs != self.dirs
+        self.files, self.dirs = files, dirs
+        if changed or removed or structure_changed:
+            self._save()
+        self._build()
+        print(f"🕸️ リンクグラフ: {len(self.pages)} ページ中 {len(changed)} ページを再解析、{len(removed)} ページを削除 "
+              f"({time.perf_counter() - started:.2f} 秒)")
+        return self
+
+    def _save(self):
+        data = {
+            "version": self.VERSION,
+            "docs_root": self.docs_root,
+            "files": sorted(self.files),
+            "dirs": sorted(self.dirs),
+            "pages": self.pages,
+        }
+        atomic_write_text(self.index_file, json.dumps(data, ensure_ascii=False, separators=(",", ":")))
+
+    def _build(self):
+        """保存済みの href から辺を組み立てる。同じディレクトリからの同じ href は1度だけ解決する。"""
+        anchor_index = {rel: set(page["anchors"]) for rel, page in self.pages.items()}
+        resolved = {}
+        self.edges = {}
+        self.outbound_pages = {}
+        self.inbound_pages = {rel: set() for rel in self.pages}
+        self.link_count = 0
+        for source, page in self.pages.items():
+            edges = []
+            targets = set()
+            for href in page["hrefs"]:
+                key = (source if href.startswith("#") else posixpath.dirname(source), href)
+                if key not in resolved:
+                    link = resolve_href(source, href)
+                    resolved[key] = link and (
+                        link[0],
+                        page_for_target(link[0], self.files, self.dirs),
+                        check_target(link[0], link[1], self.files, self.dirs, anchor_index),
+                    )
+                if resolved[key] is None:
+                    continue
+                target, target_page, reason = resolved[key]
+                edges.append((href, target, target_page, reason))
+                if target_page and target_page != source and target_page in self.inbound_pages:
+                    targets.add(target_page)
+                    self.inbound_pages[target_page].add(source)
+            self.link_count += len(edges)
+            self.edges[source] = edges
+            self.outbound_pages[source] = targets
+        self.unique_links = sum(1 for value in resolved.values() if value is not None)
+
+    # --- クエリ ---
+
+    def outbound(self, page):
+        """page からリンクしている (自分以外の) ページの集合。"""
+        return self.outbound_pages.get(page, set())
+
+    def inbound(self, page):
+        """page にリンクしている (自分以外の) ページの集合。"""
+        return self.inbound_pages.get(page, set())
+
+    def inbound_counts(self):
+        """{ページ: 被リンク元のページ数}。"""
+        return {page: len(sources) for page, sources in self.inbound_pages.items()}
+
+    def orphans(self, root="index.html"):
+        """他のどのページからもリンクされていないページ (root を除く) を返す。"""
+        return sorted(page for page, sources in self.inbound_pages.items() if not sources and page != root)
+
+    def click_depths(self, root="index.html"):
+        """root からのクリック数 (幅優先探索) を {ページ: 深さ} で返す。辿り着けないページは含まれない。"""
+        if root not in self.pages:
+            return {}
+        depths = {root: 0}
+        queue = deque([root])
+        while queue:
+            page = queue.popleft()
+            for target in self.outbound_pages.get(page, ()):
+                if target not in depths:
+                    depths[target] = depths[page] + 1
+                    queue.append(target)
+        return depths
+
+    def unreachable(self, root="index.html"):
+        """root からリンクを辿っても到達できないページ。"""
+        depths = self.click_depths(root)
+        return sorted(page for page in self.pages if page not in depths)
+
+    def broken_edges(self):
+        """リンク切れを {source, href, target, reason} のリストで返す (同じページ内の同じ href は1件にまとめる)。"""
+        broken = []
+        for source in sorted(self.edges, key=lambda rel: rel.split("/")):
+            reported = set()
+            for href, target, _, reason in self.edges[source]:
+                if reason and href not in reported:
+                    reported.add(href)
+                    broken.append({"source": source, "href": href, "target": target, "reason": reason})
+        return broken
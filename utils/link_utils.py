@@ -0,0 +1,84 @@
+import re
+import html
+import posixpath
+from urllib.parse import unquote
+
+HTML_EXTENSIONS = ('.html', '.htm')
+
+# BeautifulSoup で文書全体をパースせず、必要な属性だけを正規表現で取り出す
+ANCHOR_HREF_RE = re.compile(
+    r"""<a(?:rea)?\b[^>]*?\shref\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""", re.IGNORECASE)
+ID_ATTR_RE = re.compile(r"""\sid\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""", re.IGNORECASE)
+ANCHOR_NAME_RE = re.compile(r"""<a\b[^>]*?\sname\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s"'>]+))""", re.IGNORECASE)
+COMMENT_RE = re.compile(r"<!--.*?-->", re.DOTALL)
+# http:, mailto:, javascript:, data: などスキーム付きの URL と、プロトコル相対 URL (//example.com) は外部リンクとして扱う
+SCHEME_RE = re.compile(r"^(?:[a-zA-Z][a-zA-Z0-9+.\-]*:|//)")
+# ページ内に id が無くても、ブラウザが先頭へスクロールするフラグメント
+IMPLICIT_FRAGMENTS = {"", "top"}
+
+
+def _values(matches):
+    return [html.unescape(a or b or c).strip() for a, b, c in matches]
+
+
+def extract_links(content):
+    """HTML 文字列から (<a>/<area> の href のリスト (出現順), id と <a name> の集合) を返す。コメント内は無視する。"""
+    if "<!--" in content:
+        content = COMMENT_RE.sub("", content)
+    hrefs = _values(ANCHOR_HREF_RE.findall(content))
+    anchors = set(_values(ID_ATTR_RE.findall(content)))
+    anchors.update(_values(ANCHOR_NAME_RE.findall(content)))
+    return hrefs, anchors
+
+
+def read_page_links(path):
+    """path の HTML を読み込み、extract_links の結果を返す。"""
+    with open(path, 'r', encoding='utf-8', errors='replace') as f:
+        return extract_links(f.read())
+
+
+def resolve_href(source_rel, href):
+    """
+    source_rel (サイトルートからの相対パス) のページにある href を解決し、(リンク先の相対パス, フラグメント) を返す。
+    外部リンク・空の href の場合は None。"/" で始まる href はサイトルートからのパスとして扱う。
+    リンク先がサイトルートの外を指す場合、相対パスは ".." で始まる。
+    """
+    if not href or SCHEME_RE.match(href):
+        return None
+    path, _, fragment = href.partition("#")
+    path = unquote(path.split("?", 1)[0])
+    if not path:
+        return source_rel, unquote(fragment)
+    if path.startswith("/"):
+        target = posixpath.normpath(path.lstrip("/") or ".")
+    else:
+        target = posixpath.normpath(posixpath.join(posixpath.dirname(source_rel), path))
+    return target, unquote(fragment)
+
+
+def page_for_target(target, files, dirs):
+    """リンク先の相対パスを、実際に表示されるページ (ディレクトリなら index.html) に変換する。無ければ None。"""
+    if target in files:
+        return target
+    if target in dirs:
+        index = "index.html" if target == "." else target + "/index.html"
+        return index if index in files else None
+    return None
+
+
+def check_target(target, fragment, files, dirs, anchor_index):
+    """
+    resolve_href の結果を検証し、リンク切れの理由 (文字列) を返す。問題が無ければ None。
+    anchor_index は {HTML の相対パス: id の集合} で、フラグメントの確認に使う。
+    """
+    if target == ".." or target.startswith("../"):
+        return "サイトルートの外を指しています"
+    if target not in files and target not in dirs:
+        return "リンク先が存在しません"
+    if fragment in IMPLICIT_FRAGMENTS:
+        return None
+    page = page_for_target(target, files, dirs)
+    anchors = anchor_index.get(page) if page else None
+    if anchors is not None and fragment not in anchors:
+        return f"アンカー #{fragment} がありません"
+    return None
@@ -0,0 +1,333 @@
+import os
+import re
+import json
+import hashlib
+from datetime import datetime
+from utils.manifest_utils import fingerprint_inputs
+from utils.publish_utils import atomic_write_text
+from utils.article_registry import split_file_name
+try:
+    from config import settings
+except ImportError:
+    settings = None
+
+# LLM が生成する一覧ページの中で、記事カードのグリッドを差し込む位置
+GRID_PLACEHOLDER = "<!-- GRID_PLACEHOLDER -->"
+# 一覧ページのシェル (GRID_PLACEHOLDER を残したままのページ) の保存先 (output_reports 配下)
+SHELL_DIR_NAME = "listing_shells"
+SHELL_INDEX_NAME = "index.json"
+# カードのグリッドとカード1枚ごとの目印。記事の追加・更新・削除でカードを1枚だけ差し替えるのに使う
+GRID_START = "<!-- GRID_START -->"
+GRID_END = "<!-- GRID_END -->"
+CARD_END = "<!-- /CARD -->"
+GRID_OPEN = '<div class="grid grid-cols-1 md:grid-cols-2 gap-8">\n'
+# 2ページ目以降のアーカイブは <section>/page/<n>.html に置く
+ARCHIVE_PAGE_DIR = "page"
+ARCHIVE_PAGE_RE = re.compile(r"^(\d+)\.html$")
+PAGINATION_START = "<!-- PAGINATION_START -->"
+PAGINATION_END = "<!-- PAGINATION_END -->"
+# 1階層深いアーカイブページでは、シェル内の相対 URL の前に "../" を付ける (スキーム付き・ルート相対・# ・? で始まる URL は除く)
+RELATIVE_URL_RE = re.compile(
+    r"""(\s(?:href|src|action|poster)\s*=\s*)(["'])(?![a-zA-Z][a-zA-Z0-9+.\-]*:|//|/|#|\?|["'])""", re.IGNORECASE)
+GRID_RE = re.compile(re.escape(GRID_START) + r".*?" + re.escape(GRID_END), re.DOTALL)
+CARD_RE = re.compile(r"\n[ \t]*<!-- CARD:(.+?) -->.*?" + re.escape(CARD_END) + r"\n", re.DOTALL)
+
+
+def card_number(page):
+    """カードの並び替えに使う記事の連番 (ファイル名の末尾の数字)。無ければ None。"""
+    return split_file_name(page.get('file_name', ''))[2]
+
+
+def sort_cards(page_list, order=None):
+    """
+    一覧ページに並べる順に page_list を並べ替える (order の既定は settings.LISTING_CARD_ORDER)。
+      number: 記事の連番の昇順 (連番の無い記事は末尾) / date: 作成日 (created_at) の新しい順 / registry: 登録順のまま
+    """
+    order = order or getattr(settings, 'LISTING_CARD_ORDER', 'number')
+    if order == "number":
+        return sorted(page_list, key=lambda p: (card_number(p) is None, card_number(p) or 0))
+    if order == "date":
+        return sorted(page_list, key=lambda p: (p.get('created_at') or "", card_number(p) or 0), reverse=True)
+    return list(page_list)
+
+
+def build_card_html(page, base=""):
+    """
+    1ページ分の記事カード。CARD マーカーで囲み、一覧ページ内でカード単位に差し替えられるようにする。
+    base はリンクの前に付けるパス (アーカイブの2ページ目以降は "../")。
+    """
+    title = page.get('title', 'No Title')
+    # 目的が長い場合は丸める処理を入れてもいいが、一旦そのまま
+    desc = page.get('purpose', 'No Description')
+    # ファイル名からリンク先を特定 (相対パス計算は簡易的、同階層前提)
+    link = base + os.path.basename(page.get('file_name', '#'))
+
+    # カテゴリ推定 (ディレクトリ名)
+    category = "Project"
+    if '/' in page.get('file_name', ''):
+        category = page.get('file_name', '').split('/')[0].capitalize()
+
+    return f"""
+            <!-- CARD:{page.get('file_name', '#')} -->
+            <a href="{link}" class="block bg-brand-gray-800 rounded-lg p-6 hover:bg-brand-gray-700 hover:scale-105 transition-all duration-300 shadow-lg">
+                <div class="flex items-center mb-3">
+                    <span class="inline-block bg-brand-accent-500 text-brand-gray-900 text-xs font-semibold px-2.5 py-1 rounded-full">{category}</span>
+                </div>
+                <h3 class="text-xl font-bold text-white mb-2">{title}</h3>
+                <p class="text-brand-light-300 text-sm">{desc}</p>
+            </a>
+            {CARD_END}
+"""
+
+
+def _grid_from_cards(cards):
+    if not cards:
+        return ""
+    return f"{GRID_START}\n{GRID_OPEN}{''.join(cards)}</div>\n{GRID_END}"
+
+
+def build_grid_html(page_list, base=""):
+    """page_list の各ページを記事カードにしたグリッドHTMLを返す (GRID_PLACEHOLDER に挿入する)。"""
+    return _grid_from_cards([build_card_html(page, base) for page in page_list])
+
+
+def read_cards(html):
+    """一覧ページのグリッド内のカードを {ファイル名: カードのHTML} (ページ内の順) で返す。マーカーが無ければ None。"""
+    match = GRID_RE.search(html)
+    if not match:
+        return None
+    return {card.group(1): card.group(0) for card in CARD_RE.finditer(match.group(0))}
+
+
+def _replace_grid(html, cards):
+    match = GRID_RE.search(html)
+    return html[:match.start()] + _grid_from_cards(cards) + html[match.end():]
+
+
+def upsert_card(html, page, order, base=""):
+    """
+    一覧ページ html に page のカードを追加 (既にあれば置き換え) した HTML を返す。
+    カードは order (セクション内の全記事のファイル名を表示順に並べたもの) の順に並べ、order に無いカードは取り除く。
+    他のカードの HTML は作り直さずにそのまま使う。グリッドのマーカーが無い場合は None。
+    """
+    cards = read_cards(html)
+    if cards is None:
+        return None
+    cards[page['file_name']] = build_card_html(page, base)
+    return _replace_grid(html, [cards[name] for name in order if name in cards])
+
+
+def remove_card(html, file_name):
+    """一覧ページ html から file_name のカードを取り除いた HTML を返す。グリッドのマーカーが無い場合は None。"""
+    cards = read_cards(html)
+    if cards is None:
+        return None
+    cards.pop(file_name, None)
+    return _replace_grid(html, list(cards.values()))
+
+
+def paginate(page_list, page_size=None):
+    """
+    page_list をアーカイブの1ページ分ずつに分ける (page_size の既定は settings.LISTING_PAGE_SIZE、0 以下なら分けない)。
+    記事が無くても1ページ (空のリスト) を返す。
+    """
+    if page_size is None:
+        page_size = getattr(settings, 'LISTING_PAGE_SIZE', 0)
+    if not page_size or page_size <= 0:
+        return [list(page_list)]
+    return [page_list[i:i + page_size] for i in range(0, len(page_list), page_size)] or [[]]
+
+
+def archive_page_path(section, page_number):
+    """アーカイブの page_number ページ目の相対パス (1ページ目は <section>/index.html、以降は <section>/page/<n>.html)。"""
+    if page_number == 1:
+        return f"{section}/index.html"
+    return f"{section}/{ARCHIVE_PAGE_DIR}/{page_number}.html"
+
+
+def archive_page_numbers(root, section):
+    """root/<section>/page/ にある2ページ目以降のアーカイブのページ番号 (昇順)。"""
+    try:
+        names = os.listdir(os.path.join(root, section, ARCHIVE_PAGE_DIR))
+    except OSError:
+        return []
+    return sorted(int(m.group(1)) for m in map(ARCHIVE_PAGE_RE.match, names) if m and int(m.group(1)) >= 2)
+
+
+def rebase_relative_urls(html, prefix):
+    """href / src などの相対 URL の前に prefix を付ける (シェルを1階層深いアーカイブページで使うため)。"""
+    return RELATIVE_URL_RE.sub(lambda m: m.group(1) + m.group(2) + prefix, html)
+
+
+def build_pagination_html(page_number, page_count):
+    """
+    アーカイブの前後のページへのリンク。1ページしか無い場合は空文字列。
+    リンクは前後のページの有無だけで決まるため、記事が増えてページが増えても既存のページ (最後のページ以外) は変わらない。
+    """
+    if page_count <= 1:
+        return ""
+    if page_number == 1:
+        prev_link = None
+        next_link = f"{ARCHIVE_PAGE_DIR}/2.html"
+    else:
+        prev_link = "../index.html" if page_number == 2 else f"{page_number - 1}.html"
+        next_link = f"{page_number + 1}.html"
+    if page_number >= page_count:
+        next_link = None
+    link_class = "inline-block bg-brand-gray-800 rounded-lg px-4 py-2 text-white hover:bg-brand-gray-700 transition-colors duration-300"
+    prev_html = f'<a href="{prev_link}" rel="prev" class="{link_class}">← 前のページ</a>' if prev_link else "<span></span>"
+    next_html = f'<a href="{next_link}" rel="next" class="{link_class}">次のページ →</a>' if next_link else "<span></span>"
+    return f"""
+{PAGINATION_START}
+<nav class="flex justify-between items-center mt-12" aria-label="ページ送り">
+    {prev_html}
+    <span class="text-brand-light-300 text-sm">ページ {page_number}</span>
+    {next_html}
+</nav>
+{PAGINATION_END}"""
+
+
+def render_archive_page(shell, page_list, page_number=1, page_count=1):
+    """
+    シェルの GRID_PLACEHOLDER を page_list のカードグリッドとページ送りに置き換えたアーカイブページを返す (API 呼び出しなし)。
+    2ページ目以降 (<section>/page/<n>.html) はシェル内の相対 URL とカードのリンクを1階層分ずらす。
+    """
+    base = "" if page_number == 1 else "../"
+    if base:
+        shell = rebase_relative_urls(shell, base)
+    return shell.replace(GRID_PLACEHOLDER, build_grid_html(page_list, base) + build_pagination_html(page_number, page_count))
+
+
+def listing_fingerprint(shell, page_list, page_number=1, page_count=1):
+    """アーカイブページの出力を決める入力 (シェル・カードのグリッド・ページ送り) の指紋。BuildManifest の判定に使う。"""
+    return fingerprint_inputs(
+        shell=hashlib.sha256(shell.encode('utf-8')).hexdigest(),
+        grid=build_grid_html(page_list, "" if page_number == 1 else "../"),
+        pagination=build_pagination_html(page_number, page_count),
+    )
+
+
+def plan_section_archive(section, page_list, page_size=None):
+    """section のアーカイブを [(ページ番号, 相対パス, そのページの記事), ...] として返す。"""
+    chunks = paginate(page_list, page_size)
+    return [(n, archive_page_path(section, n), chunk) for n, chunk in enumerate(chunks, start=1)]
+
+
+def write_section_archive(root, section, shell, page_list, manifest, page_size=None, open_root=None):
+    """
+    section のアーカイブ (index.html, page/2.html, ...) をシェルから描画して root に書き出し、書き出したページ数を返す。
+    - マニフェストの指紋 (シェル・そのページのカード・ページ送り) が変わったページだけを書き出す。
+    - 記事が減って不要になったページ (page/<n>.html) は削除する。
+    - open_root を渡すと、最初に書き換えが必要になった時点で呼び出し、その戻り値を書き出し先のルートにする
+      (ステージングディレクトリを必要になってから開くため)。
+    """
+    pages = plan_section_archive(section, page_list, page_size)
+    written = 0
+    for page_number, rel_path, chunk in pages:
+        output_path = os.path.join(root, *rel_path.split("/"))
+        fingerprint = listing_fingerprint(shell, chunk, page_number, len(pages))
+        if manifest.is_fresh(output_path, fingerprint):
+            continue
+        if open_root is not None:
+            root, open_root = open_root(), None
+            output_path = os.path.join(root, *rel_path.split("/"))
+        atomic_write_text(output_path, render_archive_page(shell, chunk, page_number, len(pages)))
+        manifest.record(output_path, fingerprint)
+        written += 1
+
+    stale = [n for n in archive_page_numbers(root, section) if n > len(pages)]
+    if stale and open_root is not None:
+        root = open_root()
+    for page_number in stale:
+        os.remove(os.path.join(root, section, ARCHIVE_PAGE_DIR, f"{page_number}.html"))
+    if stale:
+        print(f"  🗑️ 不要になったアーカイブページを削除しました: {section}/{ARCHIVE_PAGE_DIR}/ ({len(stale)} ページ)")
+    return written
+
+
+def read_archive_cards(root, section):
+    """
+    section のアーカイブの各ページのカードを [(相対パス, HTML, {ファイル名: カードのHTML}), ...] で返す。
+    1ページ目が無い、またはマーカーの無いページがある場合は None。
+    """
+    page_numbers = [1] + archive_page_numbers(root, section)
+    if page_numbers != list(range(1, len(page_numbers) + 1)):
+        return None
+    pages = []
+    for page_number in page_numbers:
+        rel_path = archive_page_path(section, page_number)
+        try:
+            with open(os.path.join(root, *rel_path.split("/")), 'r', encoding='utf-8') as f:
+                html = f.read()
+        except OSError:
+            return None
+        cards = read_cards(html)
+        if cards is None:
+            return None
+        pages.append((rel_path, html, cards))
+    return pages
+
+
+class ListingShellStore:
+    """
+    セクション一覧ページのシェルの保存先 (<output_reports>/listing_shells/<section>.html)。
+    シェルはヘッダー・フッター・導入文を含むページ全体を LLM で1度だけ生成したもので、記事カードの位置に GRID_PLACEHOLDER を残している。
+    生成時の入力の指紋 (アイデンティティ・ページ仕様・共通パーツ・モデルなど) を index.json に記録し、
+    指紋が変わった場合か invalidate() された場合だけ作り直す。記事の追加・削除ではシェルは変わらない。
+    """
+
+    def __init__(self, reports_dir):
+        self.root = os.path.join(reports_dir, SHELL_DIR_NAME)
+        self.index_path = os.path.join(self.root, SHELL_INDEX_NAME)
+        try:
+            with open(self.index_path, 'r', encoding='utf-8') as f:
+                self.index = json.load(f)
+        except (OSError, ValueError):
+            self.index = {}
+
+    def _path(self, section):
+        return os.path.join(self.root, f"{section}.html")
+
+    def latest(self, section):
+        """入力の指紋に関係なく、section の保存済みのシェルを返す。無ければ None。"""
+        if section not in self.index:
+            return None
+        try:
+            with open(self._path(section), 'r', encoding='utf-8') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def get(self, section, fingerprint):
+        """fingerprint の入力で生成済みのシェルを返す。無い・入力が変わった場合は None。"""
+        entry = self.index.get(section)
+        if not entry or entry.get("fingerprint") != fingerprint:
+            return None
+        try:
+            with open(self._path(section), 'r', encoding='utf-8') as f:
+                shell = f.read()
+        except OSError:
+            return None
+        return shell if GRID_PLACEHOLDER in shell else None
+
+    def save(self, section, fingerprint, shell):
+        atomic_write_text(self._path(section), shell)
+        self.index[section] = {
+            "fingerprint": fingerprint,
+            "generated_at": datetime.now().isoformat(timespec="seconds"),
+        }
+        self._save_index()
+
+    def invalidate(self, section=None):
+        """section (省略時は全セクション) のシェルを無効にし、次回の更新で LLM に作り直させる。"""
+        sections = [section] if section else list(self.index)
+        for name in sections:
+            self.index.pop(name, None)
+            try:
+                os.remove(self._path(name))
+            except OSError:
+                pass
+        self._save_index()
+
+    def _save_index(self):
+        atomic_write_text(self.index_path, json.dumps(self.index, ensure_ascii=False, indent=1, sort_keys=True))
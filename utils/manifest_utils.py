@@ -0,0 +1,80 @@
+import os
+import json
+import hashlib
+import threading
+from datetime import datetime
+from utils.publish_utils import atomic_write_text
+
+# 出力ディレクトリ内に置くマニフェストのファイル名 (ページと一緒にステージング・公開される)
+MANIFEST_NAME = ".build_manifest.json"
+
+
+def fingerprint_inputs(**inputs):
+    """ページ生成の入力 (JSON 化できる値) から、順序に依存しない SHA-256 の指紋を返す。"""
+    data = json.dumps(inputs, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()
+
+
+class BuildManifest:
+    """
+    出力ファイルごとに「生成に使った入力の指紋」を記録するビルドマニフェスト。
+    指紋が一致し、出力ファイルも残っているページは再生成せずに再利用する。
+    マニフェストは出力ディレクトリ (root) 内の MANIFEST_NAME に保存し、キーは root からの相対パスにする。
+    ページと同じディレクトリに置くことで、ステージングディレクトリの破棄・公開とマニフェストの内容が常に一致する。
+    """
+
+    VERSION = 1
+
+    def __init__(self, root, force=False):
+        self.root = root
+        self.path = os.path.join(root, MANIFEST_NAME)
+        self.force = force
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self.entries = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") == self.VERSION:
+                self.entries = data.get("outputs", {})
+        except (OSError, ValueError):
+            pass
+
+    def rebase(self, root):
+        """保存先と基準ディレクトリを root (ステージングディレクトリなど) に切り替える。キーは変わらない。"""
+        with self._lock:
+            self.root = root
+            self.path = os.path.join(root, MANIFEST_NAME)
+
+    def _key(self, output_path):
+        return os.path.relpath(output_path, self.root).replace(os.sep, "/")
+
+    def is_fresh(self, output_path, fingerprint):
+        """output_path が同じ入力から生成済みなら True (ヒット)。それ以外は False (ミス) を返し、集計する。"""
+        entry = self.entries.get(self._key(output_path)) if not self.force else None
+        fresh = bool(entry) and entry.get("fingerprint") == fingerprint and os.path.exists(output_path)
+        with self._lock:
+            if fresh:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return fresh
+
+    def record(self, output_path, fingerprint):
+        """output_path を fingerprint の入力で生成したことを記録し、マニフェストを保存する。"""
+        with self._lock:
+            self.entries[self._key(output_path)] = {
+                "fingerprint": fingerprint,
+                "built_at": datetime.now().isoformat(timespec="seconds"),
+            }
+            self._save()
+
+    def _save(self):
+        data = {"version": self.VERSION, "outputs": self.entries}
+        atomic_write_text(self.path, json.dumps(data, ensure_ascii=False, indent=1, sort_keys=True))
+
+    def report(self):
+        total = self.hits + self.misses
+        print(f"🧾 ビルドマニフェスト: {total} ページ中 {self.hits} ページは入力が変わっていないため再利用、"
+              f"{self.misses} ページを再生成対象にしました。")
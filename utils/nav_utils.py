@@ -0,0 +1,93 @@
+import os
+import re
+try:
+    from config import settings
+except ImportError:
+    settings = None
+
+
+def estimate_tokens(text):
+    """
+    プロンプトのトークン数をおおまかに見積もる。
+    ASCII は約4文字で1トークン、日本語などの非ASCII文字は1文字1トークンとして数える。
+    """
+    non_ascii = sum(1 for ch in text if ord(ch) > 127)
+    return non_ascii + (len(text) - non_ascii + 3) // 4
+
+
+def _section_dir(file_name):
+    return os.path.dirname(file_name or "").replace(os.path.sep, '/')
+
+
+def is_global_nav_page(file_name):
+    """トップページ、または第1階層のセクションの index.html (グローバルナビの対象) かを返す。"""
+    file_name = (file_name or "").replace(os.path.sep, '/')
+    return file_name == "index.html" or (file_name.endswith("/index.html") and file_name.count('/') == 1)
+
+
+def _bigrams(text):
+    text = re.sub(r"\s+", "", (text or "").lower())
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+def _nav_line(page):
+    return f' - {page.get("title", "N/A")} ({page.get("file_name", "N/A")})'
+
+
+def build_nav_context(target_page, page_list, token_budget=None, related_count=None):
+    """
+    target_page のプロンプトに渡すナビゲーション構造を、トークン予算内に収めて返す。
+    サイト全体ではなく、次の順に必要なページだけを含める:
+      1. グローバルナビ (トップページと各セクションの index.html)
+      2. 関連ページ (タイトル・目的の文字バイグラムが似ている上位 related_count 件)
+      3. 同じセクションの兄弟ページ (ページリスト上で近い順)
+    予算を超えた分は件数だけを注記するため、サイトが数千記事になってもプロンプトの大きさは一定に保たれる。
+    """
+    token_budget = token_budget or getattr(settings, 'NAV_CONTEXT_TOKEN_BUDGET', 1500)
+    related_count = getattr(settings, 'NAV_RELATED_PAGES', 5) if related_count is None else related_count
+
+    target_file = target_page.get('file_name', '')
+    target_dir = _section_dir(target_file)
+    pages = [p for p in page_list if p.get('file_name') != target_file]
+
+    global_nav = [p for p in pages if is_global_nav_page(p.get('file_name'))]
+    chosen = {id(p) for p in global_nav}
+
+    related = []
+    if related_count:
+        target_grams = _bigrams(f"{target_page.get('title', '')}{target_page.get('purpose', '')}")
+        scored = []
+        for p in pages:
+            if id(p) in chosen:
+                continue
+            grams = _bigrams(f"{p.get('title', '')}{p.get('purpose', p.get('summary', ''))}")
+            union = len(target_grams | grams)
+            score = len(target_grams & grams) / union if union else 0.0
+            if score > 0:
+                scored.append((score, p))
+        scored.sort(key=lambda item: item[0], reverse=True)
+        related = [p for _, p in scored[:related_count]]
+        chosen.update(id(p) for p in related)
+
+    # 兄弟ページは、ページリスト上で対象ページに近いもの (前後の記事) を優先する
+    positions = {id(p): i for i, p in enumerate(page_list)}
+    target_pos = next((i for i, p in enumerate(page_list) if p.get('file_name') == target_file), len(page_list))
+    siblings = [p for p in pages if id(p) not in chosen and _section_dir(p.get('file_name')) == target_dir]
+    siblings.sort(key=lambda p: abs(positions[id(p)] - target_pos))
+
+    lines = []
+    used = 0
+    omitted = 0
+    for group in (global_nav, related, siblings):
+        for p in group:
+            line = _nav_line(p)
+            cost = estimate_tokens(line)
+            if used + cost > token_budget:
+                omitted += 1
+                continue
+            lines.append(line)
+            used += cost
+    omitted += len(pages) - len(chosen) - len(siblings)
+    if omitted > 0:
+        lines.append(f" - (他 {omitted} ページはナビゲーションの対象外のため省略)")
+    return "\n".join(lines)
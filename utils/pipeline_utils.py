@@ -0,0 +1,187 @@
+import os
+import json
+import time
+import shutil
+import hashlib
+import contextvars
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from utils.telemetry import scope as telemetry_scope
+from utils.publish_utils import atomic_write_text
+
+
+class StageError(Exception):
+    """ステージを完了できなかったことを示す。再実行時はこのステージから再開する。"""
+
+
+class PipelineError(Exception):
+    """1つ以上のステージが失敗したことを示す。failed は {ステージ名: 例外}。"""
+
+    def __init__(self, failed):
+        self.failed = failed
+        names = ", ".join(failed)
+        super().__init__(f"ステージが失敗しました: {names}")
+
+
+def fingerprint(value):
+    """JSON 化できる値の内容ハッシュ (先頭16桁) を返す。"""
+    data = json.dumps(value, ensure_ascii=False, sort_keys=True, default=str)
+    return hashlib.sha256(data.encode('utf-8')).hexdigest()[:16]
+
+
+def _write_json(path, data):
+    atomic_write_text(path, json.dumps(data, ensure_ascii=False, indent=2))
+
+
+def _read_json(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class Stage:
+    def __init__(self, name, func, deps=(), checkpoint=True):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.checkpoint = checkpoint
+
+
+class Pipeline:
+    """
+    名前付きステージの依存グラフを実行する。
+    - ステージ関数は deps の順に依存先の出力を受け取り、JSON 化できる値を返す。
+    - 完了したステージの出力は checkpoint_dir/<ステージ名>.json に保存され、
+      依存先の出力 (と inputs) が変わらない限り、再実行時はチェックポイントから読み込まれる。
+    - 依存関係の無いステージは max_workers まで並列に実行される。
+    - 失敗したステージがあると、実行中のステージの完了を待ってから PipelineError を送出する。
+    """
+
+    def __init__(self, checkpoint_dir, inputs=None, max_workers=4, fresh=False):
+        self.checkpoint_dir = checkpoint_dir
+        self.inputs = dict(inputs or {})
+        self.max_workers = max(1, max_workers)
+        self.stages = {}
+        self.results = {}
+        self._fingerprints = {name: fingerprint(value) for name, value in self.inputs.items()}
+        self._input_fingerprints = {}
+        if fresh and os.path.isdir(checkpoint_dir):
+            shutil.rmtree(checkpoint_dir)
+            print(f"🧹 チェックポイントを削除しました: {checkpoint_dir}")
+
+    def add(self, name, func, deps=(), checkpoint=True):
+        if name in self.stages or name in self.inputs:
+            raise ValueError(f"ステージ名が重複しています: {name}")
+        self.stages[name] = Stage(name, func, deps, checkpoint)
+        return func
+
+    def stage(self, name, deps=(), checkpoint=True):
+        """ステージを登録するデコレータ。"""
+        def decorator(func):
+            return self.add(name, func, deps, checkpoint)
+        return decorator
+
+    def checkpoint_path(self, name):
+        return os.path.join(self.checkpoint_dir, f"{name}.json")
+
+    def _validate(self):
+        for stage in self.stages.values():
+            for dep in stage.deps:
+                if dep not in self.stages and dep not in self.inputs:
+                    raise ValueError(f"ステージ '{stage.name}' の依存先 '{dep}' が見つかりません。")
+        # 循環の検出
+        visiting, visited = set(), set()
+
+        def visit(name):
+            if name in visited or name in self.inputs:
+                return
+            if name in visiting:
+                raise ValueError(f"ステージの依存関係が循環しています: {name}")
+            visiting.add(name)
+            for dep in self.stages[name].deps:
+                visit(dep)
+            visiting.discard(name)
+            visited.add(name)
+
+        for name in self.stages:
+            visit(name)
+
+    def _load_checkpoint(self, stage, input_fp):
+        if not stage.checkpoint:
+            return None
+        data = _read_json(self.checkpoint_path(stage.name))
+        if not data or data.get("inputs") != input_fp or "value" not in data:
+            return None
+        return data
+
+    def _run_stage(self, stage):
+        args = [self.inputs[dep] if dep in self.inputs else self.results[dep] for dep in stage.deps]
+        started = time.perf_counter()
+        with telemetry_scope(stage.name):
+            value = stage.func(*args)
+        return value, time.perf_counter() - started
+
+    def _complete(self, stage, value, seconds=None):
+        self.results[stage.name] = value
+        self._fingerprints[stage.name] = fingerprint(value)
+        if stage.checkpoint and seconds is not None:
+            _write_json(self.checkpoint_path(stage.name), {
+                "stage": stage.name,
+                "inputs": self._input_fingerprints[stage.name],
+                "completed_at": datetime.now().isoformat(timespec="seconds"),
+                "seconds": round(seconds, 2),
+                "value": value,
+            })
+
+    def run(self):
+        """全ステージを実行し、{ステージ名: 出力} を返す。"""
+        self._validate()
+        pending = dict(self.stages)
+        running = {}
+        failed = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                # 依存先がすべて完了したステージを、チェックポイントから読み込むか実行に回す
+                progressed = True
+                while progressed and not failed:
+                    progressed = False
+                    for name, stage in list(pending.items()):
+                        if not all(dep in self._fingerprints for dep in stage.deps):
+                            continue
+                        del pending[name]
+                        progressed = True
+                        input_fp = fingerprint({"stage": name, "deps": {dep: self._fingerprints[dep] for dep in stage.deps}})
+                        self._input_fingerprints[name] = input_fp
+                        saved = self._load_checkpoint(stage, input_fp)
+                        if saved is not None:
+                            print(f"⏭️ ステージ '{name}': チェックポイントから再開します ({saved.get('completed_at')} 完了)。")
+                            self._complete(stage, saved["value"])
+                            continue
+                        print(f"▶️ ステージ '{name}' を開始します。")
+                        # ステージ内の LLM 呼び出しにもテレメトリのスコープを引き継ぐ
+                        future = executor.submit(contextvars.copy_context().run, self._run_stage, stage)
+                        running[future] = stage
+
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    try:
+                        value, seconds = future.result()
+                    except Exception as e:
+                        print(f"❌ ステージ '{stage.name}' が失敗しました: {e}")
+                        failed[stage.name] = e
+                        continue
+                    self._complete(stage, value, seconds)
+                    print(f"✅ ステージ '{stage.name}' が完了しました ({seconds:.1f}s)。")
+
+        if failed:
+            raise PipelineError(failed)
+        if pending:
+            raise PipelineError({name: StageError("依存先が完了していません") for name in pending})
+        return dict(self.results)
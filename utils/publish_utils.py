@@ -0,0 +1,224 @@
+import os
+import sys
+import errno
+import shutil
+import ctypes
+import tempfile
+import threading
+from contextlib import contextmanager
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# ステージングディレクトリ、入れ替え中に退避する旧ディレクトリ、ロックファイルの接尾辞
+STAGING_SUFFIX = ".staging"
+BACKUP_SUFFIX = ".previous"
+LOCK_SUFFIX = ".lock"
+
+# renameat2(2) のフラグ: 2つのパスを1回のシステムコールで入れ替える (Linux 3.15 以降)
+_AT_FDCWD = -100
+_RENAME_EXCHANGE = 2
+
+# ロックファイルのパス -> {"lock": スレッド用 RLock, "depth": 入れ子の深さ, "file": flock を取ったファイル}
+_DIRECTORY_LOCKS = {}
+_DIRECTORY_LOCKS_GUARD = threading.Lock()
+
+
+def atomic_write_text(path, text, encoding='utf-8'):
+    """
+    同じディレクトリの一時ファイルに書き込んでから rename で置き換える。
+    読み手からは「書き込み前」か「書き込み後」のどちらかのファイルしか見えない。
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{os.path.basename(path)}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding=encoding) as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def _link_or_copy(src, dst):
+    # 書き込みは必ず atomic_write_text (rename による置き換え) で行うため、ハードリンクを共有しても元のファイルは変わらない
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+def acquire_directory_lock(target_dir):
+    """
+    target_dir への書き込み (ステージングの開始から公開まで、または公開中のファイルの直接の書き換え) の
+    排他ロックを <target_dir>.lock の flock で取得する。他のプロセスが保持している間は待機する。
+    同じスレッドからの入れ子の呼び出しでは flock を取り直さない (release_directory_lock と同じ回数だけ呼ぶこと)。
+    """
+    lock_path = os.path.normpath(target_dir) + LOCK_SUFFIX
+    with _DIRECTORY_LOCKS_GUARD:
+        entry = _DIRECTORY_LOCKS.setdefault(lock_path, {"lock": threading.RLock(), "depth": 0, "file": None})
+    entry["lock"].acquire()
+    if entry["depth"] == 0:
+        try:
+            os.makedirs(os.path.dirname(lock_path) or ".", exist_ok=True)
+            lock_file = open(lock_path, "a")
+            if fcntl:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    print(f"⏳ 他のプロセスが書き込み中のため待機しています: {target_dir}")
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+        except BaseException:
+            entry["lock"].release()
+            raise
+        entry["file"] = lock_file
+    entry["depth"] += 1
+
+
+def release_directory_lock(target_dir):
+    """acquire_directory_lock で取得したロックを解放する。"""
+    lock_path = os.path.normpath(target_dir) + LOCK_SUFFIX
+    entry = _DIRECTORY_LOCKS[lock_path]
+    entry["depth"] -= 1
+    if entry["depth"] == 0:
+        lock_file, entry["file"] = entry["file"], None
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+        lock_file.close()
+    entry["lock"].release()
+
+
+@contextmanager
+def directory_lock(target_dir):
+    """
+    with 文の間 target_dir の書き込みロックを保持する。StagedDirectory を使わずに
+    公開中のファイルを直接書き換える場合 (記事の追加など) は、同じロックの中で行うこと。
+    """
+    acquire_directory_lock(target_dir)
+    try:
+        yield
+    finally:
+        release_directory_lock(target_dir)
+
+
+def exchange_paths(path_a, path_b):
+    """
+    path_a と path_b を renameat2(RENAME_EXCHANGE) で原子的に入れ替え、成功すれば True を返す。
+    Linux 以外、glibc が renameat2 を持たない場合、ファイルシステムが対応していない場合は何もせず False を返す。
+    """
+    if not sys.platform.startswith("linux"):
+        return False
+    try:
+        renameat2 = ctypes.CDLL(None, use_errno=True).renameat2
+    except (OSError, AttributeError):
+        return False
+    result = renameat2(_AT_FDCWD, os.fsencode(path_a), _AT_FDCWD, os.fsencode(path_b), _RENAME_EXCHANGE)
+    if result == 0:
+        return True
+    error = ctypes.get_errno()
+    if error in (errno.EINVAL, errno.ENOSYS, errno.EOPNOTSUPP):  # 入れ替えに対応していない
+        return False
+    raise OSError(error, os.strerror(error), path_a, None, path_b)
+
+
+def recover_staged_directory(target_dir):
+    """
+    ディレクトリの入れ替え途中で中断した場合の後始末をする。
+    target_dir が無く退避ディレクトリだけが残っていれば元に戻し、両方あれば退避ディレクトリを削除する。
+    """
+    target_dir = os.path.normpath(target_dir)
+    backup_dir = target_dir + BACKUP_SUFFIX
+    if not os.path.isdir(backup_dir):
+        return
+    if os.path.isdir(target_dir):
+        shutil.rmtree(backup_dir)
+    else:
+        os.rename(backup_dir, target_dir)
+        print(f"♻️ 入れ替え途中で中断したディレクトリを復元しました: {target_dir}")
+
+
+class StagedDirectory:
+    """
+    target_dir への書き込みを兄弟ディレクトリ <target_dir>.staging で行い、publish() で入れ替える。
+    - open() は target_dir の内容をハードリンクで複製したステージングディレクトリを用意する (copy_existing=False なら空)。
+      ステージング内のファイルは必ず atomic_write_text で書き込むこと (上書き open はリンク先の公開中のファイルも変えてしまう)。
+    - publish() は renameat2(RENAME_EXCHANGE) でステージングと target_dir を1回で入れ替え、旧ディレクトリを削除する。
+      公開中のサイトを配信・デプロイしているプロセスからも、target_dir が存在しない瞬間は見えない。
+      入れ替えに対応していない環境 (Linux 以外など) では target_dir → <target_dir>.previous、ステージング → target_dir の
+      2回の rename で入れ替える。この場合は原子的ではなく、2回の rename の間は target_dir が存在しない。
+      2回の rename の間に中断しても、次回の open() (recover_staged_directory) で元に戻る。
+    - resume=True の場合、前回中断して残ったステージングディレクトリを破棄せずに続きから使う (resumed が True になる)。
+      resume=False の場合、残っていたステージングディレクトリは open() で破棄される。
+    - open() から publish() / discard() / release() までの間は target_dir のロック (acquire_directory_lock) を保持する。
+      他のプロセスのステージングを破棄したり、公開中のファイルへの直接の書き込みを入れ替えで失ったりしないため。
+    """
+
+    def __init__(self, target_dir, resume=False, copy_existing=True):
+        self.target_dir = os.path.normpath(target_dir)
+        self.path = self.target_dir + STAGING_SUFFIX
+        self.backup_dir = self.target_dir + BACKUP_SUFFIX
+        self.resume = resume
+        self.copy_existing = copy_existing
+        self.resumed = False
+        self._locked = False
+
+    def open(self):
+        acquire_directory_lock(self.target_dir)
+        self._locked = True
+        try:
+            recover_staged_directory(self.target_dir)
+            if os.path.isdir(self.path):
+                if self.resume:
+                    print(f"♻️ 前回中断したステージングディレクトリから再開します: {self.path}")
+                    self.resumed = True
+                    return self
+                shutil.rmtree(self.path)
+            if self.copy_existing and os.path.isdir(self.target_dir):
+                shutil.copytree(self.target_dir, self.path, copy_function=_link_or_copy)
+            else:
+                os.makedirs(self.path)
+        except BaseException:
+            self.release()
+            raise
+        return self
+
+    def staged_path(self, relative_path):
+        """target_dir からの相対パスを、ステージングディレクトリ内のパスに変換する。"""
+        return os.path.join(self.path, relative_path)
+
+    def publish(self):
+        """ステージングディレクトリを target_dir と入れ替えて公開し、ロックを解放する。"""
+        try:
+            recover_staged_directory(self.target_dir)
+            if os.path.isdir(self.target_dir) and exchange_paths(self.path, self.target_dir):
+                # ステージングのパスに旧ディレクトリが入るので、再開用のステージングと取り違えないよう退避名に変える
+                os.rename(self.path, self.backup_dir)
+            else:
+                # 非原子的なフォールバック: 2回の rename の間は target_dir が存在しない
+                if os.path.isdir(self.target_dir):
+                    os.rename(self.target_dir, self.backup_dir)
+                os.rename(self.path, self.target_dir)
+            if os.path.isdir(self.backup_dir):
+                shutil.rmtree(self.backup_dir)
+        finally:
+            self.release()
+        print(f"📤 公開しました: {self.target_dir}")
+
+    def discard(self):
+        try:
+            if os.path.isdir(self.path):
+                shutil.rmtree(self.path)
+        finally:
+            self.release()
+
+    def release(self):
+        """ステージングディレクトリを残したままロックを解放する (次回 resume=True で再開する場合など)。"""
+        if self._locked:
+            self._locked = False
+            release_directory_lock(self.target_dir)
@@ -0,0 +1,150 @@
+import re
+import json
+import time
+import random
+from email.utils import parsedate_to_datetime
+try:
+    from config import settings
+except ImportError:
+    settings = None
+
+# --- エラー分類 ---
+RATE_LIMIT = "rate_limit"            # 429 / RESOURCE_EXHAUSTED
+SERVER_OVERLOAD = "server_overload"  # 5xx / UNAVAILABLE / 通信エラー
+INVALID_OUTPUT = "invalid_output"    # 応答は返ったが期待した形式ではない (HTML途切れ, 壊れたJSON)
+FATAL = "fatal"                      # 400 / 401 / 403 / 404 など、再試行しても結果が変わらないもの
+
+RETRYABLE_CATEGORIES = (RATE_LIMIT, SERVER_OVERLOAD, INVALID_OUTPUT)
+
+_OVERLOAD_STATUSES = ("UNAVAILABLE", "INTERNAL", "DEADLINE_EXCEEDED")
+_TRANSIENT_ERROR_NAMES = ("ConnectError", "ReadTimeout", "WriteTimeout", "ConnectTimeout",
+                          "PoolTimeout", "RemoteProtocolError", "ReadError")
+
+
+class InvalidOutputError(Exception):
+    """モデルの応答が期待した形式 (完全なHTML, 有効なJSON など) ではなかったことを表す。"""
+
+
+def classify_error(error):
+    """例外を RATE_LIMIT / SERVER_OVERLOAD / INVALID_OUTPUT / FATAL のいずれかに分類する。"""
+    if isinstance(error, (InvalidOutputError, json.JSONDecodeError)):
+        return INVALID_OUTPUT
+    code = getattr(error, 'code', None)
+    status = str(getattr(error, 'status', '') or '')
+    if code == 429 or status == "RESOURCE_EXHAUSTED":
+        return RATE_LIMIT
+    if (isinstance(code, int) and 500 <= code < 600) or status in _OVERLOAD_STATUSES:
+        return SERVER_OVERLOAD
+    if isinstance(error, (ConnectionError, TimeoutError)) or type(error).__name__ in _TRANSIENT_ERROR_NAMES:
+        return SERVER_OVERLOAD
+    return FATAL
+
+
+def _parse_duration(value):
+    """'30s' / '1.5s' / '12' のような表記を秒数に変換する。"""
+    match = re.match(r"^\s*([\d.]+)\s*s?\s*$", str(value))
+    return float(match.group(1)) if match else None
+
+
+def get_retry_after(error):
+    """
+    エラーに含まれるサーバー側の再試行ヒント (秒) を返す。
+    RetryInfo.retryDelay → Retry-After ヘッダー → メッセージ中の "retry in Ns" の順に探す。
+    """
+    details = getattr(error, 'details', None)
+    if isinstance(details, dict):
+        inner = details.get('error', details)
+        for item in inner.get('details', []) if isinstance(inner, dict) else []:
+            if isinstance(item, dict) and str(item.get('@type', '')).endswith('RetryInfo'):
+                delay = _parse_duration(item.get('retryDelay', ''))
+                if delay is not None:
+                    return delay
+
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if headers:
+        retry_after = headers.get('retry-after') or headers.get('Retry-After')
+        if retry_after:
+            delay = _parse_duration(retry_after)
+            if delay is not None:
+                return delay
+            try:
+                return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+            except (TypeError, ValueError):
+                pass
+
+    match = re.search(r"retry in ([\d.]+)\s*s", str(error), re.IGNORECASE)
+    if match:
+        return float(match.group(1))
+    return None
+
+
+class RetryPolicy:
+    """
+    エラー分類ごとの再試行ポリシー。
+    上限付き指数バックオフ + ジッター (equal jitter) で待ち時間を決め、
+    サーバーが再試行までの時間を指定している場合はそれを優先する。
+    FATAL は即座に諦める。
+    """
+
+    # 分類ごとの初回待ち時間の倍率 (レート制限は長めに待つ)
+    CATEGORY_FACTORS = {RATE_LIMIT: 4.0, SERVER_OVERLOAD: 1.0, INVALID_OUTPUT: 0.5}
+
+    def __init__(self, max_attempts=3, base_delay=2.0, max_delay=60.0, jitter=True, categories=RETRYABLE_CATEGORIES):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.categories = tuple(categories)
+
+    @classmethod
+    def from_settings(cls, **overrides):
+        params = {
+            "max_attempts": getattr(settings, 'RETRY_MAX_ATTEMPTS', 3),
+            "base_delay": getattr(settings, 'RETRY_BASE_DELAY', 2.0),
+            "max_delay": getattr(settings, 'RETRY_MAX_DELAY', 60.0),
+        }
+        params.update(overrides)
+        return cls(**params)
+
+    def only(self, *categories):
+        """同じ待ち時間の設定で、categories のエラーだけを再試行するポリシーを返す (入れ子の再試行ループで使う)。"""
+        return RetryPolicy(self.max_attempts, self.base_delay, self.max_delay, self.jitter,
+                           categories=[c for c in categories if c in self.categories])
+
+    def should_retry(self, category, attempt):
+        """attempt 回目 (0始まり) が category で失敗した後、再試行すべきかを返す。"""
+        return category in self.categories and attempt < self.max_attempts - 1
+
+    def compute_delay(self, attempt, category, retry_after=None):
+        """attempt 回目 (0始まり) の失敗後に待つ秒数を返す。"""
+        if retry_after is not None:
+            # サーバー指定の時間は守りつつ、同時に再試行が集中しないよう少しだけずらす
+            delay = min(self.max_delay, retry_after)
+            return delay + (random.uniform(0, min(1.0, delay * 0.1)) if self.jitter else 0)
+        cap = min(self.max_delay, self.base_delay * self.CATEGORY_FACTORS.get(category, 1.0) * (2 ** attempt))
+        if not self.jitter:
+            return cap
+        return cap / 2 + random.uniform(0, cap / 2)
+
+
+def call_with_retry(func, policy=None, label="", on_retry=None):
+    """
+    func(attempt) を policy に従って再試行しながら呼び出し、結果を返す。
+    再試行可能なエラーでは待機してから再実行し、FATAL や試行回数の上限では最後の例外を送出する。
+    on_retry(error, category) を渡すと、待機の前に呼ばれる (APIキーの切り替えなどに使う)。
+    """
+    policy = policy or RetryPolicy.from_settings()
+    for attempt in range(policy.max_attempts):
+        try:
+            return func(attempt)
+        except Exception as e:
+            category = classify_error(e)
+            if not policy.should_retry(category, attempt):
+                raise
+            delay = policy.compute_delay(attempt, category, get_retry_after(e))
+            print(f"  ⏳ {label + ': ' if label else ''}{category} のため {delay:.1f} 秒後に再試行します "
+                  f"({attempt + 2}/{policy.max_attempts}): {e}")
+            if on_retry:
+                on_retry(e, category)
+            time.sleep(delay)
@@ -0,0 +1,150 @@
+import os
+import json
+import time
+import threading
+import contextvars
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from agents.agent_04_improvement import analyze_article_structure, generate_article_purpose
+from utils.telemetry import scope as telemetry_scope
+try:
+    from config import settings
+except ImportError:
+    settings = None
+
+
+def list_html_files(base_dir):
+    """base_dir 以下の HTML ファイルを、実行ごとに変わらない順序 (ディレクトリ・ファイル名順) で返す。"""
+    paths = []
+    for root, dirs, files in os.walk(base_dir):
+        dirs.sort()
+        for filename in sorted(files):
+            if filename.lower().endswith(('.html', '.htm')):
+                paths.append(os.path.join(root, filename))
+    return paths
+
+
+def _file_signature(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _parse_article(path):
+    """プロセスプールで実行する: HTML を解析し (path, 解析結果, シグネチャ) を返す。"""
+    article_data, _ = analyze_article_structure(path)
+    return path, article_data, _file_signature(path)
+
+
+def load_scan_progress(progress_file):
+    """前回中断したスキャンの途中結果 (JSONL) を {file_name: レコード} で返す。壊れた行は無視する。"""
+    records = {}
+    if not os.path.exists(progress_file):
+        return records
+    with open(progress_file, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+                records[record["file_name"]] = record
+            except (ValueError, KeyError, TypeError):
+                continue
+    return records
+
+
+class _ProgressReporter:
+    """完了件数・処理速度・残り時間の目安を、およそ 2% 刻みで表示する。"""
+
+    def __init__(self, total):
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.started = time.perf_counter()
+        self.step = max(1, total // 50)
+        self._lock = threading.Lock()
+
+    def tick(self, label, failed=False):
+        with self._lock:
+            self.done += 1
+            self.failed += int(failed)
+            if self.done % self.step and self.done != self.total:
+                return
+            elapsed = time.perf_counter() - self.started
+            rate = self.done / elapsed if elapsed else 0.0
+            eta = (self.total - self.done) / rate if rate else 0.0
+            print(f"  🔎 [{self.done}/{self.total}] {label} ({rate:.1f} 件/秒, 残り約 {eta:.0f} 秒, 失敗 {self.failed})")
+
+
+def scan_site_articles(client, base_dir, identity, progress_file, created_at, parse_workers=None, llm_workers=None):
+    """
+    計画ファイルが無い場合の AS-IS スキャン。base_dir 以下の全 HTML について、タイトルと戦略的目的 (summary) を求める。
+    - HTML の解析はプロセスプール (parse_workers) で行い、解析が終わったものから
+      最大 llm_workers 並列で generate_article_purpose に回す。
+    - 目的の生成に成功したページは progress_file (JSONL) に逐次追記する。中断後の再実行では、
+      ファイルが変わっていない (mtime とサイズが同じ) ページは LLM を呼ばずに途中結果を再利用する。
+    戻り値は (articles, failed) のタプル。articles は目的を生成できたページだけの、main_02 の計画と同じ形式
+    (file_name, title, summary, created_at, updated_at) のリスト。failed は解析または目的の生成に失敗したページ
+    (base_dir からの相対パス) のリストで、空でなければ progress_file を残して再実行する必要がある。
+    """
+    parse_workers = parse_workers or getattr(settings, 'AS_IS_SCAN_PARSE_WORKERS', None) or os.cpu_count() or 1
+    llm_workers = llm_workers or getattr(settings, 'AS_IS_SCAN_LLM_CONCURRENCY', 4)
+
+    paths = list_html_files(base_dir)
+    rel_paths = {path: os.path.relpath(path, base_dir).replace(os.path.sep, '/') for path in paths}
+    saved = load_scan_progress(progress_file)
+    results = {}
+    pending = []
+    for path in paths:
+        record = saved.get(rel_paths[path])
+        if record and record.get("signature") == _file_signature(path):
+            results[rel_paths[path]] = record
+        else:
+            pending.append(path)
+    print(f"🔎 AS-IS スキャン: {len(paths)} ファイル中 {len(results)} 件は前回の途中結果を再利用し、"
+          f"{len(pending)} 件を解析します (解析 {parse_workers} プロセス, LLM {llm_workers} 並列)。")
+
+    reporter = _ProgressReporter(len(pending))
+    sink_lock = threading.Lock()
+    os.makedirs(os.path.dirname(progress_file) or ".", exist_ok=True)
+
+    with open(progress_file, 'a', encoding='utf-8') as sink:
+        def purpose_task(rel_path, article_data, signature):
+            with telemetry_scope(page=rel_path):
+                summary = generate_article_purpose(client, article_data, identity)
+            record = {
+                "file_name": rel_path,
+                "title": article_data['page_title'],
+                "summary": summary,
+                "created_at": created_at, "updated_at": "",
+                "signature": signature,
+            }
+            failed = summary.startswith("❌")
+            # 失敗した目的は記録せず、次回の再実行で改めて生成する
+            if not failed:
+                with sink_lock:
+                    sink.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    sink.flush()
+            reporter.tick(rel_path, failed=failed)
+            return record, failed
+
+        parse_pool = ProcessPoolExecutor(max_workers=parse_workers) if parse_workers > 1 else ThreadPoolExecutor(max_workers=1)
+        with parse_pool, ThreadPoolExecutor(max_workers=llm_workers) as llm_pool:
+            parse_futures = [parse_pool.submit(_parse_article, path) for path in pending]
+            llm_futures = []
+            for future in as_completed(parse_futures):
+                path, article_data, signature = future.result()
+                if not article_data:
+                    reporter.tick(rel_paths[path], failed=True)
+                    continue
+                # LLM 呼び出しのスレッドにもテレメトリのフェーズを引き継ぐ
+                llm_futures.append(llm_pool.submit(
+                    contextvars.copy_context().run, purpose_task, rel_paths[path], article_data, signature))
+            for future in as_completed(llm_futures):
+                record, failed = future.result()
+                # "❌ ..." のような失敗メッセージを目的として計画に登録しない
+                if not failed:
+                    results[record["file_name"]] = record
+
+    articles = [
+        {key: value for key, value in results[rel_paths[path]].items() if key != "signature"}
+        for path in paths if rel_paths[path] in results
+    ]
+    failed = [rel_paths[path] for path in paths if rel_paths[path] not in results]
+    return articles, failed
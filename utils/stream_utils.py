@@ -0,0 +1,223 @@
+import os
+import re
+import time
+import queue
+import threading
+try:
+    from config import settings
+except ImportError:
+    settings = None
+from utils.client_utils import acquire_client, estimate_request_tokens, response_token_count
+from utils.key_pool import get_key_pool
+from utils.cache_utils import get_response_cache
+from utils.retry_utils import RATE_LIMIT, SERVER_OVERLOAD, call_with_retry, classify_error
+from utils.telemetry import get_telemetry
+
+_END_OF_STREAM = object()
+
+
+class StreamStalledError(TimeoutError):
+    """ストリームが stall_timeout 秒以上チャンクを返さなかったことを表す (SERVER_OVERLOAD として扱われる)。"""
+
+
+class StreamResult:
+    """ストリーミング生成の結果と計測値。"""
+
+    def __init__(self, text="", finish_reason=None, complete=False, stalled=False,
+                 ttfb=None, elapsed=0.0, output_tokens=0, partial_path=None, from_cache=False, usage_metadata=None):
+        self.text = text
+        self.finish_reason = finish_reason
+        self.complete = complete          # complete_marker まで出力されたか
+        self.stalled = stalled            # stall_timeout 秒以上チャンクが届かなかったか
+        self.ttfb = ttfb                  # 最初のテキストが届くまでの秒数
+        self.elapsed = elapsed
+        self.output_tokens = output_tokens
+        self.partial_path = partial_path
+        self.from_cache = from_cache
+        self.usage_metadata = usage_metadata  # 最後のチャンクの usage_metadata
+
+    @property
+    def truncated(self):
+        return not self.complete
+
+    @property
+    def tokens_per_sec(self):
+        generating = self.elapsed - (self.ttfb or 0)
+        return self.output_tokens / generating if generating > 0 else 0.0
+
+    def summary(self):
+        if self.from_cache:
+            return "キャッシュ済み"
+        ttfb = f"{self.ttfb:.1f}s" if self.ttfb is not None else "-"
+        return (f"TTFB {ttfb} / {self.elapsed:.1f}s / {self.output_tokens} tokens / "
+                f"{self.tokens_per_sec:.1f} tok/s / finish={self.finish_reason}")
+
+
+def partial_file_path(name):
+    """ストリーミング中の出力を書き出す一時ファイルのパスを返す。"""
+    safe_name = re.sub(r"[^A-Za-z0-9._-]", "_", name)
+    partial_dir = os.path.join(getattr(settings, 'CACHE_DIR', '.cache'), "partials")
+    os.makedirs(partial_dir, exist_ok=True)
+    return os.path.join(partial_dir, f"{safe_name}.partial")
+
+
+def _finish_reason(chunk):
+    candidates = getattr(chunk, 'candidates', None) or []
+    reason = getattr(candidates[0], 'finish_reason', None) if candidates else None
+    return getattr(reason, 'name', reason)
+
+
+def _close_quietly(stream):
+    """ストリーム (またはそのイテレータ) に close() があれば呼ぶ。別スレッドで読み取り中の場合などの失敗は無視する。"""
+    close = getattr(stream, 'close', None)
+    if close is None:
+        return
+    try:
+        close()
+    except Exception:
+        pass
+
+
+def stream_generate_content(client, model, contents, config=None, partial_path=None,
+                            stall_timeout=None, complete_marker="</html>", use_cache=True, retry_policy=None,
+                            cache_key_parts=None):
+    """
+    generate_content_stream でテキストを受信し、届いたチャンクを partial_path に逐次書き出す。
+    - TTFB・トークン/秒を計測し、stall_timeout 秒チャンクが途切れたら「停止」として打ち切る
+    - 終了理由 (MAX_TOKENS など) が届いた時点で complete_marker が無ければ、その場で途切れとして報告する
+    - 完全な応答は generate_content と同じキーでレスポンスキャッシュに保存される
+    キーは試行ごとに KeyPool から選ぶ (generate_content と同じ)。ストリーム開始前のレート制限・過負荷は
+    retry_policy に従い、失敗したキーを避けて再試行する。
+    cache_key_parts の意味は generate_content と同じ。
+    """
+    stall_timeout = stall_timeout or getattr(settings, 'STREAM_STALL_TIMEOUT', 90)
+    cache = get_response_cache()
+    cache_key = None
+    if use_cache and getattr(settings, 'LLM_CACHE_ENABLED', True):
+        key_contents, key_config = cache_key_parts or (contents, config)
+        cache_key = cache.make_key(model, key_contents, key_config, getattr(settings, 'PROMPT_TEMPLATE_VERSION', None))
+        entry = cache.get(cache_key)
+        if entry is not None:
+            print(f"  💾 キャッシュ済みの応答を使用します ({model}, key={cache_key[:8]})")
+            text = entry["text"]
+            get_telemetry().record(model, "cache_hit", 0.0, usage=entry.get("usage"), stream=True)
+            return StreamResult(text, "STOP", complete_marker in text, from_cache=True)
+
+    pool = get_key_pool()
+    telemetry = get_telemetry()
+    reserved_tokens = estimate_request_tokens(contents)
+    pin = bool(getattr(config, 'cached_content', None))
+    state = {"api_key": None, "exclude": None, "attempt": 0}
+
+    def open_stream(attempt):
+        api_key, active_client = acquire_client(client, reserved_tokens, exclude=state["exclude"], pin=pin)
+        state["api_key"] = api_key
+        state["attempt"] = attempt + 1
+        opened = time.perf_counter()
+        try:
+            stream = active_client.models.generate_content_stream(model=model, contents=contents, config=config)
+            # 最初のチャンクを取り出すまでエラーが表面化しないため、ここで先読みする
+            iterator = iter(stream)
+            first = next(iterator, _END_OF_STREAM)
+        except Exception as e:
+            pool.finish_request(api_key, error=e, reserved_tokens=reserved_tokens)
+            telemetry.record(model, classify_error(e), time.perf_counter() - opened,
+                             api_key=api_key, attempt=attempt + 1, error=e, stream=True)
+            raise
+        return api_key, stream, first, iterator
+
+    def on_retry(error, category):
+        if category in (RATE_LIMIT, SERVER_OVERLOAD) and state["api_key"]:
+            state["exclude"] = [state["api_key"]]
+
+    started = time.time()
+    api_key, stream, first, iterator = call_with_retry(open_stream, policy=retry_policy, label=f"{model} (stream)", on_retry=on_retry)
+
+    # 受信スレッド: ブロッキングするイテレータを読み、キュー経由で渡す (停止検知のため)。
+    # 停止で打ち切った後は stop_reading がセットされ、残りのチャンクを読まずに終了する
+    chunks = queue.Queue()
+    stop_reading = threading.Event()
+
+    def reader():
+        try:
+            if first is not _END_OF_STREAM:
+                chunks.put(first)
+                for chunk in iterator:
+                    if stop_reading.is_set():
+                        break
+                    chunks.put(chunk)
+        except Exception as e:
+            if not stop_reading.is_set():
+                chunks.put(e)
+        finally:
+            chunks.put(_END_OF_STREAM)
+            _close_quietly(iterator)
+
+    threading.Thread(target=reader, daemon=True).start()
+
+    result = StreamResult(partial_path=partial_path)
+    pieces = []
+    last_chunk = None
+    stream_error = None
+    sink = open(partial_path, 'w', encoding='utf-8') if partial_path else None
+    try:
+        while True:
+            try:
+                item = chunks.get(timeout=stall_timeout)
+            except queue.Empty:
+                result.stalled = True
+                stream_error = StreamStalledError(f"ストリームが {stall_timeout} 秒間停止しました")
+                print(f"  ⚠️ ストリームが {stall_timeout} 秒間停止したため打ち切ります。")
+                # 受信スレッドに終了を伝え、接続を閉じて残りの応答を読み続けないようにする
+                stop_reading.set()
+                _close_quietly(stream)
+                break
+            if item is _END_OF_STREAM:
+                break
+            if isinstance(item, Exception):
+                stream_error = item
+                print(f"  ⚠️ ストリーム受信中にエラーが発生しました: {item}")
+                break
+
+            last_chunk = item
+            text = getattr(item, 'text', None) or ""
+            if text:
+                if result.ttfb is None:
+                    result.ttfb = time.time() - started
+                pieces.append(text)
+                if sink:
+                    sink.write(text)
+                    sink.flush()
+
+            reason = _finish_reason(item)
+            if reason:
+                result.finish_reason = reason
+                if complete_marker and complete_marker not in "".join(pieces):
+                    print(f"  ⚠️ 生成が {complete_marker} の前に終了しました (finish_reason={reason})。")
+    finally:
+        if sink:
+            sink.close()
+
+    result.text = "".join(pieces)
+    result.elapsed = time.time() - started
+    result.complete = bool(result.text) and (not complete_marker or complete_marker in result.text)
+    result.usage_metadata = getattr(last_chunk, 'usage_metadata', None)
+    usage_tokens = getattr(result.usage_metadata, 'candidates_token_count', None)
+    # usage_metadata が無い場合は文字数からおおよそのトークン数を見積もる
+    result.output_tokens = usage_tokens or len(result.text) // 3
+
+    pool.finish_request(api_key, tokens=response_token_count(last_chunk) if last_chunk else 0, error=stream_error,
+                        reserved_tokens=reserved_tokens)
+    if result.stalled:
+        outcome = "stalled"
+    elif stream_error is not None:
+        outcome = classify_error(stream_error)
+    else:
+        outcome = "ok" if result.complete else "truncated"
+    telemetry.record(model, outcome, result.elapsed, api_key=api_key, attempt=state["attempt"],
+                     usage=result.usage_metadata, error=stream_error, stream=True,
+                     ttfb=round(result.ttfb, 3) if result.ttfb is not None else None,
+                     finish_reason=result.finish_reason)
+    if cache_key and result.complete and not result.stalled:
+        cache.put(cache_key, {"model": model, "text": result.text, "usage": None})
+    return result
@@ -0,0 +1,250 @@
+import os
+import json
+import time
+import atexit
+import threading
+import contextvars
+from contextlib import contextmanager
+from datetime import datetime
+try:
+    from config import settings
+except ImportError:
+    settings = None
+from utils.key_pool import key_suffix
+
+# 現在のフェーズ・ページ (スレッドごと / タスクごとに独立して保持される)
+_PHASE = contextvars.ContextVar("telemetry_phase", default="-")
+_PAGE = contextvars.ContextVar("telemetry_page", default=None)
+
+@contextmanager
+def scope(phase=None, page=None):
+    """
+    ブロック内の LLM 呼び出しに phase / page を付与する。省略した値は外側のスコープを引き継ぐ。
+    phase を指定した場合はブロック全体の所要時間もフェーズ時間として集計する。
+    """
+    tokens = []
+    if phase is not None:
+        tokens.append((_PHASE, _PHASE.set(phase)))
+    if page is not None:
+        tokens.append((_PAGE, _PAGE.set(page)))
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if phase is not None:
+            get_telemetry().add_phase_time(phase, time.perf_counter() - started)
+        for var, token in reversed(tokens):
+            var.reset(token)
+
+
+def _usage_value(usage, name):
+    if usage is None:
+        return None
+    if isinstance(usage, dict):
+        return usage.get(name)
+    return getattr(usage, name, None)
+
+
+class Telemetry:
+    """
+    LLM 呼び出し1回 (再試行の1試行) ごとのイベントを JSONL に追記し、実行全体の集計を保持する。
+    prometheus_file を指定すると、node_exporter の textfile collector 形式で集計値も書き出す。
+    """
+
+    def __init__(self, trace_file=None, prometheus_file=None, prices=None, enabled=True):
+        self.run_id = datetime.now().strftime("%Y%m%d-%H%M%S") + f"-{os.getpid()}"
+        self.trace_file = trace_file
+        self.prometheus_file = prometheus_file
+        self.prices = prices or {}  # {モデル名: (入力, 出力)} 1M トークンあたりの USD
+        self.enabled = enabled
+        self.started = time.time()
+        self.stats = {}           # (phase, model) -> 集計値
+        self.phase_times = {}     # phase -> 所要時間 (秒)
+        self._lock = threading.Lock()
+        self._sink = None
+
+    def _cost(self, model, prompt_tokens, output_tokens):
+        price_in, price_out = self.prices.get(model, (0.0, 0.0))
+        return (prompt_tokens * price_in + output_tokens * price_out) / 1_000_000
+
+    def record(self, model, outcome, latency, api_key=None, attempt=None, usage=None, error=None, **extra):
+        """
+        LLM 呼び出しのイベントを1件記録する。outcome は "ok" / "cache_hit" / 再試行カテゴリ名 など。
+        usage には usage_metadata (オブジェクトまたは辞書) を渡す。
+        """
+        if not self.enabled:
+            return
+        prompt_tokens = _usage_value(usage, 'prompt_token_count') or 0
+        output_tokens = _usage_value(usage, 'candidates_token_count') or 0
+        cached_tokens = _usage_value(usage, 'cached_content_token_count') or 0
+        billed = outcome != "cache_hit"
+        cost = self._cost(model, prompt_tokens, output_tokens) if billed else 0.0
+        event = {
+            "ts": datetime.now().isoformat(timespec="milliseconds"),
+            "run_id": self.run_id,
+            "phase": _PHASE.get(),
+            "page": _PAGE.get(),
+            "model": model,
+            "key": key_suffix(api_key) if api_key else None,
+            "attempt": attempt,
+            "outcome": outcome,
+            "latency": round(latency, 3),
+            "prompt_tokens": prompt_tokens,
+            "output_tokens": output_tokens,
+            "cached_tokens": cached_tokens,
+            "cost_usd": round(cost, 6),
+        }
+        if error is not None:
+            event["error"] = str(error)[:300]
+        event.update(extra)
+
+        with self._lock:
+            stat = self.stats.setdefault((event["phase"], model), {
+                "calls": 0, "errors": 0, "retries": 0, "cache_hits": 0, "latency": 0.0,
+                "prompt_tokens": 0, "output_tokens": 0, "cached_tokens": 0, "cost_usd": 0.0,
+                "outcomes": {},
+            })
+            stat["calls"] += 1
+            stat["outcomes"][outcome] = stat["outcomes"].get(outcome, 0) + 1
+            if outcome == "cache_hit":
+                stat["cache_hits"] += 1
+            elif outcome != "ok":
+                stat["errors"] += 1
+            if attempt and attempt > 1:
+                stat["retries"] += 1
+            if billed:
+                stat["latency"] += latency
+                stat["prompt_tokens"] += prompt_tokens
+                stat["output_tokens"] += output_tokens
+                stat["cached_tokens"] += cached_tokens
+                stat["cost_usd"] += cost
+            self._write(event)
+
+    def add_phase_time(self, phase, seconds):
+        with self._lock:
+            self.phase_times[phase] = self.phase_times.get(phase, 0.0) + seconds
+
+    def _write(self, event):
+        if not self.trace_file:
+            return
+        try:
+            if self._sink is None:
+                os.makedirs(os.path.dirname(self.trace_file) or ".", exist_ok=True)
+                self._sink = open(self.trace_file, 'a', encoding='utf-8')
+            self._sink.write(json.dumps(event, ensure_ascii=False) + "\n")
+            self._sink.flush()
+        except OSError as e:
+            print(f"⚠️ テレメトリの書き込みに失敗しました (以降は記録しません): {e}")
+            self.trace_file = None
+
+    def write_prometheus(self, path=None):
+        """集計値を Prometheus の textfile 形式で書き出す (一時ファイル経由で置き換える)。"""
+        path = path or self.prometheus_file
+        if not path:
+            return
+        lines = [
+            "# HELP mysitegen_llm_requests_total LLM calls by phase, model and outcome.",
+            "# TYPE mysitegen_llm_requests_total counter",
+        ]
+        with self._lock:
+            stats = {k: dict(v, outcomes=dict(v["outcomes"])) for k, v in self.stats.items()}
+        for (phase, model), stat in sorted(stats.items()):
+            for outcome, count in sorted(stat["outcomes"].items()):
+                lines.append(f'mysitegen_llm_requests_total{{phase="{phase}",model="{model}",outcome="{outcome}"}} {count}')
+        lines += ["# HELP mysitegen_llm_tokens_total Tokens by phase, model and kind.",
+                  "# TYPE mysitegen_llm_tokens_total counter"]
+        for (phase, model), stat in sorted(stats.items()):
+            for kind in ("prompt", "output", "cached"):
+                lines.append(f'mysitegen_llm_tokens_total{{phase="{phase}",model="{model}",kind="{kind}"}} {stat[kind + "_tokens"]}')
+        lines += ["# HELP mysitegen_llm_latency_seconds_sum Total LLM latency by phase and model.",
+                  "# TYPE mysitegen_llm_latency_seconds_sum counter"]
+        for (phase, model), stat in sorted(stats.items()):
+            lines.append(f'mysitegen_llm_latency_seconds_sum{{phase="{phase}",model="{model}"}} {stat["latency"]:.3f}')
+        lines += ["# HELP mysitegen_llm_cost_usd_total Estimated LLM cost in USD.",
+                  "# TYPE mysitegen_llm_cost_usd_total counter"]
+        for (phase, model), stat in sorted(stats.items()):
+            lines.append(f'mysitegen_llm_cost_usd_total{{phase="{phase}",model="{model}"}} {stat["cost_usd"]:.6f}')
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write("\n".join(lines) + "\n")
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️ Prometheus テキストファイルの書き込みに失敗しました: {e}")
+
+    def summary(self):
+        """フェーズ・モデル別の集計を、所要時間の長い順に並べた行のリストで返す。"""
+        with self._lock:
+            rows = sorted(self.stats.items(), key=lambda item: item[1]["latency"], reverse=True)
+            phase_times = dict(self.phase_times)
+        lines = [f"{'phase':<24} {'model':<24} {'calls':>5} {'err':>4} {'retry':>5} {'hit':>4} "
+                 f"{'latency':>9} {'in_tok':>9} {'out_tok':>9} {'usd':>8}"]
+        total = {"calls": 0, "latency": 0.0, "prompt_tokens": 0, "output_tokens": 0, "cost_usd": 0.0}
+        for (phase, model), s in rows:
+            lines.append(f"{phase[:24]:<24} {model[:24]:<24} {s['calls']:>5} {s['errors']:>4} {s['retries']:>5} "
+                         f"{s['cache_hits']:>4} {s['latency']:>8.1f}s {s['prompt_tokens']:>9} {s['output_tokens']:>9} "
+                         f"{s['cost_usd']:>8.4f}")
+            for key in total:
+                total[key] += s[key]
+        lines.append(f"{'合計':<48} {total['calls']:>5} {'':>4} {'':>5} {'':>4} {total['latency']:>8.1f}s "
+                     f"{total['prompt_tokens']:>9} {total['output_tokens']:>9} {total['cost_usd']:>8.4f}")
+        if phase_times:
+            lines.append("フェーズ別の所要時間: " + ", ".join(
+                f"{phase} {seconds:.1f}s" for phase, seconds in sorted(phase_times.items(), key=lambda i: -i[1])))
+        lines.append(f"実行時間: {time.time() - self.started:.1f}s")
+        return lines
+
+    def close(self):
+        """実行の終わりに集計を表示し、Prometheus ファイルを更新してトレースを閉じる。"""
+        if not self.stats:
+            return
+        print(f"\n--- 📈 LLM テレメトリ (run {self.run_id}) ---")
+        for line in self.summary():
+            print(line)
+        if self.trace_file:
+            print(f"  トレース: {self.trace_file}")
+        self.write_prometheus()
+        with self._lock:
+            if self._sink:
+                self._sink.close()
+                self._sink = None
+
+
+_TELEMETRY = None
+_TELEMETRY_LOCK = threading.Lock()
+
+
+def get_telemetry():
+    """settings (TELEMETRY_*) から作成したプロセス共通の Telemetry を返す。終了時に集計を表示する。"""
+    global _TELEMETRY
+    with _TELEMETRY_LOCK:
+        if _TELEMETRY is None:
+            trace_dir = getattr(settings, 'TELEMETRY_DIR', None) or os.path.join(
+                getattr(settings, 'CACHE_DIR', '.cache'), "telemetry")
+            telemetry = Telemetry(
+                prometheus_file=getattr(settings, 'TELEMETRY_PROMETHEUS_FILE', None),
+                prices=dict(getattr(settings, 'MODEL_PRICES', {})),
+                enabled=getattr(settings, 'TELEMETRY_ENABLED', True),
+            )
+            telemetry.trace_file = os.path.join(trace_dir, f"{telemetry.run_id}.jsonl")
+            atexit.register(telemetry.close)
+            _TELEMETRY = telemetry
+        return _TELEMETRY
+
+
+def traced_generate_content(client, model, contents, config=None):
+    """
+    client.models.generate_content を1回だけ呼び、テレメトリに記録する (キャッシュ・再試行なし)。
+    utils.client_utils を import できない環境 (run_x_bot_bridge.py など) 向け。
+    """
+    api_key = getattr(getattr(client, '_api_client', None), 'api_key', None)
+    started = time.perf_counter()
+    try:
+        response = client.models.generate_content(model=model, contents=contents, config=config)
+    except Exception as e:
+        get_telemetry().record(model, "error", time.perf_counter() - started, api_key=api_key, attempt=1, error=e)
+        raise
+    get_telemetry().record(model, "ok", time.perf_counter() - started, api_key=api_key, attempt=1,
+                           usage=getattr(response, 'usage_metadata', None))
+    return response